@@ -30,6 +30,8 @@ export function useChat({ apiBase, isSignedIn, userId }: Opts) {
   ]);
   const [convos, setConvos] = useState<ConversationRow[]>([]);
   const sending = useRef(false);
+  // Local conversation id -> server-issued session id; requests with a session carry only the new message
+  const serverSessions = useRef(new Map<string, string>());
 
   const hasStarted = messages.length > 1;
 
@@ -112,14 +114,24 @@ export function useChat({ apiBase, isSignedIn, userId }: Opts) {
     if (currentConv) persist(userMsg, currentConv);
 
     try {
-      const history = [...messages.filter((m) => !m.loading).slice(-10), userMsg].map((m) => ({
-        role: m.role, content: m.content,
-      }));
+      // Server-issued session id for this chat, if the server has one open
+      const sessionId = currentConv ? serverSessions.current.get(currentConv) : undefined;
+      const hasSession = !!sessionId;
+      // First turn (only the greeting so far): no history, so the server skips the condense call
+      const isFirstTurn = !messages.some((m) => m.role === "user");
+      const history = hasSession || isFirstTurn
+        ? []
+        : [...messages.filter((m) => !m.loading).slice(-10), userMsg].map((m) => ({
+            role: m.role, content: m.content,
+          }));
 
       const res = await fetch(`${base}/chat`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ message: trimmed, history, top_k: 6 }),
+        body: JSON.stringify({
+          message: trimmed, history, top_k: 6,
+          ...(sessionId ? { conversation_id: sessionId } : { start_session: !!currentConv }),
+        }),
       });
 
       let reply = "Sorry, I'm not sure.";
@@ -128,6 +140,12 @@ export function useChat({ apiBase, isSignedIn, userId }: Opts) {
         const data = await res.json();
         reply = data?.reply ?? reply;
         sources = data?.sources ?? [];
+        if (currentConv) {
+          // No conversation_id back means the server has no session (expired, or sessions off):
+          // send the full history again from the next turn on
+          if (data?.conversation_id) serverSessions.current.set(currentConv, data.conversation_id);
+          else serverSessions.current.delete(currentConv);
+        }
       } else {
         reply = "Network error—please try again.";
       }
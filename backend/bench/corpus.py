@@ -0,0 +1,47 @@
+from __future__ import annotations
+import random
+from typing import Dict, Any, List
+
+TOPICS = [
+    ("Arrival", "Graduates should arrive at {place} by {time}. Bring your ticket and photo ID."),
+    ("Parking", "Guest parking is available at {place} lot {n}. Parking opens at {time}."),
+    ("Tickets", "Each graduate receives {n} guest tickets with a QR code sent by email."),
+    ("Directions", "Take the 7 train to {place}. Shuttle buses run every {n} minutes from {time}."),
+    ("Accessibility", "Accessible seating is near gate {n} at {place}. Request it before {time}."),
+    ("Regalia", "Caps and gowns are picked up at {place} until {time}. Tassels are included."),
+    ("Weather", "The ceremony is held rain or shine at {place}. Gates open at {time}."),
+]
+PLACES = ["Citi Field", "the Quad", "Colden Auditorium", "FitzGerald Gym", "Kissena Blvd gate"]
+TIMES = ["8:00 AM", "8:30 AM", "9:00 AM", "9:30 AM", "10:00 AM"]
+
+def make_section(rng: random.Random, i: int) -> Dict[str, str]:
+    title, tmpl = TOPICS[i % len(TOPICS)]
+    sentences = [
+        tmpl.format(place=rng.choice(PLACES), time=rng.choice(TIMES), n=rng.randint(1, 12))
+        for _ in range(rng.randint(3, 12))
+    ]
+    return {"title": f"{title} {i}", "text": " ".join(sentences)}
+
+def make_page(rng: random.Random, n: int, sections: int) -> Dict[str, Any]:
+    return {
+        "url": f"https://bench.local/ce/page-{n}/",
+        "page_title": f"Commencement page {n}",
+        "sections": [make_section(rng, n * sections + j) for j in range(sections)],
+    }
+
+def make_corpus(pages: int, sections_per_page: int = 8, seed: int = 7) -> List[Dict[str, Any]]:
+    """Synthetic pages in the DiskCache record format."""
+    rng = random.Random(seed)
+    return [make_page(rng, n, sections_per_page) for n in range(pages)]
+
+def make_questions(count: int, seed: int = 11) -> List[str]:
+    rng = random.Random(seed)
+    forms = [
+        "Where is {t} information for {p}?",
+        "What time should I know about {t} at {p}?",
+        "How does {t} work near {p}?",
+    ]
+    return [
+        rng.choice(forms).format(t=rng.choice(TOPICS)[0].lower(), p=rng.choice(PLACES)) + f" #{i}"
+        for i in range(count)
+    ]
@@ -0,0 +1,92 @@
+from __future__ import annotations
+import asyncio, hashlib, math, time
+from typing import Any, List
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+class _Resp:
+    def __init__(self, text: str):
+        self.text = text
+
+class _Stream:
+    def __init__(self, pieces: List[str], delay_s: float):
+        self.pieces = pieces
+        self.delay_s = delay_s
+
+    def __aiter__(self):
+        return self._gen()
+
+    async def _gen(self):
+        for p in self.pieces:
+            await asyncio.sleep(self.delay_s)
+            yield _Resp(p)
+
+class FakeLLM:
+    """
+    Stand-in for `genai.GenerativeModel`: deterministic answers after a fixed latency.
+    Streams `tokens` pieces spread over the same latency.
+    """
+    def __init__(self, latency_s: float = 0.3, first_token_s: float = 0.05, tokens: int = 20):
+        self.latency_s = latency_s
+        self.first_token_s = first_token_s
+        self.tokens = tokens
+        self.calls = 0
+
+    def _answer(self, prompt: str) -> str:
+        h = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        return " ".join(f"word{h}{i}" for i in range(self.tokens))
+
+    def generate_content(self, prompt: str, **_: Any) -> _Resp:
+        self.calls += 1
+        time.sleep(self.latency_s)
+        return _Resp(self._answer(prompt))
+
+    async def generate_content_async(self, prompt: str, stream: bool = False, **_: Any):
+        self.calls += 1
+        if stream:
+            await asyncio.sleep(self.first_token_s)
+            pieces = [w + " " for w in self._answer(prompt).split()]
+            return _Stream(pieces, max(0.0, self.latency_s - self.first_token_s) / max(1, len(pieces)))
+        await asyncio.sleep(self.latency_s)
+        return _Resp(self._answer(prompt))
+
+def hash_vector(text: str, dim: int) -> List[float]:
+    """Deterministic unit vector from bag-of-words hashing (similar texts -> similar vectors)."""
+    vec = [0.0] * dim
+    for word in (text or "").lower().split():
+        h = int.from_bytes(hashlib.md5(word.encode("utf-8")).digest()[:8], "little")
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+class FakeEmbedding(BaseEmbedding):
+    """Offline embedding model with a configurable per-call latency."""
+    dim: int = 256
+    latency_s: float = 0.02
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        time.sleep(self.latency_s)
+        return hash_vector(query, self.dim)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        time.sleep(self.latency_s)
+        return hash_vector(text, self.dim)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency_s)
+        return [hash_vector(t, self.dim) for t in texts]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        await asyncio.sleep(self.latency_s)
+        return hash_vector(query, self.dim)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        await asyncio.sleep(self.latency_s)
+        return hash_vector(text, self.dim)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency_s)
+        return [hash_vector(t, self.dim) for t in texts]
@@ -0,0 +1,100 @@
+from __future__ import annotations
+import hashlib, html, random, re, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+from bench.corpus import make_page
+
+PAGE_RE = re.compile(r"^/ce/page-(\d+)/?$")
+
+def render_divi_page(n: int, total: int, sections: int = 8, seed: int = 7) -> str:
+    """A page shaped like the QC Divi theme: text-inner blocks, toggles, links to other pages."""
+    page = make_page(random.Random(seed + n), n, sections)
+    half = sections // 2
+    blocks = []
+    for sec in page["sections"][:half]:
+        blocks.append(
+            '<div class="et_pb_module et_pb_text"><div class="et_pb_text_inner">'
+            f"<h3>{html.escape(sec['title'])}</h3><p>{html.escape(sec['text'])}</p>"
+            "<ul><li>Bring your ticket</li><li>Arrive early</li></ul></div></div>"
+        )
+    for i, sec in enumerate(page["sections"][half:]):
+        blocks.append(
+            f'<div class="et_pb_module et_pb_toggle et_pb_toggle_{i} et_pb_toggle_item et_pb_toggle_close">'
+            f'<h5 class="et_pb_toggle_title">{html.escape(sec["title"])}</h5>'
+            f'<div class="et_pb_toggle_content clearfix"><p>{html.escape(sec["text"])}</p></div></div>'
+        )
+    links = "".join(
+        f'<li><a href="/ce/page-{(n * 3 + k) % total}/">Page {(n * 3 + k) % total}</a></li>' for k in range(1, 4)
+    )
+    blocks.append(f'<div class="et_pb_module et_pb_text"><div class="et_pb_text_inner"><h4>See also</h4><ul>{links}</ul></div></div>')
+    return (
+        f"<!DOCTYPE html><html><head><title>{html.escape(page['page_title'])}</title>"
+        "<script>var tracking = 1;</script></head><body><header>Queens College</header>"
+        f"<div id=\"main-content\">{''.join(blocks)}</div>"
+        "<footer><div class=\"et_pb_text_inner\">© Copyright 2025 Queens College 65-30 Kissena Blvd</div></footer>"
+        "</body></html>"
+    )
+
+class FixtureServer:
+    """Local HTTP server for /ce/page-N/ pages, with ETag revalidation. Use as a context manager."""
+    def __init__(self, pages: int = 100, sections: int = 8):
+        self.pages = pages
+        self.sections = sections
+        self._cache: Dict[int, bytes] = {}
+        self.requests = 0
+        self.not_modified = 0
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                fixture.requests += 1
+                m = PAGE_RE.match(self.path)
+                if not m or int(m.group(1)) >= fixture.pages:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = fixture.body(int(m.group(1)))
+                etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    fixture.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def body(self, n: int) -> bytes:
+        if n not in self._cache:
+            self._cache[n] = render_divi_page(n, self.pages, self.sections).encode("utf-8")
+        return self._cache[n]
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def urls(self):
+        return [f"{self.base_url}/ce/page-{n}/" for n in range(self.pages)]
+
+    def __enter__(self) -> "FixtureServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,221 @@
+"""
+Offline benchmarks for the scraper, page cache, indexer and /chat.
+
+Gemini is replaced by deterministic fakes with configurable latency, Chroma runs
+locally in a temp directory, and pages are served by a local Divi-style fixture
+server, so this runs on an offline box:
+
+    cd backend
+    python -m bench.run                          # all suites
+    python -m bench.run chat --concurrency 64 --requests 500 --llm-latency 0.5
+    python -m bench.run cache scrape --pages 500 --json bench.json
+"""
+from __future__ import annotations
+import argparse, asyncio, contextlib, io, json, os, random, statistics, sys, tempfile, time
+from pathlib import Path
+from typing import Dict, List
+
+# settings.py reads these at import time; keep everything local and offline
+os.environ.setdefault("GEMINI_API_KEY", "offline-bench")
+os.environ.setdefault("GEMINI_EMBED_MODEL", "fake-embedding")
+os.environ.setdefault("GEMINI_CHAT_MODEL", "fake-llm")
+os.environ.setdefault("EMBED_BATCH_SIZE", "96")
+os.environ.setdefault("CHUNK_MAX_CHARS", "1200")
+os.environ.setdefault("CHUNK_OVERLAP", "150")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+SUITES = ("cache", "scrape", "index", "chat")
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    xs = sorted(samples)
+    def pct(p: float) -> float:
+        return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+    return {"p50": pct(50), "p95": pct(95), "p99": pct(99), "mean": statistics.fmean(xs), "max": xs[-1]}
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+# Suites
+
+def bench_cache(args) -> Dict[str, float]:
+    from rag.cache import DiskCache
+    from bench.corpus import make_corpus
+
+    corpus = make_corpus(args.pages, args.sections)
+    cache = DiskCache(Path("bench_cache"))
+    t0 = time.perf_counter()
+    for rec in corpus:
+        cache.put(dict(rec))
+    put_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with cache.batch():
+        for rec in corpus:
+            cache.put(dict(rec, url=rec["url"] + "batched"))
+    batch_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    n = sum(1 for _ in cache.iter_all())
+    list_s = time.perf_counter() - t0
+
+    urls = [r["url"] for r in corpus]
+    t0 = time.perf_counter()
+    for u in random.Random(3).choices(urls, k=len(urls)):
+        cache.get(u)
+    get_s = time.perf_counter() - t0
+    cache.close()
+    return {
+        "put_per_s": len(corpus) / put_s,
+        "batched_put_per_s": len(corpus) / batch_s,
+        "iter_all_pages_per_s": n / list_s,
+        "get_per_s": len(corpus) / get_s,
+    }
+
+def bench_scrape(args) -> Dict[str, float]:
+    import scraper
+    from rag.cache import DiskCache
+    from bench.fixture_server import FixtureServer
+
+    with FixtureServer(pages=args.pages, sections=args.sections) as site:
+        cache = DiskCache(Path("bench_scrape"))
+        limiter = scraper.HostLimiter(concurrency=args.scrape_concurrency, delay_s=0.0)
+        t0 = time.perf_counter()
+        with quiet():
+            asyncio.run(scraper.async_main(site.urls(), revalidate=False, limiter=limiter, cache=cache))
+        cold_s = time.perf_counter() - t0
+
+        limiter = scraper.HostLimiter(concurrency=args.scrape_concurrency, delay_s=0.0)
+        t0 = time.perf_counter()
+        with quiet():
+            asyncio.run(scraper.async_main(site.urls(), revalidate=True, limiter=limiter, cache=cache))
+        warm_s = time.perf_counter() - t0
+        not_modified = site.not_modified
+    cache.close()
+    return {
+        "pages": args.pages,
+        "cold_pages_per_s": args.pages / cold_s,
+        "revalidate_pages_per_s": args.pages / warm_s,
+        "not_modified": not_modified,
+    }
+
+def build_index(args) -> Dict[str, float]:
+    import build_index_llama
+    from rag.cache import DiskCache
+    from bench.corpus import make_corpus
+    from bench.fakes import FakeEmbedding
+
+    build_index_llama.GoogleGenAIEmbedding = lambda **kw: FakeEmbedding(
+        latency_s=args.embed_latency, embed_batch_size=kw.get("embed_batch_size", 96)
+    )
+    cache = DiskCache(Path("cache"))
+    with cache.batch():
+        for rec in make_corpus(args.pages, args.sections):
+            cache.put(rec)
+
+    t0 = time.perf_counter()
+    with quiet():
+        build_index_llama.main(reindex_all=True)
+    full_s = time.perf_counter() - t0
+
+    # One edited page: only its changed chunks should be re-embedded
+    page = cache.get(make_corpus(1, args.sections)[0]["url"])
+    page["sections"][0]["text"] += " Updated for this year."
+    cache.put({k: v for k, v in page.items() if k != "fetched_at"})
+    t0 = time.perf_counter()
+    with quiet():
+        build_index_llama.main()
+    incr_s = time.perf_counter() - t0
+    cache.close()
+    return {"full_build_s": full_s, "one_page_rebuild_s": incr_s}
+
+def bench_index(args) -> Dict[str, float]:
+    return build_index(args)
+
+def bench_chat(args, index_ready: bool) -> Dict[str, float]:
+    if not index_ready:
+        build_index(args)
+
+    import httpx
+    from llama_index.core import Settings
+    from bench.corpus import make_questions
+    from bench.fakes import FakeEmbedding, FakeLLM
+    import rag.core as core
+
+    llm = FakeLLM(latency_s=args.llm_latency)
+    core.LLM = llm
+    core.EMBED_MODEL = Settings.embed_model = FakeEmbedding(latency_s=args.embed_latency)
+    import server
+
+    uniq = make_questions(max(1, int(args.requests * (1 - args.repeat_ratio))))
+    rng = random.Random(5)
+    questions = [uniq[i] if i < len(uniq) else rng.choice(uniq) for i in range(args.requests)]
+    rng.shuffle(questions)
+
+    async def run() -> List[float]:
+        latencies: List[float] = []
+        sem = asyncio.Semaphore(args.concurrency)
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            async def one(q: str):
+                async with sem:
+                    t0 = time.perf_counter()
+                    r = await client.post("/chat", json={"message": q})
+                    r.raise_for_status()
+                    latencies.append(time.perf_counter() - t0)
+            await asyncio.gather(*(one(q) for q in questions))
+        return latencies
+
+    t0 = time.perf_counter()
+    lat = asyncio.run(run())
+    wall = time.perf_counter() - t0
+    out = {f"latency_{k}_ms": v * 1000 for k, v in percentiles(lat).items()}
+    out.update({"requests_per_s": len(lat) / wall, "llm_calls": llm.calls, "concurrency": args.concurrency})
+    return out
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Offline benchmark suite")
+    ap.add_argument("suites", nargs="*", help=f"subset of {', '.join(SUITES)} (default: all)")
+    ap.add_argument("--pages", type=int, default=200, help="synthetic pages (cache/scrape/index)")
+    ap.add_argument("--sections", type=int, default=8, help="sections per page")
+    ap.add_argument("--scrape-concurrency", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=200, help="/chat requests")
+    ap.add_argument("--concurrency", type=int, default=32, help="concurrent /chat clients")
+    ap.add_argument("--repeat-ratio", type=float, default=0.0, help="fraction of repeated questions")
+    ap.add_argument("--llm-latency", type=float, default=0.3, help="fake LLM seconds per call")
+    ap.add_argument("--embed-latency", type=float, default=0.02, help="fake embedding seconds per call")
+    ap.add_argument("--workdir", help="keep artifacts here instead of a temp dir")
+    ap.add_argument("--json", help="also write results to this file")
+    args = ap.parse_args(argv)
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        ap.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+    suites = [s for s in SUITES if s in (args.suites or SUITES)]
+
+    json_path = Path(args.json).resolve() if args.json else None
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="qc-bench-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir)  # cache/ and vectorstore/ are relative paths in settings
+
+    results: Dict[str, Dict[str, float]] = {}
+    for suite in suites:
+        t0 = time.perf_counter()
+        if suite == "chat":
+            results[suite] = bench_chat(args, index_ready="index" in results)
+        else:
+            results[suite] = globals()[f"bench_{suite}"](args)
+        print(f"\n[{suite}]  ({time.perf_counter() - t0:.1f}s)")
+        for k, v in results[suite].items():
+            print(f"  {k:<26} {v:>12.2f}" if isinstance(v, float) else f"  {k:<26} {v:>12}")
+
+    print(f"\nArtifacts in {workdir}")
+    if json_path:
+        json_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
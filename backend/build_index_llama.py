@@ -1,16 +1,29 @@
 from __future__ import annotations
-import sys, json
+import asyncio, itertools, sys, json, time
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Any, Iterable
+from typing import Dict, Any, Iterable, List, Set
 import chromadb
-from llama_index.core import StorageContext, VectorStoreIndex
-from llama_index.core.ingestion import IngestionPipeline
-from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core import QueryBundle
+from llama_index.core.schema import BaseNode
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
 from settings import settings
+from constants import DEFAULT_FAMILY, FAQ_URL_MARKERS, PAGE_FAMILIES
+from schemas import ChatRequest, ChatResponse
 from rag.cache import DiskCache
-from rag.documents import pages_to_documents
+from rag.dedup import NearDuplicateFilter
+from rag.documents import EMBED_TEXT_VERSION, pages_to_documents
+from rag.embed_cache import EmbeddingCache
+from rag.faq import FAQIndex, build_faq_entries, faq_path, faq_questions, load_question_file, state_fingerprint
+from rag.indexing import chunk_documents, embed_and_store
+from rag.lexical import BM25Index, lexical_index_path
+from rag.registry import IndexRegistry
+from rag.routing import centroid, load_partitions, page_family, partition_name, partitions_path, save_partitions
+from rag.snapshot import VectorSnapshot, export_snapshot, snapshot_dir
+
+# Collection metadata recording what the stored vectors embed
+EMBED_TEXT_META = {"embed_text": EMBED_TEXT_VERSION}
 
 def load_index_state(path: Path) -> Dict[str, str]:
     if not path.exists():
@@ -24,86 +37,404 @@ def save_index_state(path: Path, state: Dict[str, str]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     path.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
 
-def pages_needing_index(cache: DiskCache, state: Dict[str, str]) -> Iterable[Dict[str, Any]]:
-    for page in cache.list_all():
+def publish_generation(path: Path) -> None:
+    """Start a new index generation: servers reload artifacts and drop answers cached for the old one."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(str(time.time_ns()), encoding="utf-8")
+    tmp.replace(path)
+
+def pages_needing_index(pages: Iterable[Dict[str, Any]], state: Dict[str, str]) -> Iterable[Dict[str, Any]]:
+    """Pages whose kept sections changed since they were indexed (state maps url -> index_key)."""
+    for page in pages:
         url = page.get("url")
-        sha = page.get("content_sha1")
-        if not url or not sha:
+        if not url or not page.get("content_sha1"):
             continue
-        if state.get(url) == sha:
+        if state.get(url) == page["index_key"]:
             continue
         yield page
 
-def main(reindex_all: bool = False, collection_name: str | None = None) -> int:
-    if not settings.google_api_key:
-        print("ERROR: GEMINI_API_KEY is not set in your environment.")
-        return 2
+def existing_chunk_ids(chroma_col, url: str) -> Set[str]:
+    got = chroma_col.get(where={"url": url}, include=[])
+    return set(got.get("ids") or [])
 
-    cache = DiskCache(Path("cache"))
-    state_path = settings.index_state_path
-    state = {} if reindex_all else load_index_state(state_path)
+def build_faq(cache: DiskCache, client, colname: str, embed_model) -> int:
+    """
+    Answer the FAQ page's questions and the configured extra questions against the freshly built
+    index, and store them with their embeddings; the server serves close matches without the LLM.
+    """
+    from rag.core import agenerate_text, build_prompt, unique_sources  # Gemini client, only needed here
 
-    pages = list(cache.list_all() if reindex_all else pages_needing_index(cache, state))
-    if not pages:
-        print("Nothing to index (all up to date).")
+    questions = faq_questions(cache.iter_all(), FAQ_URL_MARKERS, load_question_file(settings.faq_questions_path))
+    if not questions:
+        print("FAQ: no questions found.")
         return 0
+    registry = IndexRegistry(
+        client_fn=lambda: client,
+        generation_fn=lambda: "build",
+        lexical_path_fn=lambda name: lexical_index_path(settings.chroma_path, name),
+        embed_model_fn=lambda: embed_model,
+    )
+    top_k = ChatRequest.model_fields["top_k"].default
 
-    print(f"Pages to index: {len(pages)}")
+    async def answer(question: str, emb: List[float]) -> ChatResponse | None:
+        nodes = registry.retrieve_many(colname, [QueryBundle(query_str=question, embedding=emb)], top_k)[0]
+        if not nodes:
+            return None
+        text = (await agenerate_text(build_prompt(nodes, question), stage="faq")).strip()
+        if not text or text.lower().startswith("i am not sure"):
+            return None
+        return ChatResponse(reply=text, sources=unique_sources(nodes, max_items=3))
 
-    # Converts cached pages into LlamaIndex Documents (one per section)
-    documents = pages_to_documents(pages)
-    print(f"Prepared {len(documents)} documents (one per section).")
+    entries = asyncio.run(build_faq_entries(questions, embed_model.aget_query_embedding, answer))
+    path = faq_path(settings.chroma_path, colname)
+    FAQIndex(entries, state_sha1=state_fingerprint(settings.index_generation_path)).save(path)
+    print(f"FAQ: answered {len(entries)}/{len(questions)} questions → {path}")
+    return len(entries)
 
-    # Chunking
-    splitter = SentenceSplitter(
-        separator=" ",
-        chunk_size=settings.chunk_max_chars,
-        chunk_overlap=settings.chunk_overlap,
-    )
-    pipeline = IngestionPipeline(transformations=[splitter])
+@dataclass
+class IndexTotals:
+    pages: int = 0
+    documents: int = 0
+    nodes: int = 0
+    new: int = 0
+    stale: int = 0
+    cached: int = 0
+    embedded: int = 0
+    retries: int = 0
 
-    nodes = pipeline.run(
-        documents=documents,
-        in_place=False,
-        show_progress=True,
-    )
-    print(f"Produced {len(nodes)} nodes (chunks).")
+class FanOutStore:
+    """
+    Vector store handed to embed_and_store: each embedded chunk is added to the main collection
+    and/or its page family's partition, whichever doesn't hold it yet.
+    """
+    def __init__(self, main: ChromaVectorStore, main_ids: Set[str], partitions: Dict[str, ChromaVectorStore], partition_ids: Dict[str, Set[str]]):
+        self.main = main
+        self.main_ids = main_ids
+        self.partitions = partitions
+        self.partition_ids = partition_ids
 
-    # Establish Chroma client
-    client = chromadb.PersistentClient(path=str(settings.chroma_path))
+    def add(self, nodes: List[BaseNode]) -> None:
+        for store, ids in [(self.main, self.main_ids)] + [(self.partitions[f], ids) for f, ids in self.partition_ids.items()]:
+            batch = [n for n in nodes if n.node_id in ids]
+            if batch:
+                store.add(batch)
 
-    colname = collection_name or settings.chroma_collection
-    chroma_col = client.get_or_create_collection(name=colname)
+class Indexer:
+    """
+    Incremental writer for one Chroma collection and its per-family partitions. Pages go through
+    in batches (documents → chunks → diff against the stored chunks → embed → upsert/delete), so
+    memory is bounded by the batch size rather than the corpus. `rebuild` regenerates the
+    corpus-wide artifacts (BM25 indexes, snapshots, partition manifest); `finish` does that and
+    saves the index state. Long-lived in the ingestion daemon, which rebuilds on its own schedule;
+    one run in `main`.
+    """
+    def __init__(self, colname: str, embed_model, client=None):
+        self.colname = colname
+        self.embed_model = embed_model
+        self.client = client or chromadb.PersistentClient(path=str(settings.chroma_path))
+        self.col = self.client.get_or_create_collection(name=colname, metadata=EMBED_TEXT_META)
+        self.vector_store = ChromaVectorStore(chroma_collection=self.col)
+        self.embed_cache = EmbeddingCache(settings.embed_cache_path)
+        self.manifest_path = partitions_path(settings.chroma_path, colname)
+        if (self.col.metadata or {}).get("embed_text") != EMBED_TEXT_VERSION:
+            self.drop_collections()
+        self.partitions: Dict[str, Any] = {}
+        self.touched: Set[str] = set()
+        self.totals = IndexTotals()
+        # set when Chroma changed since the last rebuild (and for a fresh Indexer: artifacts unknown)
+        self.dirty = True
+
+    def drop_collections(self) -> None:
+        """
+        The collection was built from a different embedded text (e.g. before volatile metadata was
+        excluded): drop it, its partitions and the manifest, so the next sync re-embeds every page
+        instead of mixing old and new vectors.
+        """
+        prefix = partition_name(self.colname, "")
+        names = [c if isinstance(c, str) else c.name for c in self.client.list_collections()]
+        for name in names:
+            if name == self.colname or name.startswith(prefix):
+                self.client.delete_collection(name)
+        self.manifest_path.unlink(missing_ok=True)
+        print(f"Embedded text changed (now version {EMBED_TEXT_VERSION}): dropped {self.colname} and its partitions; re-embedding.")
+        self.col = self.client.create_collection(name=self.colname, metadata=EMBED_TEXT_META)
+        self.vector_store = ChromaVectorStore(chroma_collection=self.col)
+
+    def partition(self, family: str, create: bool = True):
+        """Chroma collection for a page family (None if it doesn't exist and `create` is False)."""
+        if family not in self.partitions:
+            name = partition_name(self.colname, family)
+            if create:
+                self.partitions[family] = self.client.get_or_create_collection(name=name, metadata=EMBED_TEXT_META)
+            else:
+                try:
+                    self.partitions[family] = self.client.get_collection(name=name)
+                except Exception:
+                    return None
+        return self.partitions[family]
+
+    def partitioned(self) -> bool:
+        """False until a manifest exists, i.e. the partitions must be backfilled from every page."""
+        return self.manifest_path.exists()
+
+    def remove(self, urls: List[str], state: Dict[str, str]) -> None:
+        """Drop every chunk of pages that are no longer cached."""
+        for url in urls:
+            stale = existing_chunk_ids(self.col, url)
+            if stale:
+                self.col.delete(ids=list(stale))
+            family = url_family(url)
+            part = self.partition(family, create=False)
+            if part is not None:
+                part_stale = existing_chunk_ids(part, url)
+                if part_stale:
+                    part.delete(ids=list(part_stale))
+                    self.touched.add(family)
+            state.pop(url, None)
+            self.dirty = True
+            print(f"[removed] {url}  chunks={len(stale)}")
+
+    async def index_batch(self, pages: List[Dict[str, Any]], state: Dict[str, str]) -> None:
+        # Converts cached pages into LlamaIndex Documents (one per section), then chunks them
+        documents = pages_to_documents(pages)
+        nodes = await asyncio.to_thread(
+            chunk_documents,
+            documents,
+            chunk_size=settings.chunk_max_chars,
+            chunk_overlap=settings.chunk_overlap,
+            workers=settings.chunk_workers,
+        )
+
+        # Diff against what Chroma already holds for each page, in the main collection and in the
+        # page's partition: add new chunks, delete removed ones
+        by_url: Dict[str, List[BaseNode]] = {}
+        for n in nodes:
+            by_url.setdefault(n.metadata.get("url", ""), []).append(n)
+        new_nodes: List[BaseNode] = []
+        new_main: Set[str] = set()
+        new_part: Dict[str, Set[str]] = {}
+        stale_ids: List[str] = []
+        stale_part: Dict[str, List[str]] = {}
+        for p in pages:
+            page_nodes = by_url.get(p["url"], [])
+            family = url_family(p["url"])
+            part = self.partition(family)
+            want = {n.node_id for n in page_nodes}
+            have = existing_chunk_ids(self.col, p["url"])
+            have_part = existing_chunk_ids(part, p["url"])
+            for n in page_nodes:
+                if n.node_id not in have or n.node_id not in have_part:
+                    new_nodes.append(n)
+                if n.node_id not in have:
+                    new_main.add(n.node_id)
+                if n.node_id not in have_part:
+                    new_part.setdefault(family, set()).add(n.node_id)
+            stale_ids.extend(have - want)
+            if have_part - want:
+                stale_part.setdefault(family, []).extend(have_part - want)
+            if new_part.get(family) or family in stale_part:
+                self.touched.add(family)
+
+        # Embed concurrently (rate-limited, retried) and write each batch to Chroma as it completes.
+        # Stored vectors are reused for unchanged chunk text; stale chunks are deleted afterwards.
+        store = FanOutStore(
+            self.vector_store,
+            new_main,
+            {f: ChromaVectorStore(chroma_collection=self.partition(f)) for f in new_part},
+            new_part,
+        )
+        stats = await embed_and_store(
+            new_nodes,
+            self.embed_model,
+            store,
+            self.embed_cache,
+            model_name=settings.gemini_embedding_model,
+            batch_size=settings.embed_batch_size,
+            concurrency=settings.embed_concurrency,
+            requests_per_min=settings.embed_requests_per_min,
+            max_retries=settings.embed_max_retries,
+        )
+        if stale_ids:
+            self.col.delete(ids=stale_ids)
+        for family, ids in stale_part.items():
+            self.partition(family).delete(ids=ids)
+        for p in pages:
+            state[p["url"]] = p["index_key"]
+        self.dirty = self.dirty or bool(new_nodes or stale_ids or stale_part)
+        t = self.totals
+        t.pages += len(pages)
+        t.documents += len(documents)
+        t.nodes += len(nodes)
+        t.new += len(new_main)
+        t.stale += len(stale_ids)
+        t.cached += stats.cached
+        t.embedded += stats.embedded
+        t.retries += stats.retries
+
+    async def index_pages(self, pages: Iterable[Dict[str, Any]], state: Dict[str, str], batch_pages: int = 64) -> int:
+        """Index pages from an iterator, `batch_pages` at a time; returns how many were indexed."""
+        before = self.totals.pages
+        batch: List[Dict[str, Any]] = []
+        for page in pages:
+            batch.append(page)
+            if len(batch) >= batch_pages:
+                await self.index_batch(batch, state)
+                batch = []
+        if batch:
+            await self.index_batch(batch, state)
+        return self.totals.pages - before
 
-    # Wire Chroma into LlamaIndex
-    vector_store = ChromaVectorStore(chroma_collection=chroma_col)
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    def report(self) -> None:
+        t = self.totals
+        print(f"Indexed {t.pages} pages: {t.documents} documents, {t.nodes} chunks.")
+        print(f"Chunk diff: {t.new} new, {t.stale} stale, {t.nodes - t.new} unchanged.")
+        print(f"Embeddings: {t.cached} from cache, {t.embedded} newly embedded, {t.retries} retries.")
+        print(f"Added {t.new} and deleted {t.stale} vectors in Chroma collection '{self.colname}' at '{settings.chroma_path}'.")
+        self.totals = IndexTotals()
 
+    def finish(self, state: Dict[str, str]) -> None:
+        self.report()
+        self.rebuild()
+
+        # Updates state.json to mark these pages as indexed
+        save_index_state(settings.index_state_path, state)
+        publish_generation(settings.index_generation_path)
+        print(f"Updated index state → {settings.index_state_path}")
+
+    def rebuild(self) -> None:
+        # Lexical (BM25) index over the same chunks, saved next to the collection
+        lexical = BM25Index.from_chroma(self.col)
+        lexical_path = lexical_index_path(settings.chroma_path, self.colname)
+        lexical.save(lexical_path)
+        print(f"Saved BM25 index ({len(lexical)} chunks) → {lexical_path}")
+
+        # Memory-mappable vector snapshot for RETRIEVAL_MODE=snapshot
+        snap_path = snapshot_dir(settings.chroma_path, self.colname)
+        rows = export_snapshot(self.col, snap_path)
+        print(f"Exported vector snapshot ({rows} rows) → {snap_path}")
+
+        # Same artifacts for the partitions that changed, plus their centroids for the query router
+        self.finish_partitions()
+        self.dirty = False
+
+    def finish_partitions(self) -> None:
+        manifest = load_partitions(self.manifest_path)
+        # the first partitioned build writes every partition it has seen
+        families = self.touched if self.partitioned() else self.touched | set(self.partitions)
+        for family in sorted(families):
+            part = self.partition(family)
+            name = partition_name(self.colname, family)
+            BM25Index.from_chroma(part).save(lexical_index_path(settings.chroma_path, name))
+            snap_path = snapshot_dir(settings.chroma_path, name)
+            export_snapshot(part, snap_path)
+            snap = VectorSnapshot.load(snap_path)
+            vectors = snap.vectors if snap is not None else []
+            manifest[family] = {"collection": name, "chunks": len(vectors), "centroid": centroid(vectors)}
+        save_partitions(self.manifest_path, self.colname, manifest)
+        if families:
+            sizes = ", ".join(f"{f}={p['chunks']}" for f, p in sorted(manifest.items()))
+            print(f"Partitions ({sizes}) → {self.manifest_path}")
+        self.touched = set()
+
+    def close(self) -> None:
+        self.embed_cache.close()
+
+def make_embed_model():
     # Use the Google GenAI embedding wrapper
-    embed_model = GoogleGenAIEmbedding(
+    return GoogleGenAIEmbedding(
         model_name=settings.gemini_embedding_model,
         api_key=settings.google_api_key,
         embed_batch_size=settings.embed_batch_size,
     )
 
-    # Build index
-    _ = VectorStoreIndex(
-        nodes=nodes,
-        storage_context=storage_context,
-        embed_model=embed_model,
-        show_progress=True,
+def url_family(url: str) -> str:
+    return page_family(url, PAGE_FAMILIES, DEFAULT_FAMILY)
+
+def dedup_filter() -> NearDuplicateFilter:
+    # within a page family only, so each partition keeps its own copy of shared sections
+    return NearDuplicateFilter(
+        settings.dedup_max_distance, settings.dedup_min_jaccard, settings.dedup_min_chars, group_fn=url_family,
     )
-    print(f"Upserted {len(nodes)} vectors into Chroma collection '{colname}' at '{settings.chroma_path}'.")
 
-    # Updates state.json to mark these pages as indexed
-    for p in pages:
-        state[p["url"]] = p["content_sha1"]
-    save_index_state(state_path, state)
-    print(f"Updated index state → {state_path}")
+async def sync_index(
+    cache: DiskCache,
+    indexer: Indexer,
+    state: Dict[str, str],
+    reindex_all: bool = False,
+    dedup: NearDuplicateFilter | None = None,
+) -> int:
+    """
+    Bring the collection up to date with the cache: pages are streamed in URL order through the
+    near-duplicate filter (sections repeated across pages are indexed once), and those whose kept
+    sections changed since the last run are indexed. Returns the number of pages indexed or removed.
+    Pass an empty `dedup` to keep it: it then indexes every cached page, for `index_changed`.
+    """
+    # the first run with partitioning backfills them from every page (vectors come from the embedding cache)
+    reindex_all = reindex_all or not indexer.partitioned()
+    live_urls = {m.get("url") for m in cache.list_meta()}
+    removed_urls = [u for u in state if u not in live_urls]
+    dedup = dedup if dedup is not None else dedup_filter()
+    pages = dedup.stream(cache.iter_all(by_url=True))
+    pending = pages if reindex_all else pages_needing_index(pages, state)
+    first = next(pending, None)
+    if first is None and not removed_urls:
+        return 0
+    print(f"Indexing changed pages (removed from cache: {len(removed_urls)})")
+    indexer.remove(removed_urls, state)
+    n = await indexer.index_pages(itertools.chain([first] if first else [], pending), state)
+    if dedup.stats.dropped:
+        print(f"Near-duplicates: dropped {dedup.stats.dropped}/{dedup.stats.sections} sections on {dedup.stats.pages_changed} pages.")
+    indexer.finish(state)
+    return n + len(removed_urls)
+
+async def index_changed(
+    cache: DiskCache, indexer: Indexer, state: Dict[str, str], dedup: NearDuplicateFilter, urls: Iterable[str],
+) -> int:
+    """
+    Incremental counterpart of sync_index for a long-lived `dedup` filter that has seen every
+    cached page: re-index the given pages and the pages whose kept sections moved with them
+    (a shared section gained or lost its first copy). BM25, snapshots and the index state are
+    left to the caller. Returns the number of pages indexed or removed.
+    """
+    affected: Set[str] = set()
+    removed: List[str] = []
+    for url in dict.fromkeys(urls):
+        page = cache.get(url)
+        affected |= dedup.update(page, url)
+        if page is None:
+            removed.append(url)
+        else:
+            affected.add(url)
+    gone = [u for u in removed if u in state]
+    indexer.remove(gone, state)
+    pages = (dedup.apply(p) for p in map(cache.get, sorted(affected)) if p is not None)
+    return await indexer.index_pages(pages_needing_index(pages, state), state) + len(gone)
+
+def main(reindex_all: bool = False, collection_name: str | None = None, faq: bool = False) -> int:
+    if not settings.google_api_key:
+        print("ERROR: GEMINI_API_KEY is not set in your environment.")
+        return 2
+
+    cache = DiskCache(Path("cache"))
+    state = load_index_state(settings.index_state_path)
+    colname = collection_name or settings.chroma_collection
+    indexer = Indexer(colname, make_embed_model())
+    try:
+        changed = asyncio.run(sync_index(cache, indexer, state, reindex_all))
+    finally:
+        indexer.close()
+    if not changed:
+        print("Nothing to index (all up to date).")
+
+    # Precomputed answers are tied to this index generation; without --faq old ones stop being served
+    if faq:
+        build_faq(cache, indexer.client, colname, indexer.embed_model)
     return 0
 
 if __name__ == "__main__":
     reindex = "--reindex-all" in sys.argv
+    faq = "--faq" in sys.argv
     try:
         col_flag = "--collection"
         coll = None
@@ -112,4 +443,4 @@ if __name__ == "__main__":
             coll = sys.argv[idx + 1]
     except Exception:
         coll = None
-    raise SystemExit(main(reindex_all=reindex, collection_name=coll))
+    raise SystemExit(main(reindex_all=reindex, collection_name=coll, faq=faq))
@@ -6,7 +6,9 @@ HEADERS = {
     "User-Agent": "QC-CommencementScraper/1.0 (contact: you@example.com)"
 }
 REQUEST_TIMEOUT = 25
-MAX_CONCURRENCY = 4
+# Politeness, applied per host
+PER_HOST_CONCURRENCY = 2
+PER_HOST_DELAY_S = 0.5
 
 # URLs for the scraper
 DEFAULT_URLS = [
@@ -16,6 +18,42 @@ DEFAULT_URLS = [
     "https://www.qc.cuny.edu/ce/faq/",
 ]
 
+# Pages whose question-like section titles seed the precomputed FAQ answers
+FAQ_URL_MARKERS = ("/ce/faq",)
+
+# Page families by URL marker: which Divi blocks the scraper reads, and the index partition
+# (Chroma collection) a page's chunks go to. Pages matching none go to DEFAULT_FAMILY.
+PAGE_FAMILIES = {
+    "graduates": ("/ce/for-graduates",),
+    "guests": ("/ce/for-guests",),
+    "directions": ("/a/directions",),
+    "faq": ("/ce/faq",),
+}
+DEFAULT_FAMILY = "general"
+TOGGLE_FAMILIES = ("graduates", "guests")
+TEXT_INNER_FAMILIES = ("graduates", "directions", "faq")
+
+# Query router keyword rules: questions matching one are searched in that family's partition
+ROUTE_KEYWORDS = {
+    "graduates": re.compile(r"\b(graduates?|caps?|gowns?|regalia|diplomas?|line ?up|processional|rehearsal)\b", re.I),
+    "guests": re.compile(r"\b(guests?|tickets?|family|families|seating|seats?|wheelchair|accessib\w*)\b", re.I),
+    "directions": re.compile(r"\b(directions?|parking|park|subway|bus(es)?|train|lirr|driving|drive|address)\b", re.I),
+}
+
+# Crawl mode: stay on the seed hosts, under these path prefixes
+CRAWL_ALLOWED_PREFIXES = ("/ce/", "/a/directions")
+CRAWL_MAX_DEPTH = 2
+CRAWL_MAX_PAGES = 5000
+CRAWL_SKIP_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png", ".gif", ".svg", ".zip", ".doc", ".docx", ".ics", ".mp4")
+
+# Ingestion daemon (ingest.py): seconds between re-crawls, items buffered between stages,
+# how long changed pages are collected before an index update, and the minimum interval
+# between rebuilds of the corpus-wide BM25 indexes and snapshots
+INGEST_INTERVAL_S = 600
+INGEST_QUEUE_SIZE = 32
+INGEST_DEBOUNCE_S = 5.0
+INGEST_REBUILD_S = 120
+
 # Used to filter noisy data
 NOISE_TITLES = {"Follow Us", "Resources & Links", "© Copyright 2025"}
 NOISE_PATTERNS = re.compile(
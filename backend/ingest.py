@@ -0,0 +1,304 @@
+"""
+Continuous ingestion: re-crawl on a schedule and push every changed page through to Chroma.
+
+    fetch → parse → cache write → index (chunk → embed → upsert)
+
+Stages are linked by bounded asyncio queues, so a slow stage holds back the ones before it
+instead of buffering pages in memory. Fetches are conditional (ETag / Last-Modified): an
+unchanged page costs one 304 per cycle. Changed pages are indexed a few seconds after they
+are written, together with the pages whose near-duplicate sections moved with them; Chroma
+serves them right away. The corpus-wide BM25 indexes and snapshots are rebuilt at most every
+`--rebuild-interval` seconds, and only a rebuild starts a new index generation (the API then
+reloads them and drops its cached answers).
+
+    cd backend
+    python ingest.py                      # DEFAULT_URLS + every cached page, every 10 minutes
+    python ingest.py --crawl --max-depth 2
+    python ingest.py --once               # one cycle, then exit
+"""
+from __future__ import annotations
+import argparse, asyncio, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+import httpx
+from build_index_llama import (
+    Indexer, build_faq, dedup_filter, index_changed, load_index_state, make_embed_model, publish_generation,
+    save_index_state, sync_index,
+)
+from constants import (
+    CRAWL_ALLOWED_PREFIXES, CRAWL_MAX_DEPTH, CRAWL_MAX_PAGES, DEFAULT_URLS,
+    INGEST_DEBOUNCE_S, INGEST_INTERVAL_S, INGEST_QUEUE_SIZE, INGEST_REBUILD_S, PER_HOST_CONCURRENCY,
+)
+from rag.dedup import NearDuplicateFilter
+from rag.cache import DiskCache
+from rag.metrics import PAGES_SCRAPED, record, span, stage_report
+from scraper import HTML_PARSER, PARSE_WORKERS, HostLimiter, crawlable, fetch_html_async, normalize_url, parse_page
+from settings import settings
+
+class Ingestor:
+    def __init__(
+        self,
+        seeds: List[str],
+        crawl: bool = False,
+        max_depth: int = CRAWL_MAX_DEPTH,
+        prefixes: Tuple[str, ...] = CRAWL_ALLOWED_PREFIXES,
+        max_pages: int = CRAWL_MAX_PAGES,
+        queue_size: int = INGEST_QUEUE_SIZE,
+        debounce_s: float = INGEST_DEBOUNCE_S,
+        rebuild_s: float = INGEST_REBUILD_S,
+        faq: bool = False,
+        collection_name: Optional[str] = None,
+        cache: Optional[DiskCache] = None,
+        limiter: Optional[HostLimiter] = None,
+    ):
+        self.seeds = [normalize_url(u) for u in seeds]
+        self.hosts = {urlsplit(u).netloc.lower() for u in self.seeds}
+        self.crawl = crawl
+        self.max_depth = max_depth if crawl else 0
+        self.prefixes = prefixes
+        self.max_pages = max_pages
+        self.debounce_s = debounce_s
+        self.rebuild_s = rebuild_s
+        self.faq = faq
+        self.cache = cache or DiskCache(Path("cache"))
+        self.limiter = limiter or HostLimiter()
+        self.fetch_q: asyncio.Queue = asyncio.Queue(queue_size)
+        self.parse_q: asyncio.Queue = asyncio.Queue(queue_size)
+        self.write_q: asyncio.Queue = asyncio.Queue(queue_size)
+        self.index_q: asyncio.Queue = asyncio.Queue(queue_size)
+        self.discovered: List[Tuple[str, int]] = []
+        self.collection_name = collection_name or settings.chroma_collection
+        # Chroma, the embedding cache and the BM25/snapshot rebuild live on one dedicated thread
+        self.index_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index")
+        self.indexer: Optional[Indexer] = None
+        # every cached page's sections, kept up to date page by page after the first full sync
+        self.dedup: Optional[NearDuplicateFilter] = None
+        self.last_rebuild = 0.0
+        self.state = load_index_state(settings.index_state_path)
+        self.counts = {"fetched": 0, "not_modified": 0, "changed": 0, "error": 0}
+
+    # Stages
+
+    async def fetcher(self, client: httpx.AsyncClient) -> None:
+        while True:
+            url, depth = await self.fetch_q.get()
+            try:
+                t_wait = time.perf_counter()
+                async with self.limiter.slot(url):
+                    record("host_wait", time.perf_counter() - t_wait)
+                    with span("fetch"):
+                        fetched = await fetch_html_async(client, url, self.cache.validators(url))
+                if fetched is None:
+                    PAGES_SCRAPED.inc(outcome="not_modified")
+                    self.counts["not_modified"] += 1
+                    if self.crawl:
+                        self.discover((self.cache.get(url) or {}).get("links", []), depth)
+                else:
+                    await self.parse_q.put((url, depth, *fetched))
+            except Exception as e:
+                PAGES_SCRAPED.inc(outcome="error")
+                self.counts["error"] += 1
+                print(f"[error] {url} -> {e}")
+            finally:
+                self.fetch_q.task_done()
+
+    async def parser(self, pool: ProcessPoolExecutor) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            url, depth, html, validators = await self.parse_q.get()
+            try:
+                with span("parse"):
+                    page_title, sections, links = await loop.run_in_executor(pool, parse_page, html, url)
+                await self.write_q.put((url, depth, page_title, sections, links, validators))
+            except Exception as e:
+                PAGES_SCRAPED.inc(outcome="error")
+                self.counts["error"] += 1
+                print(f"[error] parse {url} -> {e}")
+            finally:
+                self.parse_q.task_done()
+
+    async def writer(self) -> None:
+        while True:
+            url, depth, page_title, sections, links, validators = await self.write_q.get()
+            try:
+                # SQLite writes stay off the event loop the fetchers share
+                before = await asyncio.to_thread(self.cache.content_sha1, url)
+                with span("cache_put"):
+                    sha = await asyncio.to_thread(self.cache.put, {
+                        "url": url, "page_title": page_title, "sections": sections, "links": links, **validators,
+                    })
+                PAGES_SCRAPED.inc(outcome="fetched")
+                self.counts["fetched"] += 1
+                if self.crawl:
+                    self.discover(links, depth)
+                if sha != before:
+                    self.counts["changed"] += 1
+                    print(f"[changed] {url} -> {sha[:10]}  sections={len(sections)}")
+                    await self.index_q.put(url)
+            except Exception as e:
+                self.counts["error"] += 1
+                print(f"[error] cache {url} -> {e}")
+            finally:
+                self.write_q.task_done()
+
+    async def index_updater(self) -> None:
+        """
+        Collect changed pages for `debounce_s`, then index them on the index thread; a pending
+        BM25/snapshot rebuild runs once it is due, even when no more pages change.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                urls = [await asyncio.wait_for(self.index_q.get(), self.rebuild_wait())]
+            except asyncio.TimeoutError:
+                await loop.run_in_executor(self.index_thread, self.maybe_rebuild)
+                continue
+            deadline = loop.time() + self.debounce_s
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    urls.append(await asyncio.wait_for(self.index_q.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                t0 = time.perf_counter()
+                n = await loop.run_in_executor(self.index_thread, self.update_index, urls)
+                print(f"[index] {len(urls)} changed page(s) → {n} page(s) re-indexed in {time.perf_counter() - t0:.1f}s")
+            except Exception as e:
+                print(f"[error] index update -> {e!r}")
+            finally:
+                for _ in urls:
+                    self.index_q.task_done()
+
+    # Index thread: Chroma, the embedding cache and the dedup index are only touched here
+
+    def update_index(self, urls: List[str]) -> int:
+        # own event loop per update, so indexing never stalls the fetch loop
+        if self.indexer is None:
+            self.indexer = Indexer(self.collection_name, make_embed_model())
+        if self.dedup is None:
+            # startup: one full pass catches up on pages cached while the daemon was down
+            # and fills the dedup index that later updates maintain incrementally
+            self.dedup = dedup_filter()
+            n = asyncio.run(sync_index(self.cache, self.indexer, self.state, dedup=self.dedup))
+            if n:
+                self.rebuilt()
+        else:
+            n = asyncio.run(index_changed(self.cache, self.indexer, self.state, self.dedup, [u for u in urls if u]))
+            if n:
+                # pages are marked indexed; the generation only moves with the next rebuild
+                self.indexer.report()
+                save_index_state(settings.index_state_path, self.state)
+        self.maybe_rebuild()
+        return n
+
+    def rebuild_wait(self) -> Optional[float]:
+        """Seconds until a pending rebuild is due; None when there is none."""
+        if self.indexer is None or not self.indexer.dirty:
+            return None
+        return max(0.0, self.last_rebuild + self.rebuild_s - time.monotonic())
+
+    def maybe_rebuild(self, force: bool = False) -> None:
+        """Regenerate BM25 indexes and snapshots when Chroma changed and the last rebuild is old enough."""
+        wait = self.rebuild_wait()
+        if wait is None or (wait > 0 and not force):
+            return
+        self.indexer.rebuild()
+        save_index_state(settings.index_state_path, self.state)
+        publish_generation(settings.index_generation_path)  # the API reloads the artifacts
+        self.rebuilt()
+
+    def rebuilt(self) -> None:
+        self.last_rebuild = time.monotonic()
+        if self.faq:
+            build_faq(self.cache, self.indexer.client, self.indexer.colname, self.indexer.embed_model)
+
+    # Scheduling
+
+    def discover(self, links: List[str], depth: int) -> None:
+        if depth < self.max_depth:
+            self.discovered.extend(
+                (u, depth + 1) for u in map(normalize_url, links) if crawlable(u, self.hosts, self.prefixes)
+            )
+
+    async def run_cycle(self) -> None:
+        """One pass over the seeds and every cached page (plus links found on the way when crawling)."""
+        t0 = time.perf_counter()
+        self.counts = dict.fromkeys(self.counts, 0)
+        todo = [(u, 0) for u in dict.fromkeys(self.seeds + [m["url"] for m in self.cache.list_meta()])]
+        seen: Set[str] = set()
+        while todo and len(seen) < self.max_pages:
+            for url, depth in todo:
+                if url not in seen and len(seen) < self.max_pages:
+                    seen.add(url)
+                    await self.fetch_q.put((url, depth))
+            for q in (self.fetch_q, self.parse_q, self.write_q):
+                await q.join()
+            todo, self.discovered = self.discovered, []
+        print(f"[cycle] {len(seen)} URL(s) in {time.perf_counter() - t0:.1f}s  {self.counts}")
+
+    async def run(self, interval_s: float = INGEST_INTERVAL_S, once: bool = False) -> None:
+        print(
+            f"Ingesting {len(self.seeds)} seed(s) every {interval_s:.0f}s "
+            f"(crawl={self.crawl}, parse workers={PARSE_WORKERS}, {HTML_PARSER}).\n"
+        )
+        limits = httpx.Limits(max_connections=10, max_keepalive_connections=5)
+        with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as pool:
+            async with httpx.AsyncClient(follow_redirects=True, http2=True, limits=limits) as client:
+                workers = [asyncio.create_task(self.fetcher(client)) for _ in range(max(1, PER_HOST_CONCURRENCY * len(self.hosts)))]
+                workers += [asyncio.create_task(self.parser(pool)) for _ in range(PARSE_WORKERS)]
+                workers += [asyncio.create_task(self.writer()), asyncio.create_task(self.index_updater())]
+                try:
+                    # pages already cached but not yet indexed (e.g. after a crash) go first
+                    await self.index_q.put("")
+                    while True:
+                        t0 = time.monotonic()
+                        await self.run_cycle()
+                        if once:
+                            await self.index_q.join()
+                            break
+                        await asyncio.sleep(max(0.0, interval_s - (time.monotonic() - t0)))
+                finally:
+                    for w in workers:
+                        w.cancel()
+                    if self.indexer is not None:
+                        self.index_thread.submit(self.maybe_rebuild, True).result()
+                        self.index_thread.submit(self.indexer.close).result()
+                    self.index_thread.shutdown()
+        print(stage_report())
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Continuous scrape → index pipeline")
+    ap.add_argument("urls", nargs="*", help="Seed URLs (default: DEFAULT_URLS)")
+    ap.add_argument("--interval", type=float, default=INGEST_INTERVAL_S, help="Seconds between re-crawls")
+    ap.add_argument("--once", action="store_true", help="Run one cycle, wait for indexing, then exit")
+    ap.add_argument("--crawl", action="store_true", help="Follow same-site links from the seed URLs")
+    ap.add_argument("--max-depth", type=int, default=CRAWL_MAX_DEPTH, help="Crawl depth limit")
+    ap.add_argument("--max-pages", type=int, default=CRAWL_MAX_PAGES, help="Fetches per cycle")
+    ap.add_argument("--prefix", action="append", help="Allowed path prefix when crawling (repeatable)")
+    ap.add_argument("--debounce", type=float, default=INGEST_DEBOUNCE_S, help="Seconds to batch changes before indexing")
+    ap.add_argument("--rebuild-interval", type=float, default=INGEST_REBUILD_S, help="Min seconds between BM25/snapshot rebuilds")
+    ap.add_argument("--faq", action="store_true", help="Rebuild precomputed FAQ answers after each BM25/snapshot rebuild")
+    ap.add_argument("--collection", help="Chroma collection (default: CHROMA collection from settings)")
+    return ap.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not settings.google_api_key:
+        raise SystemExit("ERROR: GEMINI_API_KEY is not set in your environment.")
+    ingestor = Ingestor(
+        [u.strip() for u in (args.urls or DEFAULT_URLS) if u.strip()],
+        crawl=args.crawl,
+        max_depth=args.max_depth,
+        prefixes=tuple(args.prefix) if args.prefix else CRAWL_ALLOWED_PREFIXES,
+        max_pages=args.max_pages,
+        debounce_s=args.debounce,
+        rebuild_s=args.rebuild_interval,
+        faq=args.faq,
+        collection_name=args.collection,
+    )
+    try:
+        asyncio.run(ingestor.run(args.interval, once=args.once))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,115 @@
+from __future__ import annotations
+import re, time, threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from schemas import ChatResponse
+
+def normalize_question(q: str) -> str:
+    q = re.sub(r"[^\w\s]", " ", (q or "").lower())
+    return " ".join(q.split())
+
+def _unit(vec) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+@dataclass
+class _Entry:
+    question: str
+    vector: Optional[np.ndarray]
+    response: ChatResponse
+    created_at: float
+
+class SemanticAnswerCache:
+    """
+    In-memory LRU/TTL cache of final answers, keyed on the standalone question.
+
+    Lookups try an exact (normalized) question match first, then cosine similarity
+    against the cached question embeddings. The whole cache is dropped whenever
+    `generation_fn()` changes (i.e. the index was rebuilt).
+    """
+    def __init__(
+        self,
+        generation_fn: Callable[[], str],
+        max_items: int = 512,
+        ttl_s: float = 3600.0,
+        threshold: float = 0.95,
+    ):
+        self.generation_fn = generation_fn
+        self.max_items = max_items
+        self.ttl_s = ttl_s
+        self.threshold = threshold
+        self._items: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._generation: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _check_generation(self) -> None:
+        gen = self.generation_fn()
+        if gen != self._generation:
+            self._items.clear()
+            self._generation = gen
+
+    def _expired(self, e: _Entry) -> bool:
+        return self.ttl_s > 0 and (time.monotonic() - e.created_at) > self.ttl_s
+
+    def get_exact(self, namespace: str, question: str) -> Optional[ChatResponse]:
+        key = (namespace, normalize_question(question))
+        with self._lock:
+            self._check_generation()
+            e = self._items.get(key)
+            if e is None:
+                return None
+            if self._expired(e):
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return e.response.model_copy(deep=True)
+
+    def get_similar(self, namespace: str, embedding: List[float]) -> Optional[ChatResponse]:
+        q = _unit(embedding)
+        with self._lock:
+            self._check_generation()
+            keys, vecs = [], []
+            for key, e in list(self._items.items()):
+                if key[0] != namespace or e.vector is None:
+                    continue
+                if self._expired(e):
+                    del self._items[key]
+                    continue
+                keys.append(key)
+                vecs.append(e.vector)
+            if not vecs:
+                return None
+            sims = np.vstack(vecs) @ q
+            best = int(np.argmax(sims))
+            if float(sims[best]) < self.threshold:
+                return None
+            self._items.move_to_end(keys[best])
+            return self._items[keys[best]].response.model_copy(deep=True)
+
+    def put(
+        self,
+        namespace: str,
+        question: str,
+        embedding: Optional[List[float]],
+        response: ChatResponse,
+    ) -> None:
+        key = (namespace, normalize_question(question))
+        entry = _Entry(
+            question=question,
+            vector=_unit(embedding) if embedding is not None else None,
+            response=response.model_copy(deep=True),
+            created_at=time.monotonic(),
+        )
+        with self._lock:
+            self._check_generation()
+            self._items[key] = entry
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
@@ -1,5 +1,6 @@
-import json, hashlib, pathlib, datetime
-from typing import Dict, Any, List, Optional
+import json, hashlib, pathlib, datetime, sqlite3, threading
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional
 
 DEFAULT_DIR = pathlib.Path("cache")
 
@@ -8,8 +9,8 @@ def _sha1(s: str) -> str:
 
 class DiskCache:
     """
-    Minimal filesystem cache for parsed pages.
-    Stores one JSON per page keyed by URL hash, plus a manifest for listing.
+    Page cache backed by SQLite (WAL) with a primary-key index on URL.
+    Every put is one atomic transaction; wrap many puts in `batch()` to commit once.
 
     Page record:
     {
@@ -17,74 +18,190 @@ class DiskCache:
         "page_title": str,
         "fetched_at": str (ISO),
         "sections": [{"title": str, "text": str}, ...],
-        "content_sha1": str
+        "content_sha1": str,
+        "etag": str | None,           # HTTP validators from the last 200 response
+        "last_modified": str | None,
+        "links": [str, ...]           # absolute links found in the extracted sections
     }
     """
     def __init__(self, base_dir: pathlib.Path = DEFAULT_DIR):
         self.base_dir = pathlib.Path(base_dir)
-        self.pages_dir = self.base_dir / "pages"
-        self.manifest_path = self.base_dir / "manifest.json"
-        self.pages_dir.mkdir(parents=True, exist_ok=True)
-        if not self.manifest_path.exists():
-            self._write_manifest({"created_at": datetime.datetime.utcnow().isoformat(), "items": []})
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.base_dir / "pages.sqlite"
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self.conn = self._connect()
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " url TEXT PRIMARY KEY, page_title TEXT, fetched_at TEXT,"
+                " content_sha1 TEXT, record TEXT NOT NULL, etag TEXT, last_modified TEXT)"
+            )
+            cols = {r[1] for r in self.conn.execute("PRAGMA table_info(pages)")}
+            for col in ("etag", "last_modified"):
+                if col not in cols:
+                    self.conn.execute(f"ALTER TABLE pages ADD COLUMN {col} TEXT")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS frontier ("
+                " url TEXT PRIMARY KEY, depth INTEGER NOT NULL, status TEXT NOT NULL DEFAULT 'pending',"
+                " discovered_at TEXT)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS frontier_status ON frontier (status, depth)")
+        self._import_legacy_manifest()
 
-    def _page_path(self, url: str) -> pathlib.Path:
-        return self.pages_dir / f"{_sha1(url)}.json"
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
 
-    def _read_manifest(self) -> Dict[str, Any]:
-        return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+    def _import_legacy_manifest(self) -> None:
+        """One-time import of the old manifest.json + pages/*.json layout."""
+        manifest = self.base_dir / "manifest.json"
+        if not manifest.exists() or self.conn.execute("SELECT 1 FROM pages LIMIT 1").fetchone():
+            return
+        items = json.loads(manifest.read_text(encoding="utf-8")).get("items", [])
+        with self.batch():
+            for it in items:
+                path = pathlib.Path(it.get("path") or "")
+                if path.exists():
+                    self._upsert(json.loads(path.read_text(encoding="utf-8")))
 
-    def _write_manifest(self, data: Dict[str, Any]) -> None:
-        self.manifest_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    def _upsert(self, record: Dict[str, Any]) -> None:
+        self.conn.execute(
+            "INSERT INTO pages (url, page_title, fetched_at, content_sha1, record, etag, last_modified)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(url) DO UPDATE SET page_title = excluded.page_title,"
+            " fetched_at = excluded.fetched_at, content_sha1 = excluded.content_sha1, record = excluded.record,"
+            " etag = excluded.etag, last_modified = excluded.last_modified",
+            (
+                record["url"],
+                record.get("page_title"),
+                record.get("fetched_at"),
+                record.get("content_sha1"),
+                json.dumps(record, ensure_ascii=False, separators=(",", ":")),
+                record.get("etag"),
+                record.get("last_modified"),
+            ),
+        )
 
-    def put(self, record: Dict[str, Any]) -> pathlib.Path:
+    @contextmanager
+    def batch(self):
+        """Group puts into a single commit (rolled back if the block raises)."""
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                yield self
+            except BaseException:
+                if self._batch_depth == 1:
+                    self.conn.rollback()
+                raise
+            else:
+                if self._batch_depth == 1:
+                    self.conn.commit()
+            finally:
+                self._batch_depth -= 1
+
+    def put(self, record: Dict[str, Any]) -> str:
+        """Store a page record; returns its content_sha1."""
         assert "url" in record and "sections" in record, "record must have url and sections"
         concat = "\n\n".join(sec.get("text", "") for sec in record["sections"])
         record["content_sha1"] = _sha1(concat)
         record.setdefault("fetched_at", datetime.datetime.utcnow().isoformat())
-
-        p = self._page_path(record["url"])
-        p.write_text(json.dumps(record, ensure_ascii=False, indent=2), encoding="utf-8")
-
-        man = self._read_manifest()
-        items: List[Dict[str, Any]] = man.get("items", [])
-        found = False
-        for it in items:
-            if it.get("url") == record["url"]:
-                it.update({
-                    "page_title": record.get("page_title"),
-                    "fetched_at": record.get("fetched_at"),
-                    "content_sha1": record.get("content_sha1"),
-                    "path": str(p)
-                })
-                found = True
-                break
-        if not found:
-            items.append({
-                "url": record["url"],
-                "page_title": record.get("page_title"),
-                "fetched_at": record.get("fetched_at"),
-                "content_sha1": record.get("content_sha1"),
-                "path": str(p)
-            })
-        man["items"] = items
-        self._write_manifest(man)
-        return p
+        with self._lock:
+            self._upsert(record)
+            if self._batch_depth == 0:
+                self.conn.commit()
+        return record["content_sha1"]
 
     def get(self, url: str) -> Optional[Dict[str, Any]]:
-        p = self._page_path(url)
-        if not p.exists():
-            return None
-        return json.loads(p.read_text(encoding="utf-8"))
+        with self._lock:
+            row = self.conn.execute("SELECT record FROM pages WHERE url = ?", (url,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def content_sha1(self, url: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute("SELECT content_sha1 FROM pages WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def validators(self, url: str) -> Dict[str, str]:
+        """HTTP validators stored for a cached page: {"etag": ..., "last_modified": ...} (may be empty)."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if not row:
+            return {}
+        return {k: v for k, v in zip(("etag", "last_modified"), row) if v}
+
+    def iter_all(self, batch_size: int = 256, by_url: bool = False) -> Iterator[Dict[str, Any]]:
+        """Stream every cached page (in insertion or URL order) without loading the whole cache into memory."""
+        conn = self._connect()  # own connection: a consistent WAL snapshot, no lock held
+        try:
+            cur = conn.execute(f"SELECT record FROM pages ORDER BY {'url' if by_url else 'rowid'}")
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for (rec,) in rows:
+                    yield json.loads(rec)
+        finally:
+            conn.close()
 
     def list_all(self) -> List[Dict[str, Any]]:
-        man = self._read_manifest()
-        out: List[Dict[str, Any]] = []
-        for it in man.get("items", []):
-            path = pathlib.Path(it["path"])
-            if path.exists():
-                out.append(json.loads(path.read_text(encoding="utf-8")))
-        return out
+        return list(self.iter_all())
 
     def list_meta(self) -> List[Dict[str, Any]]:
-        return self._read_manifest().get("items", [])
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT url, page_title, fetched_at, content_sha1 FROM pages ORDER BY rowid"
+            ).fetchall()
+        return [
+            {"url": u, "page_title": t, "fetched_at": f, "content_sha1": c}
+            for u, t, f, c in rows
+        ]
+
+    # Crawl frontier (deduplicated by URL, survives restarts)
+
+    def frontier_add(self, urls: List[str], depth: int) -> List[str]:
+        """Queue URLs not seen before; returns the ones that were actually new."""
+        now = datetime.datetime.utcnow().isoformat()
+        added: List[str] = []
+        with self._lock:
+            for u in dict.fromkeys(urls):
+                cur = self.conn.execute(
+                    "INSERT OR IGNORE INTO frontier (url, depth, status, discovered_at) VALUES (?, ?, 'pending', ?)",
+                    (u, depth, now),
+                )
+                if cur.rowcount:
+                    added.append(u)
+            if self._batch_depth == 0:
+                self.conn.commit()
+        return added
+
+    def frontier_pending(self, max_depth: int) -> List[tuple]:
+        """(url, depth) pairs still to crawl within `max_depth`, shallowest first."""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT url, depth FROM frontier WHERE status = 'pending' AND depth <= ? ORDER BY depth, rowid",
+                (max_depth,),
+            ).fetchall()
+
+    def frontier_mark(self, url: str, status: str) -> None:
+        with self._lock:
+            self.conn.execute("UPDATE frontier SET status = ? WHERE url = ?", (status, url))
+            if self._batch_depth == 0:
+                self.conn.commit()
+
+    def frontier_restart(self) -> None:
+        """
+        Start a new crawl pass over every known URL (discovered URLs are kept).
+        The frontier may hold URLs from other seeds; callers filter `frontier_pending` to their own scope.
+        """
+        with self._lock:
+            self.conn.execute("UPDATE frontier SET status = 'pending'")
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,39 @@
+from __future__ import annotations
+import difflib
+from typing import List
+from schemas import ChatTurn
+from rag.answer_cache import normalize_question
+
+# Words/openers that usually point back at earlier turns ("what about parking there?")
+FOLLOW_UP_WORDS = {
+    "it", "its", "that", "this", "those", "these", "they", "them", "their", "there",
+    "he", "she", "him", "her", "one", "ones", "same", "else", "above", "former", "latter",
+}
+FOLLOW_UP_OPENERS = ("and ", "but ", "so ", "also ", "then ", "what about", "how about", "what else")
+
+def looks_standalone(message: str) -> bool:
+    """Cheap check that a message can be answered without the prior conversation."""
+    norm = normalize_question(message)
+    words = norm.split()
+    if len(words) < 3:
+        return False
+    if norm.startswith(FOLLOW_UP_OPENERS):
+        return False
+    return not any(w in FOLLOW_UP_WORDS for w in words)
+
+def needs_condense(message: str, history: List[ChatTurn]) -> bool:
+    """
+    The condense call only adds something when there is history to resolve against: an earlier
+    user turn. Assistant-only preambles (the app's greeting) and a trailing copy of the message don't count.
+    """
+    turns = list(history)
+    if turns and turns[-1].role == "user" and turns[-1].content.strip() == message.strip():
+        turns = turns[:-1]
+    return any(t.role == "user" for t in turns) and not looks_standalone(message)
+
+def questions_match(a: str, b: str, threshold: float = 0.85) -> bool:
+    """True when the rewrite is close enough to the raw message to reuse its retrieval."""
+    na, nb = normalize_question(a), normalize_question(b)
+    if na == nb:
+        return True
+    return difflib.SequenceMatcher(None, na, nb).ratio() >= threshold
@@ -0,0 +1,164 @@
+from __future__ import annotations
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Set
+
+# Context assembly for the answer prompt: retrieved chunks -> deduplicated,
+# merged, diversified blocks that fit a token budget.
+
+SEPARATOR = "\n\n---\n\n"
+CHARS_PER_TOKEN = 4  # rough estimate for English prose; no tokenizer round-trip
+MIN_OVERLAP_CHARS = 24
+MIN_TAIL_TOKENS = 48  # don't bother packing a truncated block smaller than this
+
+_SENT_RE = re.compile(r"(?<=[.!?])\s+")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def _word_set(text: str) -> Set[str]:
+    return set(_WORD_RE.findall(text.lower()))
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def overlap_len(a: str, b: str, min_len: int = MIN_OVERLAP_CHARS) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b` (0 if shorter than `min_len`)."""
+    if len(a) < min_len or len(b) < min_len:
+        return 0
+    probe = b[:min_len]
+    pos = a.find(probe, max(0, len(a) - len(b)))
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        pos = a.find(probe, pos + 1)
+    return 0
+
+def join_text(a: str, b: str) -> str:
+    """Concatenate two pieces of the same section, dropping the shared span if they overlap."""
+    if not a:
+        return b
+    if b in a:
+        return a
+    if a in b:
+        return b
+    k = overlap_len(a, b)
+    return a + b[k:] if k else f"{a.rstrip()} … {b.lstrip()}"
+
+@dataclass
+class Block:
+    """One section's worth of context: merged text of its retrieved chunks."""
+    key: str
+    text: str
+    score: float
+    rank: int
+    words: Set[str] = field(default_factory=set)
+
+def _score(nws, rank: int) -> float:
+    s = getattr(nws, "score", None)
+    return float(s) if s is not None else 1.0 / (1 + rank)
+
+def merge_sections(nodes) -> List[Block]:
+    """
+    Group chunks by `section_sha1` (chunks of one section overlap by CHUNK_OVERLAP) and merge
+    each group into one block in document order. Blocks keep their best chunk's score and rank.
+    """
+    groups: Dict[str, List] = {}
+    scores: Dict[str, float] = {}
+    ranks: Dict[str, int] = {}
+    for rank, nws in enumerate(nodes):
+        node = getattr(nws, "node", nws)
+        key = (node.metadata or {}).get("section_sha1") or node.node_id
+        groups.setdefault(key, []).append(node)
+        ranks.setdefault(key, rank)
+        scores[key] = max(scores.get(key, float("-inf")), _score(nws, rank))
+
+    blocks: List[Block] = []
+    for key, members in groups.items():
+        # offsets survive the Chroma round trip; BM25-only hits keep retrieval order
+        members.sort(key=lambda n: (n.start_char_idx is None, n.start_char_idx or 0))
+        text = ""
+        for n in members:
+            text = join_text(text, (n.get_content() or "").strip())
+        if text:
+            blocks.append(Block(key=key, text=text, score=scores[key], rank=ranks[key]))
+    blocks.sort(key=lambda b: b.rank)
+    return blocks
+
+def drop_repeated_sentences(blocks: List[Block]) -> List[Block]:
+    """Remove sentences already present in a higher-ranked block (pages repeat boilerplate across sections)."""
+    seen: Set[str] = set()
+    out: List[Block] = []
+    for b in blocks:
+        lines = []
+        for line in b.text.split("\n"):
+            kept = []
+            for sent in _SENT_RE.split(line):
+                norm = " ".join(sent.lower().split())
+                if not norm:
+                    continue
+                if len(norm) >= MIN_OVERLAP_CHARS and norm in seen:
+                    continue
+                seen.add(norm)
+                kept.append(sent.strip())
+            if kept:
+                lines.append(" ".join(kept))
+        text = "\n".join(lines)
+        if text:
+            b.text = text
+            b.words = _word_set(text)
+            out.append(b)
+    return out
+
+def mmr_order(blocks: List[Block], lam: float) -> List[Block]:
+    """Maximal marginal relevance: lam * relevance - (1 - lam) * max Jaccard to already-picked blocks."""
+    if not blocks:
+        return []
+    top = max(b.score for b in blocks) or 1.0
+    rel = {id(b): b.score / top for b in blocks}
+    picked: List[Block] = []
+    rest = list(blocks)
+    while rest:
+        def gain(b: Block) -> float:
+            redundancy = max((jaccard(b.words, p.words) for p in picked), default=0.0)
+            return lam * rel[id(b)] - (1 - lam) * redundancy
+        nxt = max(rest, key=gain)
+        picked.append(nxt)
+        rest.remove(nxt)
+    return picked
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Cut at a sentence boundary within `max_tokens` (ellipsis included), falling back to a hard cut."""
+    if len(text) <= max_tokens * CHARS_PER_TOKEN:
+        return text
+    limit = max_tokens * CHARS_PER_TOKEN - len(" …")
+    cut = text[:limit]
+    end = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "))
+    return (cut[:end + 1] if end > limit // 2 else cut.rstrip()) + " …"
+
+def pack_context(nodes, token_budget: int, mmr_lambda: float = 0.7, max_redundancy: float = 0.9) -> str:
+    """
+    Prompt context from retrieved nodes: merge chunks of the same section, drop repeated
+    sentences and near-duplicate blocks, order by MMR, and pack up to `token_budget` tokens.
+    """
+    blocks = mmr_order(drop_repeated_sentences(merge_sections(nodes)), mmr_lambda)
+    out: List[str] = []
+    used = 0
+    picked: List[Block] = []
+    for b in blocks:
+        if any(jaccard(b.words, p.words) >= max_redundancy for p in picked):
+            continue
+        cost = estimate_tokens(b.text) + (estimate_tokens(SEPARATOR) if out else 0)
+        if used + cost <= token_budget:
+            out.append(b.text)
+            used += cost
+            picked.append(b)
+            continue
+        room = token_budget - used - (estimate_tokens(SEPARATOR) if out else 0)
+        if room >= MIN_TAIL_TOKENS:
+            out.append(_truncate(b.text, room))
+        break
+    return SEPARATOR.join(out)
@@ -1,33 +1,387 @@
 from __future__ import annotations
-from typing import List, Optional, Dict, Any
-import chromadb
-import google.generativeai as genai
-from llama_index.core import VectorStoreIndex, Settings
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+import asyncio, hashlib, threading, time
+from typing import TYPE_CHECKING, List, Optional, Dict, Any, AsyncIterator, Tuple
+import prompts
+from constants import ROUTE_KEYWORDS
 from settings import settings
 from schemas import SourceItem, ChatTurn
+from rag.answer_cache import SemanticAnswerCache
+from rag.context import pack_context
+from rag.faq import FAQIndex, faq_path, state_fingerprint
+from rag.gateway import LLMGateway, LLMUnavailable
+from rag.registry import IndexRegistry, UnknownCollection
+from rag.routing import QueryRouter, load_partitions, merge_hits, partitions_path
+from rag.llm_cache import LLMResponseCache
+from rag.sessions import Session, SessionStore
+from rag.metrics import span, record, count_llm_usage, LLM_CALLS, LLM_CACHE_LOOKUPS, EMBED_CALLS, RETRIEVED_NODES, ROUTED_QUERIES, LLM_GATEWAY_EVENTS
 
-# Init LLM + embeddings + Chroma client
+if TYPE_CHECKING:
+    from llama_index.core import QueryBundle, VectorStoreIndex
 
-if not settings.google_api_key:
-    raise RuntimeError("GEMINI_API_KEY is missing. Add it to .env or environment.")
+# LLM + embeddings + Chroma client, created on first use (thread-safe). Importing this
+# module does not touch Gemini, llama_index or chromadb, so workers start fast and a
+# missing key surfaces as a failed readiness check instead of an import error.
+# Tests and benchmarks may assign LLM / EMBED_MODEL / CHROMA before first use.
 
-Settings.embed_model = GoogleGenAIEmbedding(
-    model_name=settings.gemini_embedding_model,
-    api_key=settings.google_api_key,
-    embed_batch_size=settings.embed_batch_size,
+LLM = None
+EMBED_MODEL = None
+CHROMA = None
+_init_lock = threading.Lock()
+
+def require_api_key() -> str:
+    if not settings.google_api_key:
+        raise RuntimeError("GEMINI_API_KEY is missing. Add it to .env or environment.")
+    return settings.google_api_key
+
+def get_llm():
+    global LLM
+    if LLM is None:
+        with _init_lock:
+            if LLM is None:
+                import google.generativeai as genai
+                genai.configure(api_key=require_api_key())
+                LLM = genai.GenerativeModel(settings.gemini_chat_model)
+    return LLM
+
+def get_embed_model():
+    global EMBED_MODEL
+    if EMBED_MODEL is None:
+        with _init_lock:
+            if EMBED_MODEL is None:
+                from llama_index.core import Settings
+                from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+                model = GoogleGenAIEmbedding(
+                    model_name=settings.gemini_embedding_model,
+                    api_key=require_api_key(),
+                    embed_batch_size=settings.embed_batch_size,
+                )
+                Settings.embed_model = model
+                EMBED_MODEL = model
+    return EMBED_MODEL
+
+def get_chroma():
+    global CHROMA
+    if CHROMA is None:
+        with _init_lock:
+            if CHROMA is None:
+                import chromadb
+                CHROMA = chromadb.PersistentClient(path=str(settings.chroma_path))
+    return CHROMA
+
+def make_query(question: str, embedding: Optional[List[float]] = None) -> QueryBundle:
+    from llama_index.core import QueryBundle
+    return QueryBundle(query_str=question, embedding=embedding)
+
+def index_generation() -> str:
+    """
+    Fingerprint of the generation file, which builds rewrite only when they publish new artifacts
+    (incremental ingest updates don't); indexes built before it existed fall back to the state file.
+    """
+    for path in (settings.index_generation_path, settings.index_state_path):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        return f"{st.st_mtime_ns}:{st.st_size}"
+    return "none"
+
+def embed_query(text: str) -> List[float]:
+    return get_embed_model().get_query_embedding(text)
+
+async def aembed_query(text: str) -> List[float]:
+    EMBED_CALLS.inc()
+    with span("embed"):
+        return await get_embed_model().aget_query_embedding(text)
+
+def _lexical_path(name: str):
+    from rag.lexical import lexical_index_path
+    return lexical_index_path(settings.chroma_path, name)
+
+def _snapshot_path(name: str):
+    from rag.snapshot import snapshot_dir
+    return snapshot_dir(settings.chroma_path, name)
+
+REGISTRY = IndexRegistry(
+    client_fn=get_chroma,
+    generation_fn=index_generation,
+    max_size=settings.index_registry_size,
+    lexical_path_fn=_lexical_path,
+    snapshot_path_fn=_snapshot_path if settings.retrieval_mode == "snapshot" else None,
+    embed_model_fn=get_embed_model,
 )
 
-genai.configure(api_key=settings.google_api_key)
-LLM = genai.GenerativeModel(settings.gemini_chat_model)
+def servable(name: str) -> str:
+    """`name` if clients may query it (the configured collections; never partitions); UnknownCollection otherwise."""
+    if name != settings.chroma_collection and name not in settings.extra_collections:
+        raise UnknownCollection(name)
+    return name
+
+def require_collection(collection_name: Optional[str] = None) -> None:
+    """Raise UnknownCollection for collections that can't be served (no Chroma work in snapshot mode)."""
+    REGISTRY.require(servable(collection_name or settings.chroma_collection))
 
-CHROMA = chromadb.PersistentClient(path=str(settings.chroma_path))
+async def arequire_collection(collection_name: Optional[str] = None) -> None:
+    """require_collection for the event loop: a missing or stale entry (Chroma, BM25, snapshot) loads in a thread."""
+    name = servable(collection_name or settings.chroma_collection)
+    if not REGISTRY.current(name):
+        await asyncio.to_thread(REGISTRY.require, name)
 
 def get_index(collection_name: Optional[str] = None) -> VectorStoreIndex:
-    col = CHROMA.get_or_create_collection(name=collection_name or settings.chroma_collection)
-    vstore = ChromaVectorStore(chroma_collection=col)
-    return VectorStoreIndex.from_vector_store(vstore)
+    """Warm index for an existing collection; raises UnknownCollection otherwise."""
+    return REGISTRY.get_index(collection_name or settings.chroma_collection)
+
+async def lexical_only(collection_name: Optional[str], question: str) -> bool:
+    """Exact-term queries go to BM25 alone when the collection has a lexical index (no embedding call)."""
+    from rag.lexical import is_exact_term_query
+    if not is_exact_term_query(question):
+        return False
+    await arequire_collection(collection_name)
+    return REGISTRY.has_lexical(collection_name or settings.chroma_collection)
+
+def _current(loaded: Dict[str, tuple], name: str) -> bool:
+    """True when `loaded[name]` (a (generation, value) pair) was built for the current index generation."""
+    hit = loaded.get(name)
+    return hit is not None and hit[0] == index_generation()
+
+_ROUTERS: Dict[str, tuple] = {}
+
+def get_router(collection_name: Optional[str] = None) -> Optional[QueryRouter]:
+    """Query router over the collection's partitions (None when it has none), reloaded when the index generation changes."""
+    name = collection_name or settings.chroma_collection
+    gen = index_generation()
+    hit = _ROUTERS.get(name)
+    if hit is not None and hit[0] == gen:
+        return hit[1]
+    router = None
+    if settings.route_max_partitions > 0:
+        partitions = load_partitions(partitions_path(settings.chroma_path, name))
+        if partitions:
+            router = QueryRouter(partitions, ROUTE_KEYWORDS, settings.route_max_partitions, settings.route_margin)
+    _ROUTERS[name] = (gen, router)
+    return router
+
+async def route(collection_name: Optional[str], query: QueryBundle, top_k: int) -> Tuple[List[str], int]:
+    """Collections to search and the k to use: the routed partitions (k capped at ROUTE_TOP_K), or the whole collection."""
+    name = collection_name or settings.chroma_collection
+    # the partition manifest is re-read in a thread after a re-index
+    router = _ROUTERS[name][1] if _current(_ROUTERS, name) else await asyncio.to_thread(get_router, name)
+    families = router.route(query.query_str, query.embedding) if router is not None else []
+    ROUTED_QUERIES.inc(route=",".join(families) or "all")
+    if not families:
+        return [name], top_k
+    return router.collections_for(families), min(top_k, settings.route_top_k)
+
+async def aretrieve(collection_name: Optional[str], query: QueryBundle, top_k: int):
+    """Top-k nodes for the query; a bundle without an embedding uses the lexical index only."""
+    names, k = await route(collection_name, query, top_k)
+    # Chroma's local query is synchronous, and a re-index reloads the collection; keep both off the event loop.
+    with span("retrieve"):
+        results = await asyncio.gather(*(
+            asyncio.to_thread(lambda n=name: REGISTRY.get_retriever(n, k).retrieve(query)) for name in names
+        ))
+    nodes = merge_hits(results, k) if len(results) > 1 else results[0]
+    RETRIEVED_NODES.observe(len(nodes), mode="vector" if query.embedding is not None else "lexical")
+    return nodes
+
+async def aretrieve_many(collection_name: Optional[str], queries: List[QueryBundle], top_k: int):
+    """Batched retrieval: one Chroma query per searched collection for all the queries routed to it."""
+    routes = [await route(collection_name, q, top_k) for q in queries]
+    wanted: Dict[Tuple[str, int], List[int]] = {}
+    for i, (names, k) in enumerate(routes):
+        for name in names:
+            wanted.setdefault((name, k), []).append(i)
+    keys = list(wanted)
+    with span("retrieve"):
+        found = await asyncio.gather(*(
+            asyncio.to_thread(REGISTRY.retrieve_many, name, [queries[i] for i in wanted[(name, k)]], k) for name, k in keys
+        ))
+    hits: List[list] = [[] for _ in queries]
+    for key, rows in zip(keys, found):
+        for i, nodes in zip(wanted[key], rows):
+            hits[i].append(nodes)
+    results = [merge_hits(h, k) if len(h) > 1 else h[0] for h, (_, k) in zip(hits, routes)]
+    for nodes in results:
+        RETRIEVED_NODES.observe(len(nodes), mode="batch")
+    return results
+
+async def acarry_nodes(collection_name: Optional[str], node_ids: List[str], nodes: list) -> list:
+    """
+    Append previously retrieved chunks (by node ID) that are not already in `nodes`,
+    scored just below the weakest new hit so context packing prefers fresh results.
+    """
+    have = {n.node.node_id for n in nodes}
+    ids = [i for i in node_ids if i not in have]
+    if not ids:
+        return nodes
+    from llama_index.core.schema import NodeWithScore
+    name = collection_name or settings.chroma_collection
+    with span("carry_nodes"):
+        carried = await asyncio.to_thread(REGISTRY.get_nodes, name, ids)
+    floor = min((n.score or 0.0 for n in nodes), default=1.0) * 0.99
+    return list(nodes) + [NodeWithScore(node=n, score=floor) for n in carried]
+
+def prompts_fingerprint() -> str:
+    """Hash of every template in prompts.py; editing one invalidates cached LLM responses."""
+    templates = sorted((k, v) for k, v in vars(prompts).items() if k.isupper() and isinstance(v, str))
+    return hashlib.sha1(repr(templates).encode("utf-8")).hexdigest()[:12]
+
+PROMPTS_FINGERPRINT = prompts_fingerprint()
+
+LLM_CACHE = LLMResponseCache(
+    path=settings.llm_cache_path,
+    max_entries=settings.llm_cache_size,
+    namespace_fn=lambda: f"{index_generation()}:{PROMPTS_FINGERPRINT}",
+)
+
+# Every Gemini generate call goes through the gateway: bounded concurrency + queue, deadlines, retries
+LLM_GATEWAY = LLMGateway(
+    max_inflight=settings.llm_max_inflight,
+    max_queue=settings.llm_max_queue,
+    timeout_s=settings.llm_timeout_s,
+    deadline_s=settings.llm_deadline_s,
+    max_retries=settings.llm_max_retries,
+    hedge_after_s=settings.llm_hedge_after_s,
+)
+
+async def cached_llm_text(prompt: str, stage: str) -> Optional[str]:
+    if not LLM_CACHE.enabled:
+        return None
+    # SQLite (shared by every worker) stays off the event loop
+    text = await asyncio.to_thread(LLM_CACHE.get, settings.gemini_chat_model, prompt)
+    LLM_CACHE_LOOKUPS.inc(stage=stage, result="miss" if text is None else "hit")
+    return text
+
+async def agenerate_text(prompt: str, stage: str = "llm", cache: bool = True) -> str:
+    """`cache=False` skips the shared LLM cache (prompts carrying one conversation's context)."""
+    cached = await cached_llm_text(prompt, stage) if cache else None
+    if cached is not None:
+        return cached
+    LLM_CALLS.inc(stage=stage)
+    with span(stage):
+        resp = await LLM_GATEWAY.call(lambda: get_llm().generate_content_async(prompt), stage)
+    count_llm_usage(resp)
+    text = resp.text or ""
+    if cache:
+        await asyncio.to_thread(LLM_CACHE.put, settings.gemini_chat_model, prompt, text)
+    return text
+
+async def astream_text(prompt: str, stage: str = "llm_stream", cache: bool = True) -> AsyncIterator[str]:
+    cached = await cached_llm_text(prompt, stage) if cache else None
+    if cached is not None:
+        yield cached
+        return
+    LLM_CALLS.inc(stage=stage)
+    t0 = time.perf_counter()
+    first = True
+    parts: List[str] = []
+    try:
+        async with LLM_GATEWAY.slot(stage) as deadline:
+            # retried until the stream opens; after that each chunk must arrive within the per-call timeout
+            resp = await LLM_GATEWAY.run(
+                lambda: get_llm().generate_content_async(prompt, stream=True), stage, deadline, hedge=False
+            )
+            chunks = resp.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), LLM_GATEWAY.timeout_s)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError as e:
+                    # stalled mid-stream: no retry (tokens were already sent), end it like a failed call
+                    LLM_GATEWAY_EVENTS.inc(event="gave_up", stage=stage)
+                    raise LLMUnavailable(LLM_GATEWAY.retry_after(), e) from e
+                try:
+                    piece = chunk.text
+                except ValueError:
+                    # chunk without text parts (e.g. finish/safety metadata)
+                    continue
+                if piece:
+                    if first:
+                        record(f"{stage}_first_token", time.perf_counter() - t0)
+                        first = False
+                    parts.append(piece)
+                    yield piece
+        count_llm_usage(resp)  # aggregated once the stream is consumed
+        if cache:
+            await asyncio.to_thread(LLM_CACHE.put, settings.gemini_chat_model, prompt, "".join(parts))
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+def build_prompt(nodes, question: str) -> str:
+    with span("pack_context"):
+        ctx = pack_context(nodes, settings.context_token_budget, settings.context_mmr_lambda)
+    return prompts.SYSTEM_PROMPT.format(context=ctx, question=question)
+
+_FAQS: Dict[str, tuple] = {}
+
+def get_faq(collection_name: Optional[str] = None) -> Optional[FAQIndex]:
+    """
+    Precomputed FAQ answers for the collection, reloaded when the index generation changes.
+    Answers built against a different index state are not served.
+    """
+    name = collection_name or settings.chroma_collection
+    gen = index_generation()
+    hit = _FAQS.get(name)
+    if hit is not None and hit[0] == gen:
+        return hit[1]
+    faq = FAQIndex.load(faq_path(settings.chroma_path, name))
+    if faq is not None and faq.state_sha1 != state_fingerprint(settings.index_generation_path):
+        faq = None
+    _FAQS[name] = (gen, faq)
+    return faq
+
+async def aget_faq(collection_name: Optional[str] = None) -> Optional[FAQIndex]:
+    """get_faq for the event loop: the FAQ file is re-read in a thread after a re-index."""
+    name = collection_name or settings.chroma_collection
+    if _current(_FAQS, name):
+        return _FAQS[name][1]
+    return await asyncio.to_thread(get_faq, name)
+
+def warm_up(collection_name: Optional[str] = None, query: str = "commencement") -> float:
+    """Create the clients, load the collection's index and run one retrieval. Returns seconds taken."""
+    t0 = time.perf_counter()
+    get_llm()
+    name = collection_name or settings.chroma_collection
+    REGISTRY.get_retriever(name, 1).retrieve(make_query(query, embed_query(query)))
+    return time.perf_counter() - t0
+
+def readiness(collection_name: Optional[str] = None) -> Dict[str, Any]:
+    """Checks behind /readyz: API key configured, index built, default collection loadable."""
+    checks: Dict[str, Any] = {
+        "api_key": bool(settings.google_api_key),
+        "index_built": index_generation() != "none",
+    }
+    try:
+        require_collection(collection_name)
+        checks["collection"] = True
+    except Exception as e:
+        checks["collection"] = False
+        checks["error"] = f"{type(e).__name__}: {e}"
+    return checks
+
+SESSIONS = SessionStore(
+    path=settings.session_path,
+    ttl_s=settings.session_ttl_s,
+    enabled=settings.sessions_enabled,
+)
+
+def session_history(session: Session) -> List[ChatTurn]:
+    """The session's condensed exchanges as turns, in place of client-sent history."""
+    turns: List[ChatTurn] = []
+    for question, answer in session.exchanges:
+        turns += [ChatTurn(role="user", content=question), ChatTurn(role="assistant", content=answer)]
+    return turns
+
+def seed_exchanges(turns: List[ChatTurn]) -> List[List[str]]:
+    """(user, assistant) pairs from client history, for sessions that start mid-conversation."""
+    return [[u.content, a.content] for u, a in zip(turns, turns[1:]) if u.role == "user" and a.role == "assistant"]
+
+ANSWER_CACHE = SemanticAnswerCache(
+    generation_fn=index_generation,
+    max_items=settings.answer_cache_size,
+    ttl_s=settings.answer_cache_ttl_s,
+    threshold=settings.answer_cache_threshold,
+)
 
 # Helpers 
 def trim(sn: str, limit: int = 240) -> str:
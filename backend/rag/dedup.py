@@ -0,0 +1,211 @@
+from __future__ import annotations
+import hashlib, re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import numpy as np
+
+# Cross-page near-duplicate detection for cached sections (footers, ticket blurbs, directions
+# text repeated on many pages). 64-bit SimHash over word 3-shingles; an LSH table split into
+# max_distance + 1 bands finds every stored hash within that Hamming distance (pigeonhole).
+# SimHash is noisy on short texts, so candidates are confirmed by shingle Jaccard similarity
+# (estimated from MinHash signatures, a fixed size per section): sections that
+# differ in a time or a place are different facts, not duplicates.
+
+BITS = 64
+MINHASH_PERMS = 128
+_WORD_RE = re.compile(r"\w+")
+_rng = np.random.default_rng(20240501)
+_PERM_A = _rng.integers(1, 2**63, MINHASH_PERMS, dtype=np.uint64) | np.uint64(1)  # odd: a bijection mod 2^64
+_PERM_B = _rng.integers(0, 2**63, MINHASH_PERMS, dtype=np.uint64)
+
+def shingle_digests(text: str, shingle: int = 3) -> List[bytes]:
+    """8-byte digests of the lowercased word n-grams of `text`."""
+    words = _WORD_RE.findall((text or "").lower())
+    if not words:
+        return []
+    grams = (" ".join(words[i:i + shingle]) for i in range(max(1, len(words) - shingle + 1)))
+    return [hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest() for g in grams]
+
+def simhash(digests: List[bytes]) -> int:
+    if not digests:
+        return 0
+    bits = np.unpackbits(np.frombuffer(b"".join(digests), dtype=np.uint8).reshape(len(digests), 8), axis=1)
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(digests)
+    return int.from_bytes(np.packbits(votes > 0).tobytes(), "big")
+
+def minhash(digests: List[bytes]) -> np.ndarray:
+    x = np.frombuffer(b"".join(digests), dtype=np.uint64)
+    if not len(x):
+        return np.zeros(MINHASH_PERMS, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        return (x[:, None] * _PERM_A + _PERM_B).min(axis=0)
+
+def jaccard_estimate(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean(a == b))
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+class SimHashLSH:
+    """Banded index over 64-bit SimHashes; `candidates` lists stored keys within `max_distance` bits, closest first."""
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.width = BITS // self.bands
+        self._tables: List[Dict[int, Set[Any]]] = [{} for _ in range(self.bands)]
+        self._hashes: Dict[Any, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def _band_values(self, h: int) -> List[int]:
+        mask = (1 << self.width) - 1
+        return [(h >> (b * self.width)) & mask for b in range(self.bands - 1)] + [h >> ((self.bands - 1) * self.width)]
+
+    def hash_of(self, key: Any) -> int:
+        return self._hashes[key]
+
+    def add(self, key: Any, h: int) -> None:
+        self.remove(key)
+        self._hashes[key] = h
+        for table, v in zip(self._tables, self._band_values(h)):
+            table.setdefault(v, set()).add(key)
+
+    def remove(self, key: Any) -> None:
+        h = self._hashes.pop(key, None)
+        if h is None:
+            return
+        for table, v in zip(self._tables, self._band_values(h)):
+            bucket = table[v]
+            bucket.discard(key)
+            if not bucket:
+                del table[v]
+
+    def candidates(self, h: int) -> List[Any]:
+        found: Dict[Any, int] = {}
+        for table, v in zip(self._tables, self._band_values(h)):
+            for key in table.get(v, ()):
+                if key not in found:
+                    found[key] = hamming(h, self._hashes[key])
+        return [k for k, d in sorted(found.items(), key=lambda kv: kv[1]) if d <= self.max_distance]
+
+@dataclass
+class DedupStats:
+    sections: int = 0
+    dropped: int = 0
+    pages_changed: int = 0
+
+def _index_key(content_sha1: str, dropped: List[int]) -> str:
+    if not dropped:
+        return content_sha1
+    return hashlib.sha1(f"{content_sha1}:{','.join(map(str, dropped))}".encode("utf-8")).hexdigest()
+
+Key = Tuple[str, int]  # (url, section index)
+
+class NearDuplicateFilter:
+    """
+    Keeps each repeated section once: a section is dropped when one within `max_distance` SimHash
+    bits and `min_jaccard` shingle overlap comes before it, on a page with a smaller URL or earlier
+    on the same page. With `group_fn` (url -> group), sections are only compared within a group,
+    so every group keeps its own copy. Sections shorter than `min_chars` are always kept;
+    `max_distance` < 0 disables the filter.
+
+    The index holds every long-enough section of the pages added so far and is updated page by
+    page: `update` replaces one page's sections and returns the other pages whose kept sections
+    may have changed with it, so a long-lived filter never has to see the whole corpus again.
+    """
+    def __init__(
+        self,
+        max_distance: int = 6,
+        min_jaccard: float = 0.9,
+        min_chars: int = 80,
+        group_fn: Optional[Callable[[str], str]] = None,
+    ):
+        self.max_distance = max_distance
+        self.min_jaccard = min_jaccard
+        self.min_chars = min_chars
+        self.group_fn = group_fn
+        self.stats = DedupStats()
+        self._lsh: Dict[str, SimHashLSH] = {}
+        self._signatures: Dict[Key, np.ndarray] = {}
+        self._keys: Dict[str, List[Key]] = {}
+
+    def _index(self, url: str) -> SimHashLSH:
+        group = self.group_fn(url) if self.group_fn else ""
+        return self._lsh.setdefault(group, SimHashLSH(self.max_distance))
+
+    def _matches(self, key: Key) -> Iterator[Key]:
+        """Indexed sections (other than `key`) that are near-duplicates of section `key`."""
+        lsh = self._index(key[0])
+        sig = self._signatures[key]
+        for k in lsh.candidates(lsh.hash_of(key)):
+            if k != key and jaccard_estimate(sig, self._signatures[k]) >= self.min_jaccard:
+                yield k
+
+    def add(self, page: Dict[str, Any]) -> None:
+        """Index the page's sections, replacing whatever was indexed for its URL."""
+        url = page.get("url") or ""
+        self.remove(url)
+        if self.max_distance < 0:
+            return
+        lsh = self._index(url)
+        keys: List[Key] = []
+        for i, sec in enumerate(page.get("sections") or []):
+            text = (sec.get("text") or "").strip()
+            if len(text) >= self.min_chars:
+                digests = shingle_digests(text)
+                lsh.add((url, i), simhash(digests))
+                self._signatures[(url, i)] = minhash(digests)
+                keys.append((url, i))
+        self._keys[url] = keys
+
+    def remove(self, url: str) -> None:
+        keys = self._keys.pop(url, [])
+        if keys:
+            lsh = self._index(url)
+            for key in keys:
+                lsh.remove(key)
+                del self._signatures[key]
+
+    def neighbours(self, url: str) -> Set[str]:
+        """Other pages holding a near-duplicate of one of this page's indexed sections."""
+        return {k[0] for key in self._keys.get(url, []) for k in self._matches(key) if k[0] != url}
+
+    def update(self, page: Optional[Dict[str, Any]], url: str) -> Set[str]:
+        """
+        Re-index one page (None: it is gone) and return the other pages sharing a section with its
+        old or new version; their kept sections may have changed.
+        """
+        affected = self.neighbours(url)
+        if page is None:
+            self.remove(url)
+        else:
+            self.add(page)
+            affected |= self.neighbours(url)
+        affected.discard(url)
+        return affected
+
+    def apply(self, page: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Copy of an indexed page with only its kept sections and an `index_key`: the page's
+        content_sha1, changed when sections were dropped, so a page is re-indexed whenever its
+        kept set changes.
+        """
+        url = page.get("url") or ""
+        kept: List[Dict[str, Any]] = []
+        dropped: List[int] = []
+        for i, sec in enumerate(page.get("sections") or []):
+            self.stats.sections += 1
+            key = (url, i)
+            if key in self._signatures and any(k < key for k in self._matches(key)):
+                dropped.append(i)
+                continue
+            kept.append(sec)
+        self.stats.dropped += len(dropped)
+        self.stats.pages_changed += bool(dropped)
+        return dict(page, sections=kept, index_key=_index_key(page.get("content_sha1") or "", dropped))
+
+    def stream(self, pages: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for page in pages:
+            self.add(page)
+            yield self.apply(page)
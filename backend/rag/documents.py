@@ -2,10 +2,17 @@ from __future__ import annotations
 from typing import List, Dict, Any
 import hashlib
 from llama_index.core import Document
+from llama_index.core.schema import BaseNode
 
 def _sha1(s: str) -> str:
     return hashlib.sha1(s.encode("utf-8")).hexdigest()
 
+# Per-fetch bookkeeping; kept out of the embedded text so unchanged chunks hash the same
+VOLATILE_META_KEYS = ["fetched_at", "content_sha1", "section_sha1", "source_type"]
+# Version of the embedded text (body layout + metadata included), stored on each Chroma collection.
+# Bump it whenever either changes: collections built with another version are re-embedded in full.
+EMBED_TEXT_VERSION = "2"
+
 def pages_to_documents(pages: List[Dict[str, Any]]) -> List[Document]:
     """
     Turns cached page JSON into LlamaIndex Documents.
@@ -38,5 +45,24 @@ def pages_to_documents(pages: List[Dict[str, Any]]) -> List[Document]:
                 "source_type": "web",
             }
 
-            out.append(Document(text=body, metadata=meta))
+            out.append(Document(
+                id_=_sha1(f"{url}\n{title}\n{sec_hash}"),
+                text=body,
+                metadata=meta,
+                excluded_embed_metadata_keys=list(VOLATILE_META_KEYS),
+                excluded_llm_metadata_keys=list(VOLATILE_META_KEYS),
+            ))
     return out
+
+def assign_chunk_ids(nodes: List[BaseNode]) -> List[BaseNode]:
+    """
+    Give chunks deterministic IDs: (source document, ordinal within it, chunk text).
+    The same section text always produces the same IDs, so re-indexing can diff by ID.
+    """
+    ordinals: Dict[str, int] = {}
+    for n in nodes:
+        doc_id = n.ref_doc_id or ""
+        i = ordinals.get(doc_id, 0)
+        ordinals[doc_id] = i + 1
+        n.id_ = _sha1(f"{doc_id}:{i}:{_sha1(n.get_content())}")
+    return nodes
@@ -0,0 +1,52 @@
+from __future__ import annotations
+import hashlib, pathlib, sqlite3
+from array import array
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+def text_hash(s: str) -> str:
+    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    Persistent embedding store keyed by (embedding model, sha1 of the embedded text).
+    Vectors are stored as float32 blobs in SQLite next to the vector store.
+    """
+    def __init__(self, path: pathlib.Path):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, text_sha1 TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, text_sha1))"
+        )
+        self.conn.commit()
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        out: Dict[str, List[float]] = {}
+        uniq = list(dict.fromkeys(hashes))
+        # stay under SQLite's bound-parameter limit
+        for i in range(0, len(uniq), 500):
+            chunk = uniq[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT text_sha1, vector FROM embeddings WHERE model = ? AND text_sha1 IN ({marks})",
+                [model, *chunk],
+            )
+            for h, blob in rows:
+                vec = array("f")
+                vec.frombytes(blob)
+                out[h] = vec.tolist()
+        return out
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, List[float]]]) -> None:
+        rows = [(model, h, len(v), array("f", v).tobytes()) for h, v in items]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_sha1, dim, vector) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def close(self) -> None:
+        self.conn.close()
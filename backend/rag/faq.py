@@ -0,0 +1,131 @@
+from __future__ import annotations
+import asyncio, hashlib, json, pathlib, re
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+import numpy as np
+from schemas import ChatResponse
+from rag.answer_cache import normalize_question
+
+QUESTION_RE = re.compile(
+    r"^(who|what|when|where|which|why|how|can|could|do|does|did|is|are|will|would|should|may|must)\b", re.I
+)
+
+def faq_path(chroma_path: pathlib.Path, collection: str) -> pathlib.Path:
+    return pathlib.Path(chroma_path) / f"faq_{collection}.json"
+
+def state_fingerprint(state_path: pathlib.Path) -> str:
+    """sha1 of the index generation file; FAQ answers are only served for the generation they were built from."""
+    try:
+        return hashlib.sha1(pathlib.Path(state_path).read_bytes()).hexdigest()
+    except FileNotFoundError:
+        return "none"
+
+def looks_like_question(title: str) -> bool:
+    t = (title or "").strip()
+    return len(t.split()) >= 3 and (t.endswith("?") or bool(QUESTION_RE.match(t)))
+
+def faq_questions(pages: Iterable[Dict[str, Any]], url_markers: Iterable[str], extra: Iterable[str] = ()) -> List[str]:
+    """Question-like section titles from FAQ pages, then the configured questions; deduplicated."""
+    markers = tuple(url_markers)
+    out: Dict[str, str] = {}
+    for p in pages:
+        if not any(m in (p.get("url") or "") for m in markers):
+            continue
+        for sec in p.get("sections") or []:
+            title = (sec.get("title") or "").strip()
+            if looks_like_question(title):
+                out.setdefault(normalize_question(title), title)
+    for q in extra:
+        if q.strip():
+            out.setdefault(normalize_question(q), q.strip())
+    return list(out.values())
+
+def load_question_file(path: pathlib.Path) -> List[str]:
+    """One question per line; blank lines and `#` comments are ignored."""
+    path = pathlib.Path(path)
+    if not path.exists():
+        return []
+    return [ln.strip() for ln in path.read_text(encoding="utf-8").splitlines() if ln.strip() and not ln.startswith("#")]
+
+@dataclass
+class FAQEntry:
+    question: str
+    response: ChatResponse
+    embedding: List[float] = field(default_factory=list)
+
+class FAQIndex:
+    """Precomputed answers for known questions, matched by normalized text or question embedding."""
+    def __init__(self, entries: List[FAQEntry], state_sha1: str = ""):
+        self.entries = entries
+        self.state_sha1 = state_sha1
+        self._by_text = {normalize_question(e.question): e for e in entries}
+        vecs = [np.asarray(e.embedding, dtype=np.float32) for e in entries if e.embedding]
+        self._with_vec = [e for e in entries if e.embedding]
+        if vecs:
+            m = np.vstack(vecs)
+            norms = np.linalg.norm(m, axis=1, keepdims=True)
+            self._matrix = m / np.where(norms == 0, 1, norms)
+        else:
+            self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def match_text(self, question: str) -> Optional[ChatResponse]:
+        e = self._by_text.get(normalize_question(question))
+        return e.response.model_copy(deep=True) if e else None
+
+    def match_embedding(self, embedding: List[float], threshold: float) -> Optional[ChatResponse]:
+        if self._matrix is None or embedding is None:
+            return None
+        q = np.asarray(embedding, dtype=np.float32)
+        n = np.linalg.norm(q)
+        if not n:
+            return None
+        sims = self._matrix @ (q / n)
+        best = int(np.argmax(sims))
+        if float(sims[best]) < threshold:
+            return None
+        return self._with_vec[best].response.model_copy(deep=True)
+
+    def save(self, path: pathlib.Path) -> None:
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({
+            "state_sha1": self.state_sha1,
+            "entries": [
+                {"question": e.question, "response": e.response.model_dump(), "embedding": e.embedding}
+                for e in self.entries
+            ],
+        }, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> Optional["FAQIndex"]:
+        path = pathlib.Path(path)
+        if not path.exists():
+            return None
+        data = json.loads(path.read_text(encoding="utf-8"))
+        entries = [
+            FAQEntry(question=d["question"], response=ChatResponse(**d["response"]), embedding=d.get("embedding") or [])
+            for d in data.get("entries", [])
+        ]
+        return cls(entries, state_sha1=data.get("state_sha1", ""))
+
+async def build_faq_entries(
+    questions: List[str],
+    embed_fn: Callable[[str], Awaitable[List[float]]],
+    answer_fn: Callable[[str, List[float]], Awaitable[Optional[ChatResponse]]],
+    concurrency: int = 4,
+) -> List[FAQEntry]:
+    """Embed each question and answer it with `answer_fn`; questions without an answer are left out."""
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(q: str) -> Optional[FAQEntry]:
+        async with sem:
+            emb = await embed_fn(q)
+            resp = await answer_fn(q, emb)
+        return FAQEntry(question=q, response=resp, embedding=list(emb)) if resp is not None else None
+
+    return [e for e in await asyncio.gather(*(one(q) for q in questions)) if e is not None]
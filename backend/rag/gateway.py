@@ -0,0 +1,174 @@
+from __future__ import annotations
+import asyncio, math, random, time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+from rag.metrics import LLM_GATEWAY_EVENTS, record
+
+T = TypeVar("T")
+
+# Upstream errors worth another attempt: rate limits, transient server errors, timeouts.
+# Matched by class name / status code so google.api_core is not imported here.
+RETRYABLE_ERRORS = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "BadGateway",
+}
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+def is_retryable(e: BaseException) -> bool:
+    if isinstance(e, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return type(e).__name__ in RETRYABLE_ERRORS or getattr(e, "code", None) in RETRYABLE_CODES
+
+class Overloaded(Exception):
+    """The LLM queue is full (or a slot didn't free up before the deadline); retry after `retry_after` seconds."""
+    def __init__(self, retry_after: int):
+        super().__init__(f"LLM queue is full; retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class LLMUnavailable(Exception):
+    """Gemini kept failing (rate limits, 5xx, timeouts) until retries or the deadline ran out."""
+    def __init__(self, retry_after: int, cause: BaseException):
+        super().__init__(f"LLM unavailable: {cause!r}")
+        self.retry_after = retry_after
+
+class LLMGateway:
+    """
+    Admission control for Gemini calls in this worker.
+
+    At most `max_inflight` calls run at once and up to `max_queue` more wait for a slot;
+    anything beyond that is rejected immediately with Overloaded, as is a caller whose
+    slot doesn't free up before its deadline. Each attempt gets `timeout_s`, and retryable
+    failures are retried with jittered exponential backoff while the overall `deadline_s`
+    (queueing included) allows. With `hedge_after_s` > 0, an attempt still running after
+    that long gets a duplicate request when a slot is free without waiting; the first
+    result wins and the other is cancelled.
+    """
+    def __init__(
+        self,
+        max_inflight: int = 16,
+        max_queue: int = 64,
+        timeout_s: float = 30.0,
+        deadline_s: float = 60.0,
+        max_retries: int = 2,
+        hedge_after_s: float = 0.0,
+    ):
+        self.max_inflight = max(1, max_inflight)
+        self.max_queue = max(0, max_queue)
+        self.timeout_s = timeout_s
+        self.deadline_s = deadline_s
+        self.max_retries = max_retries
+        self.hedge_after_s = hedge_after_s
+        self.waiting = 0
+        self._avg_s = 1.0  # moving average of call time, for Retry-After hints
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # one semaphore per event loop (scripts may call asyncio.run more than once)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._sem, self.waiting = loop, asyncio.Semaphore(self.max_inflight), 0
+        return self._sem
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue has likely drained."""
+        return max(1, math.ceil(self._avg_s * (self.waiting + 1) / self.max_inflight))
+
+    def admit(self) -> None:
+        """Raise Overloaded now if a new call would be rejected; lets routes shed load before doing any work."""
+        if self._semaphore().locked() and self.waiting >= self.max_queue:
+            LLM_GATEWAY_EVENTS.inc(event="rejected")
+            raise Overloaded(self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self, stage: str) -> AsyncIterator[float]:
+        """Hold one in-flight slot; yields the call's deadline (event loop time)."""
+        sem = self._semaphore()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline_s
+        if sem.locked():
+            self.admit()
+            self.waiting += 1
+            t0 = time.perf_counter()
+            try:
+                await asyncio.wait_for(sem.acquire(), self.deadline_s)
+            except asyncio.TimeoutError:
+                LLM_GATEWAY_EVENTS.inc(event="queue_timeout")
+                raise Overloaded(self.retry_after()) from None
+            finally:
+                self.waiting -= 1
+                record(f"{stage}_queue", time.perf_counter() - t0)
+        else:
+            await sem.acquire()
+        try:
+            yield deadline
+        finally:
+            sem.release()
+
+    async def call(self, fn: Callable[[], Awaitable[T]], stage: str) -> T:
+        """`fn()` under a slot, with deadlines, retries and (when enabled) hedging."""
+        async with self.slot(stage) as deadline:
+            return await self.run(fn, stage, deadline)
+
+    async def run(self, fn: Callable[[], Awaitable[T]], stage: str, deadline: float, hedge: bool = True) -> T:
+        """Attempts of `fn()` for a caller already holding a slot."""
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - loop.time()
+            t0 = time.perf_counter()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                timeout = min(self.timeout_s, remaining)
+                if hedge and 0 < self.hedge_after_s < timeout:
+                    result = await self._hedged(fn, stage, timeout)
+                else:
+                    result = await asyncio.wait_for(fn(), timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                delay = min(8.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+                if attempt == self.max_retries or deadline - loop.time() <= delay:
+                    LLM_GATEWAY_EVENTS.inc(event="gave_up", stage=stage)
+                    raise LLMUnavailable(self.retry_after(), e) from e
+                LLM_GATEWAY_EVENTS.inc(event="retry", stage=stage)
+                await asyncio.sleep(delay)
+                continue
+            self._avg_s = 0.8 * self._avg_s + 0.2 * (time.perf_counter() - t0)
+            return result
+        raise AssertionError("unreachable")
+
+    async def _hedged(self, fn: Callable[[], Awaitable[T]], stage: str, timeout: float) -> T:
+        """One attempt that may race a duplicate request; the first success wins."""
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout
+        primary = asyncio.ensure_future(fn())
+        tasks = {primary}
+        sem = self._semaphore()
+        hedged = False
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after_s)
+            if not done and not sem.locked():
+                await sem.acquire()  # free slot: returns without waiting
+                hedged = True
+                LLM_GATEWAY_EVENTS.inc(event="hedge", stage=stage)
+                tasks.add(asyncio.ensure_future(fn()))
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, timeout=end - loop.time(), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for t in done:
+                    # an attempt cancelled from outside counts as a failed (retryable) attempt
+                    exc = ConnectionError("LLM request was cancelled") if t.cancelled() else t.exception()
+                    if exc is None:
+                        if hedged and t is not primary:
+                            LLM_GATEWAY_EVENTS.inc(event="hedge_won", stage=stage)
+                        return t.result()
+                    error = exc
+            raise error
+        finally:
+            for t in tasks:
+                t.cancel()
+            if hedged:
+                sem.release()
@@ -0,0 +1,143 @@
+from __future__ import annotations
+import asyncio, random, time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Sequence
+from llama_index.core import Document
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import BaseNode, MetadataMode
+from rag.documents import assign_chunk_ids
+from rag.embed_cache import EmbeddingCache, text_hash
+from rag.gateway import is_retryable
+
+# Chunking
+
+def _split(documents: List[Document], chunk_size: int, chunk_overlap: int) -> List[BaseNode]:
+    splitter = SentenceSplitter(separator=" ", chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return splitter.get_nodes_from_documents(documents)
+
+def chunk_documents(
+    documents: List[Document],
+    chunk_size: int,
+    chunk_overlap: int,
+    workers: int = 1,
+    min_parallel: int = 200,
+) -> List[BaseNode]:
+    """
+    Split documents into chunks with deterministic IDs. Large inputs are split across
+    worker processes; each document stays in one worker so chunk ordinals are stable.
+    """
+    if workers <= 1 or len(documents) < min_parallel:
+        return assign_chunk_ids(_split(documents, chunk_size, chunk_overlap))
+    size = -(-len(documents) // workers)
+    parts = [documents[i:i + size] for i in range(0, len(documents), size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(_split, parts, [chunk_size] * len(parts), [chunk_overlap] * len(parts))
+        nodes = [n for part in results for n in part]
+    return assign_chunk_ids(nodes)
+
+# Embedding
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`."""
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+@dataclass
+class EmbedStats:
+    cached: int = 0
+    embedded: int = 0
+    written: int = 0
+    retries: int = 0
+
+async def embed_and_store(
+    nodes: Sequence[BaseNode],
+    embed_model,
+    vector_store,
+    cache: EmbeddingCache,
+    model_name: str,
+    batch_size: int,
+    concurrency: int = 4,
+    requests_per_min: float = 600,
+    max_retries: int = 5,
+) -> EmbedStats:
+    """
+    Embed nodes and add them to the vector store batch by batch.
+
+    Cached vectors are reused; misses go to the embedding API in concurrent batches
+    paced by a token bucket; transient failures (rate limits, 5xx, timeouts) are retried
+    with jittered exponential backoff, anything else fails the run at once. Each batch
+    is written as soon as it finishes, so an interrupted run keeps its progress.
+    """
+    stats = EmbedStats()
+    texts = [n.get_content(metadata_mode=MetadataMode.EMBED) for n in nodes]
+    hashes = [text_hash(t) for t in texts]
+    found = cache.get_many(model_name, hashes)
+
+    write_lock = asyncio.Lock()
+
+    async def write(batch: List[BaseNode]) -> None:
+        async with write_lock:
+            await asyncio.to_thread(vector_store.add, batch)
+        stats.written += len(batch)
+
+    ready: List[BaseNode] = []
+    misses: Dict[str, List[BaseNode]] = {}
+    miss_text: Dict[str, str] = {}
+    for n, h, t in zip(nodes, hashes, texts):
+        if h in found:
+            n.embedding = found[h]
+            ready.append(n)
+        else:
+            misses.setdefault(h, []).append(n)
+            miss_text.setdefault(h, t)
+    stats.cached = len(ready)
+    for i in range(0, len(ready), batch_size):
+        await write(ready[i:i + batch_size])
+
+    bucket = TokenBucket(rate=requests_per_min / 60.0, capacity=concurrency)
+    sem = asyncio.Semaphore(concurrency)
+    keys = list(misses)
+
+    async def run_batch(batch_keys: List[str]) -> None:
+        async with sem:
+            for attempt in range(max_retries + 1):
+                await bucket.acquire()
+                try:
+                    vectors = await embed_model.aget_text_embedding_batch([miss_text[k] for k in batch_keys])
+                    break
+                except Exception as e:
+                    # only transient errors (rate limits, 5xx, timeouts); bad input or auth fails every time
+                    if attempt == max_retries or not is_retryable(e):
+                        raise
+                    stats.retries += 1
+                    delay = min(60.0, 2 ** attempt) * (0.5 + random.random())
+                    print(f"[embed retry {attempt + 1}/{max_retries}] {e!r}; sleeping {delay:.1f}s")
+                    await asyncio.sleep(delay)
+        fresh = list(zip(batch_keys, vectors))
+        cache.put_many(model_name, fresh)
+        batch_nodes: List[BaseNode] = []
+        for k, vec in fresh:
+            for n in misses[k]:
+                n.embedding = vec
+                batch_nodes.append(n)
+        stats.embedded += len(batch_keys)
+        await write(batch_nodes)
+
+    await asyncio.gather(*(run_batch(keys[i:i + batch_size]) for i in range(0, len(keys), batch_size)))
+    return stats
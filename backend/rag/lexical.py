@@ -0,0 +1,152 @@
+from __future__ import annotations
+import json, math, pathlib, re
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from llama_index.core import QueryBundle
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, TextNode
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "at", "for", "is", "are", "be", "do",
+    "does", "i", "my", "me", "we", "our", "you", "your", "can", "will", "with", "it", "this", "that",
+}
+QUESTION_WORDS = {"what", "when", "where", "who", "why", "how", "which", "whom", "whose"}
+QUOTED_RE = re.compile(r'"([^"]+)"')
+
+def lexical_index_path(chroma_path: pathlib.Path, collection: str) -> pathlib.Path:
+    return pathlib.Path(chroma_path) / f"bm25_{collection}.json"
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall((text or "").lower()) if t not in STOPWORDS]
+
+def is_exact_term_query(query: str, max_terms: int = 4) -> bool:
+    """Quoted phrases or short keyword queries ("citi field parking lot") favour exact matching."""
+    if QUOTED_RE.search(query or ""):
+        return True
+    words = TOKEN_RE.findall((query or "").lower())
+    if not words or any(w in QUESTION_WORDS for w in words):
+        return False
+    return len([w for w in words if w not in STOPWORDS]) <= max_terms
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, node_id in enumerate(ranking):
+            scores[node_id] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+
+class BM25Index:
+    """
+    Small in-process Okapi BM25 index over the same chunks that live in Chroma
+    (same IDs, text and metadata), saved as JSON next to the vector store.
+    """
+    def __init__(self, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]], k1: float = 1.5, b: float = 0.75):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.k1 = k1
+        self.b = b
+        self._pos = {node_id: i for i, node_id in enumerate(ids)}
+        self._tf: List[Counter] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        for i, (text, meta) in enumerate(zip(texts, metadatas)):
+            tf = Counter(tokenize(f"{meta.get('section_title') or ''}\n{text}"))
+            self._tf.append(tf)
+            for term in tf:
+                self._postings[term].append(i)
+        n = max(1, len(ids))
+        self._doc_len = [sum(tf.values()) for tf in self._tf]
+        self._avg_len = (sum(self._doc_len) / n) or 1.0
+        self._idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for i in self._postings[term]:
+                tf = self._tf[i][term]
+                norm = self.k1 * (1 - self.b + self.b * self._doc_len[i] / self._avg_len)
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+        return [(self.ids[i], s) for i, s in best]
+
+    def node(self, node_id: str) -> Optional[TextNode]:
+        i = self._pos.get(node_id)
+        if i is None:
+            return None
+        return TextNode(id_=node_id, text=self.texts[i], metadata=dict(self.metadatas[i]))
+
+    def save(self, path: pathlib.Path) -> None:
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(
+            {"k1": self.k1, "b": self.b, "ids": self.ids, "texts": self.texts, "metadatas": self.metadatas},
+            ensure_ascii=False,
+        ), encoding="utf-8")
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> Optional["BM25Index"]:
+        path = pathlib.Path(path)
+        if not path.exists():
+            return None
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return cls(data["ids"], data["texts"], data["metadatas"], k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+
+    @classmethod
+    def from_chroma(cls, chroma_col) -> "BM25Index":
+        """Build from everything currently stored in a Chroma collection."""
+        got = chroma_col.get(include=["documents", "metadatas"])
+        metas = [
+            {k: v for k, v in (m or {}).items() if not k.startswith("_") and k not in ("document_id", "doc_id", "ref_doc_id")}
+            for m in got.get("metadatas") or []
+        ]
+        return cls(list(got.get("ids") or []), [d or "" for d in got.get("documents") or []], metas)
+
+def fuse_hits(
+    vec_hits: List[NodeWithScore],
+    lexical: BM25Index,
+    query: str,
+    top_k: int,
+    candidates: int,
+) -> List[NodeWithScore]:
+    """RRF-merge vector hits with BM25 hits for `query`; with no vector hits this is BM25 alone."""
+    lex_hits = lexical.search(query, candidates)
+    if not vec_hits:
+        return [NodeWithScore(node=lexical.node(i), score=s) for i, s in lex_hits[:top_k]]
+    by_id: Dict[str, NodeWithScore] = {h.node.node_id: h for h in vec_hits}
+    fused = reciprocal_rank_fusion([[h.node.node_id for h in vec_hits], [i for i, _ in lex_hits]])
+    out: List[NodeWithScore] = []
+    for node_id, score in fused[:top_k]:
+        node = by_id[node_id].node if node_id in by_id else lexical.node(node_id)
+        if node is not None:
+            out.append(NodeWithScore(node=node, score=score))
+    return out
+
+class HybridRetriever(BaseRetriever):
+    """
+    Vector + BM25 retrieval merged with reciprocal rank fusion.
+    A query bundle without an embedding is answered by BM25 alone (no embedding call).
+    """
+    def __init__(self, vector_retriever: BaseRetriever, lexical: BM25Index, top_k: int, candidates: int | None = None):
+        super().__init__()
+        self.vector_retriever = vector_retriever
+        self.lexical = lexical
+        self.top_k = top_k
+        self.candidates = candidates or top_k * 2
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if query_bundle.embedding is None:
+            return fuse_hits([], self.lexical, query_bundle.query_str, self.top_k, self.candidates)
+        vec_hits = self.vector_retriever.retrieve(query_bundle)
+        return fuse_hits(vec_hits, self.lexical, query_bundle.query_str, self.top_k, self.candidates)
@@ -0,0 +1,107 @@
+from __future__ import annotations
+import hashlib, pathlib, sqlite3, threading, time
+from typing import Callable, Dict, Optional, Tuple
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+class LLMResponseCache:
+    """
+    Persistent LLM response store keyed by (model, sha1 of the full prompt), in SQLite (WAL)
+    so every uvicorn worker on the host shares it. Entries belong to the namespace returned by
+    `namespace_fn` (index generation + prompt templates); rows from other namespaces are never
+    served and are dropped on the next write. Least recently used rows beyond `max_entries` are evicted.
+    Lookups only read: hit times are buffered in memory and written with the next `put` (or in batches),
+    and the size check runs every few puts, so the shared WAL file sees few, short write transactions.
+    Calls block on SQLite; async callers run them in a thread.
+    """
+    def __init__(self, path: pathlib.Path, max_entries: int, namespace_fn: Callable[[], str]):
+        self.path = pathlib.Path(path)
+        self.max_entries = max_entries
+        self.namespace_fn = namespace_fn
+        self._lock = threading.Lock()
+        self._namespace: Optional[str] = None
+        self._used: Dict[Tuple[str, str, str], float] = {}
+        self._puts = 0
+        self._trim_every = max(1, max_entries // 20)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " namespace TEXT NOT NULL, model TEXT NOT NULL, prompt_sha1 TEXT NOT NULL,"
+            " text TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (namespace, model, prompt_sha1))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.conn.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, model: str, prompt: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        key = (self.namespace_fn(), model, prompt_hash(prompt))
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT text FROM responses WHERE namespace = ? AND model = ? AND prompt_sha1 = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+            self._used[key] = time.time()
+            if len(self._used) >= self._trim_every:  # read-mostly traffic: write hits in batches
+                with self.conn:
+                    self._flush_used()
+        return row[0]
+
+    def _flush_used(self) -> None:
+        """Write buffered hit times; caller holds the lock and a transaction."""
+        if self._used:
+            self.conn.executemany(
+                "UPDATE responses SET last_used = ? WHERE namespace = ? AND model = ? AND prompt_sha1 = ?",
+                [(t, *k) for k, t in self._used.items()],
+            )
+            self._used.clear()
+
+    def put(self, model: str, prompt: str, text: str) -> None:
+        if not self.enabled or not text:
+            return
+        ns = self.namespace_fn()
+        now = time.time()
+        with self._lock, self.conn:
+            if ns != self._namespace:
+                # index or templates changed: earlier answers can't be served again
+                self.conn.execute("DELETE FROM responses WHERE namespace != ?", (ns,))
+                self._namespace = ns
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (namespace, model, prompt_sha1, text, created_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (ns, model, prompt_hash(prompt), text, now, now),
+            )
+            self._flush_used()
+            # size check and trim every few writes, so eviction cost is amortized
+            self._puts += 1
+            if self._puts % self._trim_every:
+                return
+            count = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM responses WHERE rowid IN"
+                    " (SELECT rowid FROM responses ORDER BY last_used LIMIT ?)",
+                    (max(excess, self.max_entries // 20),),
+                )
+
+    def clear(self) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM responses")
+            self._used.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            with self.conn:
+                self._flush_used()
+            self.conn.close()
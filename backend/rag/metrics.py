@@ -0,0 +1,204 @@
+from __future__ import annotations
+import bisect, contextvars, cProfile, random, re, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# In-process metrics rendered in the Prometheus text format, plus per-request
+# stage timings for the Server-Timing header. No client library needed.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _fmt_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+def _fmt_num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels(labels), 0.0)
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                out.append(f"{self.name}{_fmt_labels(key)} {_fmt_num(v)}")
+        return out
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.name, self.help = name, help
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts incl. +Inf, sum, count)
+        self._series: Dict[Labels, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            counts, total, n = self._series.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[key] = (counts, total + value, n + 1)
+
+    def summary(self) -> Dict[Labels, Tuple[int, float]]:
+        """labels -> (count, sum)"""
+        with self._lock:
+            return {k: (n, total) for k, (_, total, n) in self._series.items()}
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._series.items()):
+                acc = 0
+                for le, c in zip(self.buckets, counts):
+                    acc += c
+                    out.append(f"{self.name}_bucket{_fmt_labels(key, ('le', _fmt_num(le)))} {acc}")
+                out.append(f"{self.name}_bucket{_fmt_labels(key, ('le', '+Inf'))} {n}")
+                out.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_num(total)}")
+                out.append(f"{self.name}_count{_fmt_labels(key)} {n}")
+        return out
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics.values():
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("rag_stage_seconds", "Time spent per pipeline stage.")
+REQUEST_SECONDS = REGISTRY.histogram("http_request_duration_seconds", "HTTP request latency until headers are sent.")
+LLM_CALLS = REGISTRY.counter("llm_calls_total", "Gemini generate calls.")
+LLM_GATEWAY_EVENTS = REGISTRY.counter("llm_gateway_events_total", "LLM gateway rejections, retries and hedged requests.")
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "Gemini tokens reported in usage metadata.")
+ROUTED_QUERIES = REGISTRY.counter("router_routes_total", "Retrievals by searched partitions (all = whole collection).")
+EMBED_CALLS = REGISTRY.counter("embed_calls_total", "Query embedding calls.")
+CACHE_LOOKUPS = REGISTRY.counter("answer_cache_lookups_total", "Answer cache lookups by result.")
+LLM_CACHE_LOOKUPS = REGISTRY.counter("llm_cache_lookups_total", "Persistent LLM response cache lookups by result.")
+RETRIEVED_NODES = REGISTRY.histogram("rag_retrieved_nodes", "Nodes returned per retrieval.", COUNT_BUCKETS)
+PAGES_SCRAPED = REGISTRY.counter("scraper_pages_total", "Scraped pages by outcome.")
+
+# Per-request stage timings
+
+class Timings:
+    """Stage durations for one request, in insertion order (repeated stages add up)."""
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()  # spans also finish in to_thread workers
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def header(self) -> str:
+        """Server-Timing header value, durations in ms."""
+        with self._lock:
+            stages = list(self.stages.items())
+        return ", ".join(f"{re.sub(r'[^A-Za-z0-9_-]', '_', k)};dur={v * 1000:.1f}" for k, v in stages)
+
+_TIMINGS: contextvars.ContextVar[Optional[Timings]] = contextvars.ContextVar("rag_timings", default=None)
+
+@contextmanager
+def request_timings() -> Iterator[Timings]:
+    """Collect spans from this context (and tasks/threads started from it) into a fresh Timings."""
+    t = Timings()
+    token = _TIMINGS.set(t)
+    try:
+        yield t
+    finally:
+        _TIMINGS.reset(token)
+
+def record(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    t = _TIMINGS.get()
+    if t is not None:
+        t.add(stage, seconds)
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a block (sync or around an await) into rag_stage_seconds and the current request's timings."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+def count_llm_usage(resp) -> None:
+    """Add token counts from a Gemini response's usage metadata, when present."""
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is None:
+        return
+    for kind, attr in (("prompt", "prompt_token_count"), ("completion", "candidates_token_count")):
+        n = getattr(usage, attr, 0) or 0
+        if n:
+            LLM_TOKENS.inc(n, kind=kind)
+
+def stage_report(hist: Histogram = STAGE_SECONDS) -> str:
+    """One line per stage: count, total and mean time. For CLI scripts."""
+    rows = sorted(hist.summary().items(), key=lambda kv: -kv[1][1])
+    return "\n".join(
+        f"  {dict(key).get('stage', '-'):<14} n={n:<6} total={total:8.2f}s  mean={total / n * 1000:8.1f} ms"
+        for key, (n, total) in rows if n
+    )
+
+# Sampled profiling
+
+class SampledProfiler:
+    """
+    cProfile a random fraction of requests and dump .prof files (open with snakeviz or pstats).
+    Only one request is profiled at a time; the profile covers everything on the event loop
+    thread meanwhile, so read it as "where the loop spent its time during this request".
+    """
+    def __init__(self, rate: float, out_dir: Path):
+        self.rate = rate
+        self.out_dir = out_dir
+        self._busy = threading.Lock()
+
+    @contextmanager
+    def maybe_profile(self, name: str) -> Iterator[bool]:
+        if self.rate <= 0 or random.random() >= self.rate or not self._busy.acquire(blocking=False):
+            yield False
+            return
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+            try:
+                yield True
+            finally:
+                prof.disable()
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            slug = re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_") or "root"
+            prof.dump_stats(str(self.out_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{time.time_ns() % 10**6}.prof"))
+        finally:
+            self._busy.release()
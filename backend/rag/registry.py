@@ -0,0 +1,204 @@
+from __future__ import annotations
+import math, threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+# chromadb / llama_index are imported where they are first needed, so importing
+# this module (and the server) stays cheap.
+if TYPE_CHECKING:
+    from llama_index.core import QueryBundle, VectorStoreIndex
+    from llama_index.core.retrievers import BaseRetriever
+    from llama_index.core.schema import NodeWithScore, TextNode
+    from rag.lexical import BM25Index
+    from rag.snapshot import VectorSnapshot
+
+class UnknownCollection(KeyError):
+    """Raised for collection names that do not exist in Chroma."""
+
+def _chroma_node(node_id: str, text: Optional[str], meta: Optional[dict]) -> TextNode:
+    from llama_index.core.schema import TextNode
+    from llama_index.core.vector_stores.utils import metadata_dict_to_node
+    try:
+        return metadata_dict_to_node(meta, text=text)
+    except Exception:
+        return TextNode(id_=node_id, text=text or "", metadata=dict(meta or {}))
+
+@dataclass
+class _Entry:
+    collection: object
+    index: Optional[VectorStoreIndex]
+    generation: str
+    lexical: Optional["BM25Index"] = None
+    snapshot: Optional["VectorSnapshot"] = None
+    retrievers: Dict[int, "BaseRetriever"] = field(default_factory=dict)
+
+class IndexRegistry:
+    """
+    Warm, ready-to-query indexes per Chroma collection (bounded, LRU).
+
+    Only existing collections are served; nothing is created on lookup. When
+    `generation_fn()` changes (the indexer rewrote its state file) the entry is
+    rebuilt from a fresh collection handle and swapped in; requests already
+    holding the old retriever finish on it.
+
+    With `snapshot_path_fn`, vector search runs in-process over the exported
+    snapshot and Chroma is only opened for collections without one.
+    `embed_model_fn` supplies the model used for queries that arrive without an embedding.
+    """
+    def __init__(
+        self,
+        client_fn: Callable,
+        generation_fn: Callable[[], str],
+        max_size: int = 8,
+        lexical_path_fn: Optional[Callable[[str], object]] = None,
+        snapshot_path_fn: Optional[Callable[[str], object]] = None,
+        embed_model_fn: Optional[Callable] = None,
+    ):
+        self.client_fn = client_fn
+        self.embed_model_fn = embed_model_fn
+        self.lexical_path_fn = lexical_path_fn
+        self.snapshot_path_fn = snapshot_path_fn
+        self.generation_fn = generation_fn
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _open_index(self, name: str):
+        """(collection, index) from Chroma; UnknownCollection if it doesn't exist."""
+        from chromadb.errors import NotFoundError
+        from llama_index.core import VectorStoreIndex
+        from llama_index.vector_stores.chroma import ChromaVectorStore
+        try:
+            col = self.client_fn().get_collection(name=name)
+        except (NotFoundError, ValueError):
+            raise UnknownCollection(name) from None
+        kwargs = {"embed_model": self.embed_model_fn()} if self.embed_model_fn else {}
+        return col, VectorStoreIndex.from_vector_store(ChromaVectorStore(chroma_collection=col), **kwargs)
+
+    def _load(self, name: str, generation: str) -> _Entry:
+        from rag.lexical import BM25Index
+        from rag.snapshot import VectorSnapshot
+        lexical = BM25Index.load(self.lexical_path_fn(name)) if self.lexical_path_fn else None
+        snapshot = VectorSnapshot.load(self.snapshot_path_fn(name)) if self.snapshot_path_fn else None
+        if snapshot is not None:
+            return _Entry(collection=None, index=None, generation=generation, lexical=lexical, snapshot=snapshot)
+        col, index = self._open_index(name)
+        return _Entry(collection=col, index=index, generation=generation, lexical=lexical)
+
+    def _entry(self, name: str) -> _Entry:
+        gen = self.generation_fn()
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry.generation == gen:
+                self._entries.move_to_end(name)
+                return entry
+        # Build outside the lock; the swap below is a single dict assignment.
+        fresh = self._load(name, gen)
+        with self._lock:
+            self._entries[name] = fresh
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return fresh
+
+    def current(self, name: str) -> bool:
+        """True when the collection's entry is loaded and matches the current generation (loads nothing)."""
+        gen = self.generation_fn()
+        with self._lock:
+            entry = self._entries.get(name)
+            return entry is not None and entry.generation == gen
+
+    def require(self, name: str) -> None:
+        """Raise UnknownCollection unless the collection can be served."""
+        self._entry(name)
+
+    def get_index(self, name: str) -> VectorStoreIndex:
+        entry = self._entry(name)
+        if entry.index is None:
+            # snapshot-served collection: open the Chroma index only for callers that need it
+            entry.collection, entry.index = self._open_index(name)
+        return entry.index
+
+    def get_retriever(self, name: str, top_k: int) -> BaseRetriever:
+        """
+        Hybrid (vector + BM25) when a lexical index was saved for the collection, vector-only otherwise.
+        Cached per top_k, which callers keep within 1..MAX_TOP_K (request validation).
+        """
+        from rag.lexical import HybridRetriever
+        from rag.snapshot import SnapshotRetriever
+        entry = self._entry(name)
+        retriever = entry.retrievers.get(top_k)
+        if retriever is None:
+            hybrid = entry.lexical is not None and len(entry.lexical) > 0
+            k_vec = top_k * 2 if hybrid else top_k
+            if entry.snapshot is not None:
+                embed_model = self.embed_model_fn() if self.embed_model_fn else None
+                vector = SnapshotRetriever(entry.snapshot, k_vec, embed_model=embed_model)
+            else:
+                vector = entry.index.as_retriever(similarity_top_k=k_vec)
+            retriever = HybridRetriever(vector, entry.lexical, top_k=top_k) if hybrid else vector
+            entry.retrievers[top_k] = retriever
+        return retriever
+
+    def retrieve_many(self, name: str, queries: List[QueryBundle], top_k: int) -> List[List[NodeWithScore]]:
+        """
+        Retrieve for many queries with a single Chroma query call (one row per embedded query),
+        or one matrix product over the snapshot, fused with BM25 when available. Queries without
+        an embedding use BM25 alone.
+        """
+        from llama_index.core.schema import NodeWithScore
+        from rag.lexical import fuse_hits
+        entry = self._entry(name)
+        hybrid = entry.lexical is not None and len(entry.lexical) > 0
+        k_vec = top_k * 2 if hybrid else top_k
+        embedded = [i for i, q in enumerate(queries) if q.embedding is not None]
+        vec_hits: Dict[int, List[NodeWithScore]] = {i: [] for i in range(len(queries))}
+        if embedded and entry.snapshot is not None:
+            for i, hits in zip(embedded, entry.snapshot.search([queries[i].embedding for i in embedded], k_vec)):
+                vec_hits[i] = hits
+        elif embedded:
+            res = entry.collection.query(
+                query_embeddings=[queries[i].embedding for i in embedded],
+                n_results=k_vec,
+                include=["documents", "metadatas", "distances"],
+            )
+            for row, i in enumerate(embedded):
+                for node_id, text, meta, dist in zip(
+                    res["ids"][row], res["documents"][row], res["metadatas"][row], res["distances"][row]
+                ):
+                    vec_hits[i].append(NodeWithScore(node=_chroma_node(node_id, text, meta), score=math.exp(-dist)))
+        if not hybrid:
+            return [vec_hits[i][:top_k] for i in range(len(queries))]
+        return [
+            fuse_hits(vec_hits[i], entry.lexical, q.query_str, top_k, top_k * 2)
+            for i, q in enumerate(queries)
+        ]
+
+    def get_nodes(self, name: str, ids: List[str]) -> List[TextNode]:
+        """Stored chunks by node ID, from the BM25 table, the snapshot or Chroma; unknown IDs are skipped."""
+        entry = self._entry(name)
+        found: Dict[str, TextNode] = {}
+        for node_id in ids:
+            node = entry.lexical.node(node_id) if entry.lexical is not None else None
+            if node is None and entry.snapshot is not None:
+                node = entry.snapshot.node_by_id(node_id)
+            if node is not None:
+                found[node_id] = node
+        missing = [i for i in ids if i not in found]
+        if missing and entry.collection is not None:
+            got = entry.collection.get(ids=missing, include=["documents", "metadatas"])
+            for node_id, text, meta in zip(got["ids"], got["documents"], got["metadatas"]):
+                found[node_id] = _chroma_node(node_id, text, meta)
+        return [found[i] for i in ids if i in found]
+
+    def has_lexical(self, name: str) -> bool:
+        lexical = self._entry(name).lexical
+        return lexical is not None and len(lexical) > 0
+
+    def invalidate(self, name: str | None = None) -> None:
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
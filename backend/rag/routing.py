@@ -0,0 +1,108 @@
+from __future__ import annotations
+import json, pathlib
+from typing import Dict, List, Mapping, Optional, Pattern, Sequence
+import numpy as np
+
+# Partitioned collections: every chunk is also stored in a per-family collection
+# ("<collection>__<family>", family from the page URL), each with its own BM25 index and
+# snapshot. A manifest next to them records each partition's size and embedding centroid,
+# which the query router uses to search only the partitions a question is about.
+
+def page_family(url: str, families: Mapping[str, Sequence[str]], default: str) -> str:
+    """First family whose URL markers appear in `url`; `default` when none do."""
+    u = (url or "").rstrip("/")
+    for family, markers in families.items():
+        if any(m in u for m in markers):
+            return family
+    return default
+
+def partition_name(collection: str, family: str) -> str:
+    return f"{collection}__{family}"
+
+def partitions_path(chroma_path: pathlib.Path, collection: str) -> pathlib.Path:
+    return pathlib.Path(chroma_path) / f"partitions_{collection}.json"
+
+def centroid(vectors: np.ndarray) -> List[float]:
+    """Unit-length mean of (unit-length) row vectors; [] for an empty matrix."""
+    if not len(vectors):
+        return []
+    c = np.asarray(vectors, dtype=np.float32).mean(axis=0)
+    n = np.linalg.norm(c)
+    return (c / n if n else c).tolist()
+
+def save_partitions(path: pathlib.Path, collection: str, partitions: Dict[str, Dict]) -> None:
+    """`partitions` maps family -> {"collection", "chunks", "centroid"}."""
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"collection": collection, "partitions": partitions}, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+
+def load_partitions(path: pathlib.Path) -> Dict[str, Dict]:
+    path = pathlib.Path(path)
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8")).get("partitions") or {}
+    except ValueError:
+        return {}
+
+def merge_hits(results: Sequence[list], top_k: int) -> list:
+    """
+    Best `top_k` NodeWithScore hits across partitions, by reciprocal rank fusion: scores from
+    different partitions (separate BM25 statistics, separate fusions) are not comparable.
+    """
+    from llama_index.core.schema import NodeWithScore
+    from rag.lexical import reciprocal_rank_fusion
+    by_id: Dict[str, object] = {}
+    for hits in results:
+        for h in hits:
+            by_id.setdefault(h.node.node_id, h.node)
+    fused = reciprocal_rank_fusion([[h.node.node_id for h in hits] for hits in results])
+    return [NodeWithScore(node=by_id[node_id], score=score) for node_id, score in fused[:top_k]]
+
+class QueryRouter:
+    """
+    Picks the partitions to search for a question. Keyword rules match first; with a query
+    embedding, partitions whose centroid similarity is within `margin` of the best one are
+    added. At most `max_partitions` are searched; an empty route means "search everything"
+    (no confident match, or the route would cover every non-empty partition anyway).
+    """
+    def __init__(
+        self,
+        partitions: Dict[str, Dict],
+        keywords: Optional[Mapping[str, Pattern]] = None,
+        max_partitions: int = 2,
+        margin: float = 0.05,
+    ):
+        live = {f: p for f, p in partitions.items() if p.get("chunks")}
+        self.collections = {f: p["collection"] for f, p in live.items()}
+        self.keywords = {f: rx for f, rx in (keywords or {}).items() if f in live}
+        self.max_partitions = max_partitions
+        self.margin = margin
+        with_centroid = [(f, p["centroid"]) for f, p in live.items() if p.get("centroid")]
+        self._families = [f for f, _ in with_centroid]
+        self._matrix = np.asarray([c for _, c in with_centroid], dtype=np.float32) if with_centroid else None
+
+    def __len__(self) -> int:
+        return len(self.collections)
+
+    def route(self, question: str, embedding: Optional[Sequence[float]] = None) -> List[str]:
+        """Families to search, best first."""
+        if self.max_partitions <= 0 or len(self.collections) < 2:
+            return []
+        chosen = [f for f, rx in self.keywords.items() if rx.search(question or "")]
+        if len(chosen) > self.max_partitions:
+            return []
+        if embedding is not None and self._matrix is not None:
+            q = np.asarray(embedding, dtype=np.float32)
+            n = np.linalg.norm(q)
+            if n and q.shape[0] == self._matrix.shape[1]:
+                sims = self._matrix @ (q / n)
+                best = float(sims.max())
+                chosen += [self._families[i] for i in np.argsort(-sims) if sims[i] >= best - self.margin]
+        chosen = list(dict.fromkeys(chosen))[:self.max_partitions]
+        return chosen if len(chosen) < len(self.collections) else []
+
+    def collections_for(self, families: List[str]) -> List[str]:
+        return [self.collections[f] for f in families]
@@ -0,0 +1,90 @@
+from __future__ import annotations
+import json, pathlib, sqlite3, threading, time
+from dataclasses import asdict, dataclass, field
+from typing import Callable, List, Optional
+
+@dataclass
+class Session:
+    """
+    Condensed state of one conversation: the last few exchanges as (standalone question,
+    abridged answer) pairs, and the node IDs retrieved for the latest turn.
+    """
+    conversation_id: str
+    exchanges: List[List[str]] = field(default_factory=list)
+    node_ids: List[str] = field(default_factory=list)
+    turns: int = 0
+    updated_at: float = 0.0
+
+    def add_exchange(self, question: str, answer: str, max_exchanges: int, answer_chars: int) -> None:
+        """Roll one exchange into the state; only the last `max_exchanges` are kept."""
+        answer = " ".join((answer or "").split())
+        if len(answer) > answer_chars:
+            answer = answer[:answer_chars] + "…"
+        self.exchanges = (self.exchanges + [[question, answer]])[-max_exchanges:]
+        self.turns += 1
+
+class SessionStore:
+    """
+    Conversation sessions keyed by server-issued conversation id, in SQLite (WAL) so every
+    worker and restarts see the same state. Reads are a primary-key lookup; `update` reads,
+    modifies and writes a session in one write transaction, so turns recorded concurrently
+    (here or in another worker) are never lost. Sessions idle for longer than `ttl_s` are dropped.
+    """
+    def __init__(self, path: pathlib.Path, ttl_s: float = 86400, enabled: bool = True):
+        self.path = pathlib.Path(path)
+        self.ttl_s = ttl_s
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=10, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " conversation_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _read(self, conversation_id: str) -> Optional[Session]:
+        row = self.conn.execute(
+            "SELECT data FROM sessions WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        s = Session(**json.loads(row[0]))
+        return None if self.ttl_s > 0 and time.time() - s.updated_at > self.ttl_s else s
+
+    def get(self, conversation_id: str) -> Optional[Session]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            return self._read(conversation_id)
+
+    def update(self, conversation_id: str, fn: Callable[[Optional[Session]], Session]) -> Optional[Session]:
+        """Apply `fn` to the stored session (None if absent or expired) and save its result, atomically."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")  # takes the write lock before reading
+            try:
+                session = fn(self._read(conversation_id))
+                session.updated_at = time.time()
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO sessions (conversation_id, data, updated_at) VALUES (?, ?, ?)",
+                    (session.conversation_id, json.dumps(asdict(session), ensure_ascii=False), session.updated_at),
+                )
+                self._writes += 1
+                if self.ttl_s > 0 and self._writes % 500 == 0:
+                    self.conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_s,))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            return session
+
+    def delete(self, conversation_id: str) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM sessions WHERE conversation_id = ?", (conversation_id,))
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,124 @@
+from __future__ import annotations
+import json, os, pathlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from llama_index.core import QueryBundle, Settings
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, TextNode
+
+# Read-only export of a Chroma collection for in-process search: unit-normalized float32
+# vectors in a .npy file (memory-mapped, so workers on one host share the page cache)
+# plus a JSON table of ids, texts and metadata.
+
+VECTORS_FILE = "vectors.npy"
+META_FILE = "meta.json"
+
+def snapshot_dir(chroma_path: pathlib.Path, collection: str) -> pathlib.Path:
+    return pathlib.Path(chroma_path) / f"snapshot_{collection}"
+
+def _offsets(meta: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+    """Chunk offsets from the node JSON llama_index stores in Chroma metadata."""
+    try:
+        content = json.loads(meta.get("_node_content") or "{}")
+    except (TypeError, ValueError):
+        return None, None
+    return content.get("start_char_idx"), content.get("end_char_idx")
+
+def export_snapshot(chroma_col, out_dir: pathlib.Path) -> int:
+    """Write every vector of `chroma_col` to `out_dir`; returns the row count."""
+    got = chroma_col.get(include=["embeddings", "documents", "metadatas"])
+    ids = list(got.get("ids") or [])
+    embs = got.get("embeddings")
+    matrix = np.asarray(embs if embs is not None and len(embs) else np.zeros((0, 0)), dtype=np.float32)
+    if matrix.size:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+    rows = []
+    for meta, text in zip(got.get("metadatas") or [], got.get("documents") or []):
+        meta = meta or {}
+        start, end = _offsets(meta)
+        rows.append({
+            "text": text or "",
+            "metadata": {k: v for k, v in meta.items() if not k.startswith("_") and k not in ("document_id", "doc_id", "ref_doc_id")},
+            "start": start,
+            "end": end,
+        })
+
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # np.save appends .npy to names without it, so keep the suffix on the temp file
+    tmp_vec = out_dir / f"tmp-{VECTORS_FILE}"
+    tmp_meta = out_dir / f"{META_FILE}.tmp"
+    np.save(tmp_vec, matrix)
+    tmp_meta.write_text(json.dumps({"count": len(ids), "ids": ids, "rows": rows}, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp_vec, out_dir / VECTORS_FILE)
+    os.replace(tmp_meta, out_dir / META_FILE)
+    return len(ids)
+
+class VectorSnapshot:
+    """Memory-mapped vectors + metadata with brute-force cosine top-k."""
+    def __init__(self, vectors: np.ndarray, ids: List[str], rows: List[Dict[str, Any]]):
+        self.vectors = vectors
+        self.ids = ids
+        self.rows = rows
+        self._pos = {node_id: i for i, node_id in enumerate(ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> Optional["VectorSnapshot"]:
+        """None when there is no snapshot or its two files disagree (e.g. caught mid-export)."""
+        path = pathlib.Path(path)
+        try:
+            meta = json.loads((path / META_FILE).read_text(encoding="utf-8"))
+            vectors = np.load(path / VECTORS_FILE, mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+        if vectors.ndim != 2 or vectors.shape[0] != meta.get("count") or len(meta.get("ids", [])) != vectors.shape[0]:
+            return None
+        return cls(vectors, meta["ids"], meta["rows"])
+
+    def node(self, i: int) -> TextNode:
+        row = self.rows[i]
+        return TextNode(
+            id_=self.ids[i],
+            text=row["text"],
+            metadata=dict(row["metadata"]),
+            start_char_idx=row.get("start"),
+            end_char_idx=row.get("end"),
+        )
+
+    def node_by_id(self, node_id: str) -> Optional[TextNode]:
+        i = self._pos.get(node_id)
+        return None if i is None else self.node(i)
+
+    def search(self, queries: Sequence[Sequence[float]], k: int) -> List[List[NodeWithScore]]:
+        """Top-k rows per query by cosine similarity, one matrix product for the whole batch."""
+        if not len(self) or not len(queries) or k <= 0:
+            return [[] for _ in queries]
+        q = np.asarray(queries, dtype=np.float32)
+        norms = np.linalg.norm(q, axis=1, keepdims=True)
+        q = q / np.where(norms == 0, 1, norms)
+        sims = q @ self.vectors.T  # (queries, rows)
+        k = min(k, sims.shape[1])
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        out: List[List[NodeWithScore]] = []
+        for r, idx in enumerate(top):
+            idx = idx[np.argsort(-sims[r, idx])]
+            out.append([NodeWithScore(node=self.node(int(i)), score=float(sims[r, i])) for i in idx])
+        return out
+
+class SnapshotRetriever(BaseRetriever):
+    """Vector retriever over a VectorSnapshot; embeds the query itself when the bundle has no embedding."""
+    def __init__(self, snapshot: VectorSnapshot, top_k: int, embed_model=None):
+        super().__init__()
+        self.snapshot = snapshot
+        self.top_k = top_k
+        self.embed_model = embed_model
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        emb = query_bundle.embedding
+        if emb is None:
+            emb = (self.embed_model or Settings.embed_model).get_query_embedding(query_bundle.query_str)
+        return self.snapshot.search([emb], self.top_k)[0]
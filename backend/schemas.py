@@ -1,5 +1,6 @@
 from typing import List, Optional, Literal
 from pydantic import BaseModel, Field
+from settings import settings
 
 class ChatTurn(BaseModel):
     role: Literal["user", "assistant"]
@@ -8,8 +9,12 @@ class ChatTurn(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     history: List[ChatTurn] = Field(default_factory=list)
-    top_k: int = 6
+    top_k: int = Field(default=6, ge=1, le=settings.max_top_k)
     collection: Optional[str] = None
+    # start_session asks the server to open a session and return its conversation_id; sending
+    # that id back on later turns lets history be left empty (unknown ids are ignored)
+    conversation_id: Optional[str] = Field(default=None, max_length=128)
+    start_session: bool = False
 
 class SourceItem(BaseModel):
     url: str
@@ -19,3 +24,11 @@ class SourceItem(BaseModel):
 class ChatResponse(BaseModel):
     reply: str
     sources: List[SourceItem] = Field(default_factory=list)
+    # set when the turn was recorded in a server-side session
+    conversation_id: Optional[str] = None
+
+class ChatBatchRequest(BaseModel):
+    requests: List[ChatRequest] = Field(default_factory=list, max_length=64)
+
+class ChatBatchResponse(BaseModel):
+    responses: List[ChatResponse] = Field(default_factory=list)
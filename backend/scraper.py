@@ -1,26 +1,47 @@
 from __future__ import annotations
 import asyncio
 import argparse
+import hashlib
+import os
 import re
 import time
-from urllib.parse import urljoin
+from contextlib import asynccontextmanager, nullcontext
+from concurrent.futures import Executor, ProcessPoolExecutor
+from urllib.parse import urldefrag, urljoin, urlsplit, urlunsplit
 import httpx
 from bs4 import BeautifulSoup
 from rag.cache import DiskCache
-from constants import DEFAULT_URLS, HEADERS, MAX_CONCURRENCY, REQUEST_TIMEOUT, NOISE_PATTERNS, NOISE_TITLES
+from rag.metrics import PAGES_SCRAPED, record, span, stage_report
+from rag.routing import page_family
+from constants import (
+    DEFAULT_URLS, HEADERS, REQUEST_TIMEOUT, NOISE_PATTERNS, NOISE_TITLES,
+    PAGE_FAMILIES, DEFAULT_FAMILY, TOGGLE_FAMILIES, TEXT_INNER_FAMILIES,
+    PER_HOST_CONCURRENCY, PER_HOST_DELAY_S,
+    CRAWL_ALLOWED_PREFIXES, CRAWL_MAX_DEPTH, CRAWL_MAX_PAGES, CRAWL_SKIP_EXTENSIONS,
+)
 
 # HTML helpers
+try:
+    import lxml  # noqa: F401  (optional, much faster than html.parser)
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+PARSE_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
 def make_soup(html: str) -> BeautifulSoup:
-    return BeautifulSoup(html, "html.parser")
+    return BeautifulSoup(html, HTML_PARSER)
 
-def element_to_text(el, base_url: str) -> str:
-    """Convert raw HTML to a clean, markdown-like text."""
+def element_to_text(el, base_url: str, links: list[str] | None = None) -> str:
+    """Convert raw HTML to a clean, markdown-like text. Absolute hrefs are appended to `links`."""
     # Links -> [text](url)
     for a in el.find_all("a"):
         text = (a.get_text(" ", strip=True) or "").strip()
         href = a.get("href") or ""
         if href:
             href = urljoin(base_url, href)
+            if links is not None:
+                links.append(href)
             a.replace_with(f"[{text}]({href})")
         else:
             a.replace_with(text)
@@ -49,19 +70,16 @@ def page_title_from(soup: BeautifulSoup, fallback: str) -> str:
 
 def should_scrape_toggles(url: str) -> bool:
     """Primary content via Divi toggles (graduates & guests)."""
-    u = url.rstrip("/")
-    return ("/ce/for-graduates" in u) or ("/ce/for-guests" in u)
+    return page_family(url, PAGE_FAMILIES, DEFAULT_FAMILY) in TOGGLE_FAMILIES
 
 def should_scrape_text_inners(url: str) -> bool:
     """Grab text-inner blocks for these pages. Skips for-guests."""
-    u = url.rstrip("/")
-    return ("/ce/for-graduates" in u) or ("/a/directions" in u) or ("/ce/faq" in u)
+    return page_family(url, PAGE_FAMILIES, DEFAULT_FAMILY) in TEXT_INNER_FAMILIES
 
 # Section extraction
 
-def extract_sections_divi_toggles(html: str, url: str) -> list[dict]:
+def extract_sections_divi_toggles(soup: BeautifulSoup, url: str, links: list[str] | None = None) -> list[dict]:
     """Return a list of sections from Divi toggle blocks: {'title', 'text'}."""
-    soup = make_soup(html)
     blocks = []
     if "/ce/for-guests" in url.rstrip("/"):
         exact_selector = 'div[class="et_pb_module et_pb_toggle et_pb_toggle_0 et_pb_toggle_item et_pb_toggle_open"]'
@@ -76,14 +94,13 @@ def extract_sections_divi_toggles(html: str, url: str) -> list[dict]:
         title_el = tg.select_one(".et_pb_toggle_title")
         body_el = tg.select_one(".et_pb_toggle_content")
         title = (title_el.get_text(" ", strip=True) if title_el else f"Section {i}").strip()
-        text = element_to_text(body_el or tg, url)
+        text = element_to_text(body_el or tg, url, links)
         if text:
             sections.append({"title": title, "text": text})
     return sections
 
-def extract_sections_text_inners(html: str, url: str) -> list[dict]:
+def extract_sections_text_inners(soup: BeautifulSoup, url: str, links: list[str] | None = None) -> list[dict]:
     """Return a list of sections from all div[class='et_pb_text_inner'] blocks."""
-    soup = make_soup(html)
     blocks = soup.select('div[class="et_pb_text_inner"]')
 
     sections = []
@@ -97,7 +114,7 @@ def extract_sections_text_inners(html: str, url: str) -> list[dict]:
             if prev_h and prev_h.get_text(strip=True):
                 title = prev_h.get_text(" ", strip=True)
 
-        text = element_to_text(el, url)
+        text = element_to_text(el, url, links)
         if text:
             sections.append({"title": title or f"Text Block {i}", "text": text})
 
@@ -106,12 +123,7 @@ def extract_sections_text_inners(html: str, url: str) -> list[dict]:
 # Cleanup & de-dup
 
 def _sha1_key(title: str, text: str) -> str:
-    # local tiny hash to dedupe section
-    # simple rolling hash; adequate for de-dupe keys
-    h = 0
-    for ch in (title + "\n" + text):
-        h = (h * 131 + ord(ch)) & 0xFFFFFFFF
-    return str(h)
+    return hashlib.sha1(f"{title}\n{text}".encode("utf-8")).hexdigest()
 
 def dedupe_sections(sections: list[dict]) -> list[dict]:
     seen = set()
@@ -148,78 +160,253 @@ def merge_adjacent_same_title(sections: list[dict]) -> list[dict]:
             merged.append(s)
     return merged
 
-# Networking
-
-async def fetch_html_async(client: httpx.AsyncClient, url: str) -> tuple[str, str]:
-    t0 = time.perf_counter()
-    print(f"[fetch start] {url}")
-    resp = await client.get(url, headers=HEADERS, timeout=REQUEST_TIMEOUT)
-    resp.raise_for_status()
-    html = resp.text
-    proto = resp.extensions.get("http_version", b"HTTP/1.1")
-    dt_ms = (time.perf_counter() - t0) * 1000
-    print(f"[fetch done ] {url}  ({dt_ms:.0f} ms, {len(html):,} chars, {proto})")
+def parse_page(html: str, url: str) -> tuple[str, list[dict], list[str]]:
+    """
+    Parse a page once and return (title, cleaned sections, links found in them).
+    Pure CPU work with picklable inputs/outputs, so it can run in a worker process.
+    """
     soup = make_soup(html)
     title = page_title_from(soup, url)
-    return html, title
-
-# Orchestration
-
-async def scrape_one(cache: DiskCache, client: httpx.AsyncClient, url: str) -> None:
-    """Fetch, parse, clean, and cache one URL."""
-    html, page_title = await fetch_html_async(client, url)
+    links: list[str] = []
 
     sections_all: list[dict] = []
-    if should_scrape_text_inners(url):
-        sections_all.extend(extract_sections_text_inners(html, url))
+    toggles = should_scrape_toggles(url)
+    # Pages outside the known families (found by crawling) use the generic text blocks
+    if should_scrape_text_inners(url) or not toggles:
+        sections_all.extend(extract_sections_text_inners(soup, url, links))
     else:
         print(f"[text_inner] skipped {url}")
 
-    if should_scrape_toggles(url):
-        sections_all.extend(extract_sections_divi_toggles(html, url))
-    else:
-        print(f"[toggles   ] skipped {url}")
+    if toggles:
+        sections_all.extend(extract_sections_divi_toggles(soup, url, links))
 
     # Clean & normalize
     sections_all = dedupe_sections(sections_all)
     sections_all = filter_noise_sections(sections_all)
     sections_all = merge_adjacent_same_title(sections_all)
+    return title, sections_all, list(dict.fromkeys(links))
+
+# Crawl helpers
+
+def normalize_url(url: str) -> str:
+    u = urlsplit(urldefrag(url)[0])
+    return urlunsplit((u.scheme.lower(), u.netloc.lower(), u.path or "/", u.query, ""))
+
+def crawlable(url: str, hosts: set[str], prefixes: tuple[str, ...]) -> bool:
+    """Same host as the seeds, under an allowed path prefix, and not a binary asset."""
+    u = urlsplit(url)
+    if u.scheme not in ("http", "https") or u.netloc.lower() not in hosts:
+        return False
+    path = u.path or "/"
+    if path.lower().endswith(CRAWL_SKIP_EXTENSIONS):
+        return False
+    return any(path.startswith(p) for p in prefixes)
+
+class HostLimiter:
+    """Per-host politeness: at most `concurrency` requests in flight and `delay_s` between starts."""
+    def __init__(self, concurrency: int = PER_HOST_CONCURRENCY, delay_s: float = PER_HOST_DELAY_S):
+        self.concurrency = concurrency
+        self.delay_s = delay_s
+        self._sems: dict[str, asyncio.Semaphore] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._next_start: dict[str, float] = {}
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        host = urlsplit(url).netloc.lower()
+        sem = self._sems.setdefault(host, asyncio.Semaphore(self.concurrency))
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with sem:
+            async with lock:
+                now = time.monotonic()
+                wait = self._next_start.get(host, 0.0) - now
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._next_start[host] = max(now, self._next_start.get(host, 0.0)) + self.delay_s
+            yield
+
+# Networking
+
+def conditional_headers(validators: dict) -> dict:
+    headers = dict(HEADERS)
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+async def fetch_html_async(
+    client: httpx.AsyncClient, url: str, validators: dict | None = None
+) -> tuple[str, dict] | None:
+    """Returns (html, validators), or None when the server answers 304 Not Modified."""
+    t0 = time.perf_counter()
+    print(f"[fetch start] {url}")
+    resp = await client.get(url, headers=conditional_headers(validators or {}), timeout=REQUEST_TIMEOUT)
+    if resp.status_code == 304:
+        dt_ms = (time.perf_counter() - t0) * 1000
+        print(f"[not modified] {url}  ({dt_ms:.0f} ms)")
+        return None
+    resp.raise_for_status()
+    html = resp.text
+    proto = resp.extensions.get("http_version", b"HTTP/1.1")
+    dt_ms = (time.perf_counter() - t0) * 1000
+    print(f"[fetch done ] {url}  ({dt_ms:.0f} ms, {len(html):,} chars, {proto})")
+    fresh = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+    return html, fresh
+
+# Orchestration
+
+async def scrape_one(
+    cache: DiskCache,
+    client: httpx.AsyncClient,
+    url: str,
+    revalidate: bool = True,
+    parse_pool: Executor | None = None,
+    limiter: HostLimiter | None = None,
+) -> list[str]:
+    """
+    Fetch, parse, clean, and cache one URL; returns the links found on it.
+    Only the fetch holds a `limiter` slot; parsing runs in `parse_pool`, off the event loop.
+    """
+    t_wait = time.perf_counter()
+    async with limiter.slot(url) if limiter else nullcontext():
+        record("host_wait", time.perf_counter() - t_wait)
+        with span("fetch"):
+            fetched = await fetch_html_async(client, url, cache.validators(url) if revalidate else None)
+    if fetched is None:
+        # unchanged since the cached copy: nothing to parse or write
+        PAGES_SCRAPED.inc(outcome="not_modified")
+        return (cache.get(url) or {}).get("links", [])
+    html, validators = fetched
+
+    loop = asyncio.get_running_loop()
+    with span("parse"):
+        page_title, sections_all, links = await loop.run_in_executor(parse_pool, parse_page, html, url)
 
     # Write to cache
-    out_path = cache.put({
-        "url": url,
-        "page_title": page_title,
-        "sections": sections_all,
-    })
-    print(f"[cache] {url} -> {out_path}  sections={len(sections_all)}")
-
-async def async_main(urls: list[str]) -> None:
+    with span("cache_put"):
+        sha = cache.put({
+            "url": url,
+            "page_title": page_title,
+            "sections": sections_all,
+            "links": links,
+            **validators,
+        })
+    PAGES_SCRAPED.inc(outcome="fetched")
+    print(f"[cache] {url} -> {sha[:10]}  sections={len(sections_all)}")
+    return links
+
+async def async_main(
+    urls: list[str],
+    revalidate: bool = True,
+    limiter: HostLimiter | None = None,
+    cache: DiskCache | None = None,
+) -> None:
     t0 = time.perf_counter()
-    print(f"Running in ASYNC mode with concurrency={MAX_CONCURRENCY}.\n")
+    limiter = limiter or HostLimiter()
+    print(f"Running in ASYNC mode with per-host concurrency={limiter.concurrency}, parse workers={PARSE_WORKERS} ({HTML_PARSER}).\n")
     limits = httpx.Limits(max_connections=10, max_keepalive_connections=5)
-    sem = asyncio.Semaphore(MAX_CONCURRENCY)
-    cache = DiskCache()
+    cache = cache or DiskCache()
 
-    async with httpx.AsyncClient(follow_redirects=True, http2=True, limits=limits) as client:
-        async def guarded(u: str):
-            async with sem:
+    with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as pool:
+        async with httpx.AsyncClient(follow_redirects=True, http2=True, limits=limits) as client:
+            async def guarded(u: str):
                 try:
-                    await scrape_one(cache, client, u)
+                    await scrape_one(cache, client, u, revalidate, pool, limiter)
                 except Exception as e:
+                    PAGES_SCRAPED.inc(outcome="error")
                     print(f"[error] {u} -> {e}")
 
-        await asyncio.gather(*(guarded(u) for u in urls))
+            await asyncio.gather(*(guarded(u) for u in urls))
 
     dt_s = (time.perf_counter() - t0)
     print(f"\nAll done in {dt_s:.2f}s  (async)")
+    print(stage_report())
+
+async def crawl_main(
+    seeds: list[str],
+    max_depth: int = CRAWL_MAX_DEPTH,
+    prefixes: tuple[str, ...] = CRAWL_ALLOWED_PREFIXES,
+    max_pages: int = CRAWL_MAX_PAGES,
+    resume: bool = False,
+    revalidate: bool = True,
+) -> None:
+    """
+    Breadth-first crawl from `seeds` over same-host links under `prefixes`.
+    The frontier lives in the cache DB, so `resume=True` continues an interrupted crawl.
+    """
+    t0 = time.perf_counter()
+    cache = DiskCache()
+    seeds = [normalize_url(u) for u in seeds]
+    hosts = {urlsplit(u).netloc.lower() for u in seeds}
+    if not resume:
+        cache.frontier_restart()
+    cache.frontier_add(seeds, depth=0)
+
+    # The frontier is shared by every crawl on this cache; only queue URLs in this crawl's scope.
+    in_scope = set(seeds)
+    queue: asyncio.Queue = asyncio.Queue()
+    for url, depth in cache.frontier_pending(max_depth):
+        if url in in_scope or crawlable(url, hosts, prefixes):
+            queue.put_nowait((url, depth))
+    print(f"Crawling {len(hosts)} host(s), depth<={max_depth}, {queue.qsize()} URL(s) pending.\n")
+
+    limits = httpx.Limits(max_connections=10, max_keepalive_connections=5)
+    limiter = HostLimiter()
+    fetched = 0
+
+    with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as pool:
+        async with httpx.AsyncClient(follow_redirects=True, http2=True, limits=limits) as client:
+            async def worker():
+                nonlocal fetched
+                while True:
+                    url, depth = await queue.get()
+                    try:
+                        if fetched >= max_pages:
+                            continue
+                        fetched += 1
+                        links = await scrape_one(cache, client, url, revalidate, pool, limiter)
+                        await asyncio.to_thread(cache.frontier_mark, url, "done")
+                        if depth < max_depth:
+                            nxt = [n for n in map(normalize_url, links) if crawlable(n, hosts, prefixes)]
+                            for new_url in await asyncio.to_thread(cache.frontier_add, nxt, depth + 1):
+                                queue.put_nowait((new_url, depth + 1))
+                    except Exception as e:
+                        await asyncio.to_thread(cache.frontier_mark, url, "error")
+                        PAGES_SCRAPED.inc(outcome="error")
+                        print(f"[error] {url} -> {e}")
+                    finally:
+                        queue.task_done()
+
+            workers = [asyncio.create_task(worker()) for _ in range(max(1, PER_HOST_CONCURRENCY * len(hosts)))]
+            await queue.join()
+            for w in workers:
+                w.cancel()
+
+    dt_s = (time.perf_counter() - t0)
+    print(f"\nCrawled {fetched} page(s) in {dt_s:.2f}s")
+    print(stage_report())
 
 def parse_args():
     ap = argparse.ArgumentParser(description="QC Commencement Scraper (async + cache)")
     ap.add_argument("urls", nargs="*", help="Override URLs to scrape")
+    ap.add_argument("--force", action="store_true", help="Ignore cached ETag/Last-Modified and re-download")
+    ap.add_argument("--crawl", action="store_true", help="Follow same-site links from the seed URLs")
+    ap.add_argument("--max-depth", type=int, default=CRAWL_MAX_DEPTH, help="Crawl depth limit")
+    ap.add_argument("--max-pages", type=int, default=CRAWL_MAX_PAGES, help="Stop after this many fetches")
+    ap.add_argument("--prefix", action="append", help="Allowed path prefix (repeatable)")
+    ap.add_argument("--resume", action="store_true", help="Continue an interrupted crawl")
     return ap.parse_args()
 
 if __name__ == "__main__":
     args = parse_args()
     urls = args.urls or DEFAULT_URLS
     urls = [u.strip() for u in urls if u.strip()]
-    asyncio.run(async_main(urls))
+    if args.crawl:
+        prefixes = tuple(args.prefix) if args.prefix else CRAWL_ALLOWED_PREFIXES
+        asyncio.run(crawl_main(
+            urls, max_depth=args.max_depth, prefixes=prefixes, max_pages=args.max_pages,
+            resume=args.resume, revalidate=not args.force,
+        ))
+    else:
+        asyncio.run(async_main(urls, revalidate=not args.force))
@@ -1,11 +1,45 @@
 from __future__ import annotations
-from fastapi import FastAPI
+import asyncio, json, secrets, time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from schemas import ChatRequest, ChatResponse
-from prompts import SYSTEM_PROMPT, CONDENSE_PROMPT
-from rag.core import LLM, get_index, history_to_text, trim, unique_sources
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from schemas import ChatRequest, ChatResponse, ChatBatchRequest, ChatBatchResponse
+from prompts import CONDENSE_PROMPT
+from settings import settings
+from rag.core import (
+    ANSWER_CACHE, LLM_GATEWAY, SESSIONS, build_prompt, aget_faq, make_query, readiness, arequire_collection, warm_up, lexical_only, aembed_query, aretrieve, aretrieve_many, agenerate_text, astream_text,
+    acarry_nodes, history_to_text, seed_exchanges, session_history, unique_sources,
+)
+from rag.answer_cache import normalize_question
+from rag.condense import needs_condense, questions_match
+from rag.gateway import LLMUnavailable, Overloaded
+from rag.metrics import REGISTRY as METRICS, CACHE_LOOKUPS, REQUEST_SECONDS, SampledProfiler, request_timings
+from rag.registry import UnknownCollection
+from rag.sessions import Session
+from rag.singleflight import SingleFlight
+
+WARMUP: Dict[str, Any] = {"state": "pending" if settings.warmup_on_startup else "off"}
+
+async def run_warm_up() -> None:
+    try:
+        WARMUP["seconds"] = round(await asyncio.to_thread(warm_up), 3)
+        WARMUP["state"] = "done"
+    except Exception as e:
+        WARMUP.update(state="failed", error=f"{type(e).__name__}: {e}")
+    print(f"[warm-up] {WARMUP}")
 
-app = FastAPI(title="Commencement RAG API", version="1.0")
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Warm up in the background so /healthz answers immediately; /readyz waits for it
+    task = asyncio.create_task(run_warm_up()) if settings.warmup_on_startup else None
+    yield
+    if task is not None:
+        task.cancel()
+
+app = FastAPI(title="Commencement RAG API", version="1.0", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -14,25 +48,347 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    # Reconstruct query
+PROFILER = SampledProfiler(settings.profile_sample_rate, settings.profile_dir)
+
+@app.middleware("http")
+async def timing(request: Request, call_next):
+    """Per-stage Server-Timing header, request latency histogram, and sampled cProfile dumps."""
+    t0 = time.perf_counter()
+    with request_timings() as timings, PROFILER.maybe_profile(request.url.path):
+        response = await call_next(request)
+    dt = time.perf_counter() - t0
+    route = request.scope.get("route")
+    path = getattr(route, "path", "other")
+    if path not in ("/metrics", "/healthz", "/readyz"):
+        REQUEST_SECONDS.observe(dt, path=path, status=response.status_code)
+    timings.add("total", dt)
+    response.headers["Server-Timing"] = timings.header()
+    return response
+
+@app.exception_handler(UnknownCollection)
+async def unknown_collection(_: Request, exc: UnknownCollection):
+    return JSONResponse(status_code=404, content={"detail": f"Unknown collection: {exc.args[0]}"})
+
+@app.exception_handler(Overloaded)
+async def overloaded(_: Request, exc: Overloaded):
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+@app.exception_handler(LLMUnavailable)
+async def llm_unavailable(_: Request, exc: LLMUnavailable):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+# Pipeline steps shared by /chat, /chat/stream and /chat/batch
+
+INFLIGHT = SingleFlight()
+
+@dataclass
+class Prepared:
+    question: str
+    cache_ns: str
+    cached: Optional[ChatResponse] = None
+    q_emb: Optional[List[float]] = None
+    nodes: list = field(default_factory=list)
+    carried: bool = False  # nodes include this conversation's earlier chunks: never cached for others
+
+async def with_session(req: ChatRequest) -> ChatRequest:
+    """
+    Requests for a conversation with a server-side session use its condensed exchanges as history
+    (client-sent history is ignored), so the condense prompt stays the same size however long the chat runs.
+    Conversation ids are only issued here (`start_session`, unguessable); an id without a live session
+    (expired, made up by the client, or sessions off) is dropped, so the turn uses client history and
+    the response carries no conversation_id.
+    """
+    if not req.conversation_id:
+        if req.start_session and SESSIONS.enabled:
+            return req.model_copy(update={"conversation_id": secrets.token_urlsafe(24)})
+        return req
+    session = await asyncio.to_thread(SESSIONS.get, req.conversation_id)  # SQLite stays off the event loop
+    if session is None:
+        return req.model_copy(update={"conversation_id": None})
+    return req.model_copy(update={"history": session_history(session)})
+
+async def carried_ids(req: ChatRequest) -> List[str]:
+    """Chunks retrieved on the session's previous turn, carried into follow-ups that need condensing."""
+    if not req.conversation_id or not needs_condense(req.message, req.history):
+        return []
+    session = await asyncio.to_thread(SESSIONS.get, req.conversation_id)
+    return session.node_ids if session is not None else []
+
+async def with_carried(req: ChatRequest, prep: Prepared, nodes: list) -> None:
+    """Set the prepared context to `nodes` plus any chunks carried over from the session."""
+    ids = await carried_ids(req)
+    prep.carried = bool(ids)
+    prep.nodes = await acarry_nodes(req.collection, ids, nodes) if ids else nodes
+
+async def remember_turn(req: ChatRequest, question: str, resp: ChatResponse, nodes: list = ()) -> ChatResponse:
+    """Roll this exchange into the conversation's session; returns the response tagged with its id."""
+    if not req.conversation_id or not SESSIONS.enabled:
+        return resp
+    await asyncio.to_thread(record_turn, req, question, resp, nodes)
+    return resp.model_copy(update={"conversation_id": req.conversation_id})
+
+def record_turn(req: ChatRequest, question: str, resp: ChatResponse, nodes: list) -> None:
+    """Blocking half of remember_turn: read, update and write the session row in one transaction."""
+    def apply(session: Optional[Session]) -> Session:
+        if session is None:
+            session = Session(conversation_id=req.conversation_id)
+            for q, a in seed_exchanges(req.history):
+                session.add_exchange(q, a, settings.session_exchanges, settings.session_answer_chars)
+        session.add_exchange(question, resp.reply, settings.session_exchanges, settings.session_answer_chars)
+        if nodes:
+            session.node_ids = [n.node.node_id for n in nodes[:settings.session_carry_nodes]]
+        return session
+    SESSIONS.update(req.conversation_id, apply)
+
+async def condense_question(req: ChatRequest) -> str:
     history_txt = history_to_text(req.history)
-    condense = LLM.generate_content(
-        CONDENSE_PROMPT.format(history=history_txt, message=req.message)
+    text = await agenerate_text(CONDENSE_PROMPT.format(history=history_txt, message=req.message), stage="condense")
+    return (text or req.message).strip()
+
+async def retrieve_nodes(req: ChatRequest, question: str, q_emb: Optional[List[float]]) -> list:
+    return await aretrieve(req.collection, make_query(question, q_emb), req.top_k)
+
+async def embed_and_retrieve(req: ChatRequest, question: str) -> Tuple[List[float], list]:
+    q_emb = await aembed_query(question)
+    return q_emb, await retrieve_nodes(req, question, q_emb)
+
+async def standalone_question(req: ChatRequest) -> str:
+    if not needs_condense(req.message, req.history):
+        return req.message.strip()
+    return await condense_question(req)
+
+async def resolve_question(req: ChatRequest) -> Tuple[str, Optional[asyncio.Task]]:
+    """
+    Standalone question for this turn, plus a retrieval task already running on it when possible.
+    First turns and self-contained messages skip the condense call. Otherwise retrieval on the
+    raw message runs alongside condensing and is kept if the rewrite barely changed the question.
+    """
+    if not needs_condense(req.message, req.history):
+        return req.message.strip(), None
+    speculative = asyncio.create_task(embed_and_retrieve(req, req.message))
+    try:
+        standalone_q = await condense_question(req)
+    except BaseException:
+        speculative.cancel()
+        raise
+    if questions_match(req.message, standalone_q, settings.condense_match_threshold):
+        return standalone_q, speculative
+    speculative.cancel()
+    return standalone_q, None
+
+async def lookup_and_retrieve(req: ChatRequest, standalone_q: str, speculative: Optional[asyncio.Task]) -> Prepared:
+    """Check the answer cache and precomputed FAQ answers (exact, then semantic); retrieve context on a miss."""
+    prep = Prepared(question=standalone_q, cache_ns=cache_namespace(req))
+
+    prep.cached = cache_lookup("exact", ANSWER_CACHE.get_exact(prep.cache_ns, standalone_q))
+    if prep.cached is not None:
+        return prep
+    faq = await aget_faq(req.collection)
+    if faq is not None:
+        prep.cached = cache_lookup("faq_exact", faq.match_text(standalone_q))
+        if prep.cached is not None:
+            return prep
+
+    if speculative:
+        q_emb, nodes = await speculative
+    else:
+        if await lexical_only(req.collection, standalone_q):
+            # exact-term query: BM25 alone, no query embedding and no semantic cache lookup
+            prep.nodes = await retrieve_nodes(req, standalone_q, None)
+            if prep.nodes:
+                await with_carried(req, prep, prep.nodes)
+                return prep
+        q_emb, nodes = await aembed_query(standalone_q), None
+    prep.cached = cache_lookup("semantic", ANSWER_CACHE.get_similar(prep.cache_ns, q_emb))
+    if prep.cached is None and faq is not None:
+        prep.cached = cache_lookup("faq_semantic", faq.match_embedding(q_emb, settings.faq_match_threshold))
+    if prep.cached is not None:
+        return prep
+    if nodes is None:
+        nodes = await retrieve_nodes(req, standalone_q, q_emb)
+    prep.q_emb = q_emb
+    await with_carried(req, prep, nodes)
+    return prep
+
+async def generate_answer(prep: Prepared) -> ChatResponse:
+    answer = await agenerate_text(build_prompt(prep.nodes, prep.question), stage="generate", cache=not prep.carried)
+    reply_txt = (answer or "I am not sure.").strip()
+    sources = unique_sources(prep.nodes, max_items=3)
+    resp = ChatResponse(reply=reply_txt, sources=sources)
+    if answer and not prep.carried:
+        ANSWER_CACHE.put(prep.cache_ns, prep.question, prep.q_emb, resp)
+    return resp
+
+async def coalesced(kind: str, req: ChatRequest, fn) -> object:
+    """
+    Resolve the standalone question, then run `fn(standalone_q, speculative)` through single-flight:
+    identical in-flight questions (same collection/top_k) share one retrieval and generation.
+    """
+    standalone_q, speculative = await resolve_question(req)
+    try:
+        return await INFLIGHT.do((kind, *(await inflight_key(req, standalone_q))), lambda: fn(standalone_q, speculative))
+    finally:
+        if speculative and not speculative.done():
+            speculative.cancel()  # we joined someone else's flight
+
+async def inflight_key(req: ChatRequest, question: str) -> Tuple[str, str]:
+    ns = cache_namespace(req)
+    if await carried_ids(req):
+        ns += f":{req.conversation_id}"  # context includes this conversation's earlier chunks
+    return ns, normalize_question(question)
+
+def cache_lookup(kind: str, resp: Optional[ChatResponse]) -> Optional[ChatResponse]:
+    CACHE_LOOKUPS.inc(kind=kind, result="miss" if resp is None else "hit")
+    return resp
+
+def cache_namespace(req: ChatRequest) -> str:
+    return f"{req.collection or settings.chroma_collection}:{req.top_k}"
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Routes
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(req: ChatRequest):
+    await arequire_collection(req.collection)  # reject unknown collections before any LLM work
+    LLM_GATEWAY.admit()  # shed load before embedding/retrieval when the LLM queue is full
+    req = await with_session(req)
+    prep = await coalesced("prepare", req, lambda q, spec: lookup_and_retrieve(req, q, spec))
+    resp = prep.cached or await INFLIGHT.do(
+        ("answer", *(await inflight_key(req, prep.question))), lambda: generate_answer(prep)
     )
-    standalone_q = (condense.text or req.message).strip()
+    return await remember_turn(req, prep.question, resp, prep.nodes)
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """
+    Server-sent events: `token` events carry answer text as it is generated,
+    then one `sources` event with the citations, then `done` (with the conversation_id
+    when the turn was recorded in a session). If the LLM is overloaded or unavailable once
+    the stream has started, an `error` event with `retry_after` ends it instead.
+    The Server-Timing header is sent with the first byte, so it only covers the stages
+    before the stream starts (collection lookup, session load); the rest go to /metrics.
+    """
+    await arequire_collection(req.collection)  # 404 before the stream starts
+    LLM_GATEWAY.admit()  # 429 before the stream starts
+    req = await with_session(req)
+    async def events() -> AsyncIterator[str]:
+        try:
+            async for event in answer_events():
+                yield event
+        except (Overloaded, LLMUnavailable) as e:
+            yield sse("error", {"detail": str(e), "retry_after": e.retry_after})
+
+    async def answer_events() -> AsyncIterator[str]:
+        # retrieval is shared with identical in-flight questions; each stream generates its own tokens
+        prep = await coalesced("prepare", req, lambda q, spec: lookup_and_retrieve(req, q, spec))
+        if prep.cached is not None:
+            yield sse("token", {"text": prep.cached.reply})
+            yield sse("sources", {"sources": [s.model_dump() for s in prep.cached.sources]})
+            resp = await remember_turn(req, prep.question, prep.cached)
+            yield sse("done", {"conversation_id": resp.conversation_id} if resp.conversation_id else {})
+            return
+
+        parts: List[str] = []
+        prompt = build_prompt(prep.nodes, prep.question)
+        async for piece in astream_text(prompt, stage="generate_stream", cache=not prep.carried):
+            parts.append(piece)
+            yield sse("token", {"text": piece})
+        if not parts:
+            yield sse("token", {"text": "I am not sure."})
+
+        sources = unique_sources(prep.nodes, max_items=3)
+        yield sse("sources", {"sources": [s.model_dump() for s in sources]})
+        resp = ChatResponse(reply="".join(parts).strip() or "I am not sure.", sources=sources)
+        tagged = await remember_turn(req, prep.question, resp, prep.nodes)
+        yield sse("done", {"conversation_id": tagged.conversation_id} if tagged.conversation_id else {})
+        if parts and not prep.carried:
+            ANSWER_CACHE.put(prep.cache_ns, prep.question, prep.q_emb, resp)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/chat/batch", response_model=ChatBatchResponse)
+async def chat_batch(batch: ChatBatchRequest):
+    """
+    Answer many requests in one call. Requests that condense to the same question share
+    one answer, retrievals run as one Chroma query per collection/top_k, and generation
+    is coalesced with identical questions in flight on /chat.
+    """
+    for r in batch.requests:
+        await arequire_collection(r.collection)
+    LLM_GATEWAY.admit()
+    reqs = await asyncio.gather(*(with_session(r) for r in batch.requests))
+    questions = await asyncio.gather(*(standalone_question(r) for r in reqs))
+    keys = await asyncio.gather(*(inflight_key(r, q) for r, q in zip(reqs, questions)))
+
+    # One representative request per distinct question
+    leaders: Dict[Tuple[str, str], int] = {}
+    for i, key in enumerate(keys):
+        leaders.setdefault(key, i)
+    results: Dict[Tuple[str, str], ChatResponse] = {}
+    preps: Dict[Tuple[str, str], Prepared] = {}
+    for key, i in leaders.items():
+        prep = Prepared(question=questions[i], cache_ns=cache_namespace(reqs[i]))
+        prep.cached = cache_lookup("exact", ANSWER_CACHE.get_exact(prep.cache_ns, prep.question))
+        faq = await aget_faq(reqs[i].collection)
+        if prep.cached is None and faq is not None:
+            prep.cached = cache_lookup("faq_exact", faq.match_text(prep.question))
+        if prep.cached is not None:
+            results[key] = prep.cached
+        else:
+            preps[key] = prep
+
+    embs = await asyncio.gather(*(aembed_query(p.question) for p in preps.values()))
+    for (key, prep), emb in zip(list(preps.items()), embs):
+        prep.q_emb = emb
+        cached = cache_lookup("semantic", ANSWER_CACHE.get_similar(prep.cache_ns, emb))
+        faq = await aget_faq(reqs[leaders[key]].collection)
+        if cached is None and faq is not None:
+            cached = cache_lookup("faq_semantic", faq.match_embedding(emb, settings.faq_match_threshold))
+        if cached is not None:
+            results[key] = cached
+            del preps[key]
+
+    # Batched retrieval per (collection, top_k)
+    groups: Dict[Tuple[Optional[str], int], List[Tuple[str, str]]] = {}
+    for key in preps:
+        r = reqs[leaders[key]]
+        groups.setdefault((r.collection, r.top_k), []).append(key)
+    for (collection, top_k), group in groups.items():
+        bundles = [make_query(preps[k].question, preps[k].q_emb) for k in group]
+        for k, nodes in zip(group, await aretrieve_many(collection, bundles, top_k)):
+            await with_carried(reqs[leaders[k]], preps[k], nodes)
+
+    answers = await asyncio.gather(*(
+        INFLIGHT.do(("answer", *key), lambda p=prep: generate_answer(p)) for key, prep in preps.items()
+    ))
+    results.update(zip(preps.keys(), answers))
+    # in order, so turns of one conversation are recorded as they were sent
+    return ChatBatchResponse(responses=[
+        await remember_turn(r, q, results[k], preps[k].nodes if k in preps else ())
+        for r, q, k in zip(reqs, questions, keys)
+    ])
 
-    # Retrieve
-    index = get_index(req.collection)
-    retriever = index.as_retriever(similarity_top_k=req.top_k)
-    nodes = retriever.retrieve(standalone_q)
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition of stage timings, LLM/embedding calls, cache hits and retrieval sizes."""
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
 
-    # Synthesize answer
-    ctx = "\n\n---\n\n".join(trim(n.get_text() or "", 1200) for n in nodes)
-    answer = LLM.generate_content(SYSTEM_PROMPT.format(context=ctx, question=standalone_q))
-    reply_txt = (answer.text or "I am not sure.").strip()
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
 
-    # Cite sources
-    sources = unique_sources(nodes, max_items=3)
-    return ChatResponse(reply=reply_txt, sources=sources)
+@app.get("/readyz")
+async def readyz():
+    """Readiness: warm-up finished (when enabled), API key set, index built, default collection loadable."""
+    if WARMUP["state"] == "pending":
+        return JSONResponse(status_code=503, content={"ready": False, "warmup": WARMUP})
+    checks = await asyncio.to_thread(readiness)
+    ready = checks["api_key"] and checks["index_built"] and checks["collection"]
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "checks": checks, "warmup": WARMUP})
@@ -16,9 +16,69 @@ class AppSettings:
     gemini_embedding_model: str = os.getenv("GEMINI_EMBED_MODEL")
     gemini_chat_model: str = os.getenv("GEMINI_CHAT_MODEL")
     embed_batch_size: int = int(os.getenv("EMBED_BATCH_SIZE"))
+    embed_concurrency: int = int(os.getenv("EMBED_CONCURRENCY", "4"))
+    embed_requests_per_min: float = float(os.getenv("EMBED_REQUESTS_PER_MIN", "600"))
+    embed_max_retries: int = int(os.getenv("EMBED_MAX_RETRIES", "5"))
     # Index
     index_state_path: Path = Path("vectorstore/state.json")
+    # Rewritten only when a build publishes new BM25/snapshot/partition artifacts; the API keys its caches on it
+    index_generation_path: Path = Path("vectorstore/generation")
+    index_registry_size: int = int(os.getenv("INDEX_REGISTRY_SIZE", "8"))
+    # Collections clients may name besides chroma_collection (comma-separated), and the largest top_k accepted
+    extra_collections: tuple = tuple(c.strip() for c in os.getenv("EXTRA_COLLECTIONS", "").split(",") if c.strip())
+    max_top_k: int = int(os.getenv("MAX_TOP_K", "20"))
+    # "snapshot": vector search over the memory-mapped export from build_index_llama (Chroma as fallback)
+    retrieval_mode: str = os.getenv("RETRIEVAL_MODE", "chroma")
+    # Cross-page near-duplicate sections: SimHash candidate radius in bits (-1 = off), shingle overlap
+    # needed to drop one, and the length below which sections are always kept
+    dedup_max_distance: int = int(os.getenv("DEDUP_MAX_DISTANCE", "6"))
+    dedup_min_jaccard: float = float(os.getenv("DEDUP_MIN_JACCARD", "0.9"))
+    dedup_min_chars: int = int(os.getenv("DEDUP_MIN_CHARS", "80"))
+    # Query router over the per-family partitions: partitions searched at most (0 = always search the
+    # whole collection), centroid-similarity margin for adding runner-up partitions, top_k cap when routed
+    route_max_partitions: int = int(os.getenv("ROUTE_MAX_PARTITIONS", "2"))
+    route_margin: float = float(os.getenv("ROUTE_MARGIN", "0.05"))
+    route_top_k: int = int(os.getenv("ROUTE_TOP_K", "4"))
+    embed_cache_path: Path = Path("vectorstore/embed_cache.sqlite")
     chunk_max_chars: int = int(os.getenv("CHUNK_MAX_CHARS"))
     chunk_overlap: int = int(os.getenv("CHUNK_OVERLAP"))
+    chunk_workers: int = int(os.getenv("CHUNK_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+    # Answer cache (exact + semantic hits on the standalone question)
+    answer_cache_size: int = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+    answer_cache_ttl_s: float = float(os.getenv("ANSWER_CACHE_TTL_S", "3600"))
+    answer_cache_threshold: float = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+    # Condense policy: reuse the speculative retrieval when the rewrite is this similar
+    condense_match_threshold: float = float(os.getenv("CONDENSE_MATCH_THRESHOLD", "0.85"))
+    # LLM response cache (condense + answer prompts), shared by all workers; 0 disables
+    llm_cache_path: Path = Path(os.getenv("LLM_CACHE_PATH", "cache/llm_responses.sqlite"))
+    llm_cache_size: int = int(os.getenv("LLM_CACHE_SIZE", "5000"))
+    # Precomputed FAQ answers (build_index_llama.py --faq): extra questions file and match threshold
+    faq_questions_path: Path = Path(os.getenv("FAQ_QUESTIONS_PATH", "faq_questions.txt"))
+    faq_match_threshold: float = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.92"))
+    # LLM gateway (per worker): concurrent Gemini calls, callers allowed to wait for one (beyond: 429),
+    # per-attempt timeout, overall deadline incl. queueing and retries, retries on 429/5xx/timeouts,
+    # and a hedged duplicate after this many seconds when a slot is free (0 = off)
+    llm_max_inflight: int = int(os.getenv("LLM_MAX_INFLIGHT", "16"))
+    llm_max_queue: int = int(os.getenv("LLM_MAX_QUEUE", "64"))
+    llm_timeout_s: float = float(os.getenv("LLM_TIMEOUT_S", "30"))
+    llm_deadline_s: float = float(os.getenv("LLM_DEADLINE_S", "60"))
+    llm_max_retries: int = int(os.getenv("LLM_MAX_RETRIES", "2"))
+    llm_hedge_after_s: float = float(os.getenv("LLM_HEDGE_AFTER_S", "0"))
+    # Server-side sessions (conversation ids issued by the server): condensed exchanges kept
+    # for the condense prompt, answer chars kept per exchange, chunks carried into follow-ups
+    sessions_enabled: bool = os.getenv("SESSIONS_ENABLED", "1").lower() in ("1", "true", "yes")
+    session_path: Path = Path(os.getenv("SESSION_PATH", "cache/sessions.sqlite"))
+    session_ttl_s: float = float(os.getenv("SESSION_TTL_S", "86400"))
+    session_exchanges: int = int(os.getenv("SESSION_EXCHANGES", "3"))
+    session_answer_chars: int = int(os.getenv("SESSION_ANSWER_CHARS", "300"))
+    session_carry_nodes: int = int(os.getenv("SESSION_CARRY_NODES", "2"))
+    # Prompt context: token budget for retrieved text and MMR relevance/diversity trade-off
+    context_token_budget: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+    context_mmr_lambda: float = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+    # Observability: fraction of requests to cProfile (0 = off) and where .prof files go
+    profile_sample_rate: float = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    profile_dir: Path = Path(os.getenv("PROFILE_DIR", "profiles"))
+    # Load clients + default index and run one retrieval in the background at startup (/readyz waits for it)
+    warmup_on_startup: bool = os.getenv("WARMUP_ON_STARTUP", "0").lower() in ("1", "true", "yes")
 
 settings = AppSettings()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Import backend modules the way the server does (`from rag.x import ...`), wherever pytest runs from.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
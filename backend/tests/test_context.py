@@ -0,0 +1,50 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+from rag.context import SEPARATOR, estimate_tokens, join_text, overlap_len, pack_context
+
+def hit(text, score, section=None, start=None, node_id=None):
+    node = TextNode(text=text, id_=node_id or text[:20], metadata={"section_sha1": section} if section else {})
+    node.start_char_idx = start
+    return NodeWithScore(node=node, score=score)
+
+SECTION = (
+    "Commencement takes place on the Quad at 10 a.m. Graduates should arrive by 8:30 a.m. "
+    "to line up in the Colden Center parking lot. Guests need a ticket for the seating area."
+)
+
+def test_overlapping_chunks_are_joined_once():
+    a, b = SECTION[:120], SECTION[80:]
+    assert overlap_len(a, b) == 40
+    assert join_text(a, b) == SECTION
+
+def test_chunks_of_one_section_merge_in_document_order():
+    second = hit(SECTION[80:], 0.9, section="s1", start=80, node_id="b")
+    first = hit(SECTION[:120], 0.5, section="s1", start=0, node_id="a")
+    assert pack_context([second, first], token_budget=1000) == SECTION
+
+def test_sentences_repeated_across_sections_are_dropped():
+    shared = "Visit the registrar's office for replacement diplomas and transcripts."
+    ctx = pack_context([
+        hit(f"Tickets are free. {shared}", 0.9, section="s1"),
+        hit(f"Parking is in Lot 5. {shared}", 0.8, section="s2"),
+    ], token_budget=1000)
+    assert ctx.count(shared) == 1
+    assert "Parking is in Lot 5." in ctx
+
+def test_near_duplicate_blocks_are_skipped():
+    ctx = pack_context([
+        hit("The ceremony starts at ten on the main quad, rain or shine.", 0.9, section="s1"),
+        hit("The ceremony starts at ten on the main quad, rain or shine!", 0.8, section="s2"),
+    ], token_budget=1000)
+    assert SEPARATOR not in ctx
+
+def test_context_fits_the_token_budget():
+    nodes = [hit(f"Section {i}. " + " ".join(f"word{i}x{j}" for j in range(80)), 1.0 - i / 10, section=f"s{i}") for i in range(6)]
+    for budget in (60, 200, 400):
+        assert estimate_tokens(pack_context(nodes, token_budget=budget)) <= budget
+
+def test_highest_scoring_block_comes_first():
+    ctx = pack_context([
+        hit("Diplomas are mailed to graduates within three months.", 0.2, section="s1"),
+        hit("Caps and gowns are picked up at the bookstore in May.", 0.9, section="s2"),
+    ], token_budget=1000, mmr_lambda=1.0)
+    assert ctx.startswith("Caps and gowns")
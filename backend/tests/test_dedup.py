@@ -0,0 +1,63 @@
+from rag.dedup import NearDuplicateFilter, SimHashLSH, hamming, shingle_digests, simhash
+
+FOOTER = (
+    "Queens College, 65-30 Kissena Boulevard, Flushing, NY 11367. For questions about commencement "
+    "tickets, parking and accessibility, email commencement@qc.cuny.edu or call the events office."
+)
+
+def page(url, *texts, sha="sha"):
+    return {"url": url, "content_sha1": f"{sha}-{url}", "sections": [{"title": "", "text": t} for t in texts]}
+
+def unique(n):
+    return f"Section {n} has its own facts: " + " ".join(f"detail{n}x{i}" for i in range(20))
+
+def test_simhash_is_stable_and_close_for_small_edits():
+    a = simhash(shingle_digests(FOOTER))
+    assert a == simhash(shingle_digests(FOOTER))
+    assert hamming(a, simhash(shingle_digests(FOOTER.replace("call", "phone")))) < 16
+
+def test_lsh_finds_hashes_within_distance():
+    lsh = SimHashLSH(max_distance=3)
+    lsh.add("a", 0b1011)
+    lsh.add("b", 0b1011 ^ (1 << 40) ^ (1 << 2))
+    lsh.add("c", ~0b1011 & (2**64 - 1))
+    assert lsh.candidates(0b1011) == ["a", "b"]
+    lsh.remove("a")
+    assert lsh.candidates(0b1011) == ["b"]
+
+def test_repeated_section_is_kept_on_the_first_page_only():
+    f = NearDuplicateFilter()
+    a, b = list(f.stream([page("https://x/a", unique(1), FOOTER), page("https://x/b", unique(2), FOOTER)]))
+    assert [s["text"] for s in a["sections"]] == [unique(1), FOOTER]
+    assert [s["text"] for s in b["sections"]] == [unique(2)]
+    assert f.stats.dropped == 1
+
+def test_sections_differing_in_a_fact_are_kept():
+    f = NearDuplicateFilter()
+    other = FOOTER.replace("65-30 Kissena Boulevard", "Citi Field, 41 Seaver Way")
+    out = list(f.stream([page("https://x/a", FOOTER), page("https://x/b", other)]))
+    assert [len(p["sections"]) for p in out] == [1, 1]
+
+def test_groups_keep_their_own_copy():
+    f = NearDuplicateFilter(group_fn=lambda url: url.rsplit("/", 1)[-1][0])
+    out = list(f.stream([page("https://x/a1", FOOTER), page("https://x/b1", FOOTER), page("https://x/a2", FOOTER)]))
+    assert [len(p["sections"]) for p in out] == [1, 1, 0]
+
+def test_index_key_is_stable_and_tracks_dropped_sections():
+    pages = [page("https://x/a", FOOTER), page("https://x/b", unique(2), FOOTER)]
+    first = [p["index_key"] for p in NearDuplicateFilter().stream(pages)]
+    again = [p["index_key"] for p in NearDuplicateFilter().stream(pages)]
+    assert first == again
+    assert first[0] == "sha-https://x/a"  # nothing dropped: the content hash itself
+    assert first[1] != "sha-https://x/b"
+
+    # the other copy goes away: page b keeps its footer again, so its key changes back
+    f = NearDuplicateFilter()
+    list(f.stream(pages))
+    assert f.update(None, "https://x/a") == {"https://x/b"}
+    assert f.apply(pages[1])["index_key"] == "sha-https://x/b"
+
+def test_short_sections_are_never_dropped():
+    f = NearDuplicateFilter(min_chars=80)
+    out = list(f.stream([page("https://x/a", "Tickets: 4 per graduate."), page("https://x/b", "Tickets: 4 per graduate.")]))
+    assert [len(p["sections"]) for p in out] == [1, 1]
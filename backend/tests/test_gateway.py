@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+from rag import gateway
+from rag.gateway import LLMGateway, LLMUnavailable, Overloaded
+
+class TooManyRequests(Exception):
+    code = 429
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # backoff delay is min(8, 0.5 * 2**attempt) * (0.5 + random()): zero it
+    monkeypatch.setattr(gateway.random, "random", lambda: -0.5)
+
+def flaky(failures, exc=TooManyRequests, result="ok"):
+    calls = []
+    async def fn():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise exc()
+        return result
+    return fn, calls
+
+def test_retryable_errors_are_retried():
+    fn, calls = flaky(2)
+    gw = LLMGateway(max_retries=2)
+    assert asyncio.run(gw.call(fn, "t")) == "ok"
+    assert len(calls) == 3
+
+def test_gives_up_after_max_retries():
+    fn, calls = flaky(5)
+    gw = LLMGateway(max_retries=1)
+    with pytest.raises(LLMUnavailable):
+        asyncio.run(gw.call(fn, "t"))
+    assert len(calls) == 2
+
+def test_other_errors_are_not_retried():
+    fn, calls = flaky(1, exc=ValueError)
+    with pytest.raises(ValueError):
+        asyncio.run(LLMGateway().call(fn, "t"))
+    assert len(calls) == 1
+
+def test_slow_attempt_times_out_and_retries():
+    calls = []
+    async def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+        return "ok"
+    gw = LLMGateway(timeout_s=0.05, max_retries=1)
+    assert asyncio.run(gw.call(fn, "t")) == "ok"
+    assert len(calls) == 2
+
+def test_full_queue_is_rejected():
+    gw = LLMGateway(max_inflight=1, max_queue=0)
+    async def main():
+        release = asyncio.Event()
+        async def hold():
+            await release.wait()
+            return "held"
+        first = asyncio.ensure_future(gw.call(hold, "t"))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as e:
+            gw.admit()
+        assert e.value.retry_after >= 1
+        release.set()
+        return await first
+    assert asyncio.run(main()) == "held"
+
+def test_hedged_duplicate_wins_when_primary_is_slow():
+    calls = []
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(1 if len(calls) == 1 else 0)
+        return f"call {len(calls)}"
+    gw = LLMGateway(hedge_after_s=0.02, timeout_s=2)
+    assert asyncio.run(gw.call(fn, "t")) == "call 2"
+
+def test_cancelled_attempt_counts_as_failure():
+    calls = []
+    async def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            asyncio.current_task().cancel()
+            await asyncio.sleep(1)
+        return "ok"
+    gw = LLMGateway(hedge_after_s=0.5, timeout_s=2, max_retries=1)
+    assert asyncio.run(gw.call(fn, "t")) == "ok"
+    assert len(calls) == 2
@@ -0,0 +1,54 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+from rag.lexical import BM25Index, fuse_hits, is_exact_term_query, reciprocal_rank_fusion, tokenize
+
+DOCS = {
+    "tickets": "Each graduate receives four guest tickets for the ceremony.",
+    "parking": "Guests park in Lot 5 next to the Colden Center.",
+    "gowns": "Caps and gowns are picked up at the campus bookstore.",
+    "citi": "The ceremony is held at Citi Field; parking at Citi Field is free.",
+}
+
+def index() -> BM25Index:
+    ids = list(DOCS)
+    return BM25Index(ids, [DOCS[i] for i in ids], [{"section_title": ""} for _ in ids])
+
+def vec(*ids):
+    return [NodeWithScore(node=TextNode(id_=i, text=DOCS[i]), score=1.0 - n / 10) for n, i in enumerate(ids)]
+
+def test_tokenize_drops_stopwords():
+    assert tokenize("Where do I pick up my cap and gown?") == ["where", "pick", "up", "cap", "gown"]
+
+def test_bm25_ranks_matching_chunks():
+    hits = index().search("citi field parking", 3)
+    assert hits[0][0] == "citi"
+    assert index().search("unrelated words", 3) == []
+
+def test_save_and_load_round_trip(tmp_path):
+    path = tmp_path / "bm25.json"
+    index().save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.search("bookstore", 1) == index().search("bookstore", 1)
+    assert BM25Index.load(tmp_path / "missing.json") is None
+
+def test_rrf_rewards_agreement():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "a", "d"]])
+    assert {i for i, _ in fused[:2]} == {"a", "b"}
+    assert fused[-1][0] in ("c", "d")
+
+def test_fuse_hits_merges_vector_and_bm25():
+    # vector search missed the exact-term chunk; BM25 brings it in
+    fused = fuse_hits(vec("tickets", "gowns"), index(), "citi field", top_k=3, candidates=4)
+    ids = [h.node.node_id for h in fused]
+    assert "citi" in ids and "tickets" in ids
+    assert len(ids) == 3
+    assert all(a.score >= b.score for a, b in zip(fused, fused[1:]))
+
+def test_fuse_hits_without_vector_hits_is_bm25():
+    fused = fuse_hits([], index(), "bookstore gowns", top_k=2, candidates=4)
+    assert [h.node.node_id for h in fused] == ["gowns"]
+    assert fused[0].node.text == DOCS["gowns"]
+
+def test_exact_term_queries():
+    assert is_exact_term_query('"Lot 5"')
+    assert is_exact_term_query("citi field parking")
+    assert not is_exact_term_query("where do guests park?")
@@ -0,0 +1,49 @@
+import itertools
+from rag import llm_cache
+from rag.llm_cache import LLMResponseCache
+
+def make(tmp_path, max_entries=20, ns=None):
+    ns = ns if ns is not None else {"value": "gen1"}
+    return LLMResponseCache(tmp_path / "llm.sqlite", max_entries, lambda: ns["value"]), ns
+
+def test_round_trip_per_model_and_prompt(tmp_path):
+    cache, _ = make(tmp_path)
+    cache.put("m", "prompt", "answer")
+    assert cache.get("m", "prompt") == "answer"
+    assert cache.get("other-model", "prompt") is None
+    assert cache.get("m", "prompt2") is None
+
+def test_shared_between_instances(tmp_path):
+    a, ns = make(tmp_path)
+    b, _ = make(tmp_path, ns=ns)
+    a.put("m", "p", "from a")
+    assert b.get("m", "p") == "from a"
+
+def test_new_namespace_drops_old_entries(tmp_path):
+    cache, ns = make(tmp_path)
+    cache.put("m", "p", "old index")
+    ns["value"] = "gen2"
+    assert cache.get("m", "p") is None
+    cache.put("m", "q", "new index")
+    assert cache.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 1
+
+def test_least_recently_used_are_evicted(tmp_path, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(llm_cache.time, "time", lambda: float(next(clock)))
+    cache, _ = make(tmp_path, max_entries=20)
+    for i in range(20):
+        cache.put("m", f"p{i}", f"a{i}")
+    assert cache.get("m", "p0") == "a0"  # recently used: survives the trim
+    for i in range(20, 30):
+        cache.put("m", f"p{i}", f"a{i}")
+    count = cache.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    assert count <= 20
+    assert cache.get("m", "p0") == "a0"
+    assert cache.get("m", "p1") is None
+    assert cache.get("m", "p29") == "a29"
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache, _ = make(tmp_path, max_entries=0)
+    cache.put("m", "p", "a")
+    assert not cache.enabled
+    assert cache.get("m", "p") is None
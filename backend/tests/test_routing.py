@@ -0,0 +1,49 @@
+import re
+from llama_index.core.schema import NodeWithScore, TextNode
+from rag.routing import QueryRouter, merge_hits, page_family
+
+PARTITIONS = {
+    "guests": {"collection": "c__guests", "chunks": 10, "centroid": [1.0, 0.0, 0.0]},
+    "directions": {"collection": "c__directions", "chunks": 10, "centroid": [0.0, 1.0, 0.0]},
+    "general": {"collection": "c__general", "chunks": 10, "centroid": [0.0, 0.0, 1.0]},
+    "empty": {"collection": "c__empty", "chunks": 0, "centroid": [1.0, 1.0, 0.0]},
+}
+
+def router(**kw):
+    return QueryRouter(PARTITIONS, keywords={"directions": re.compile(r"\bpark", re.I)}, **kw)
+
+def test_page_family():
+    families = {"guests": ["/guests"], "directions": ["/directions", "/parking"]}
+    assert page_family("https://x/ce/parking/", families, "general") == "directions"
+    assert page_family("https://x/ce/about/", families, "general") == "general"
+
+def test_keyword_rule_routes_first():
+    assert router().route("Where do I park?") == ["directions"]
+
+def test_embedding_routes_to_the_nearest_partition():
+    assert router().route("How many tickets?", [0.9, 0.1, 0.0]) == ["guests"]
+
+def test_partitions_within_the_margin_are_added():
+    embedding = [0.70, 0.68, 0.0]
+    assert router(margin=0.05).route("?", embedding) == ["guests", "directions"]
+    assert router(margin=0.01).route("?", embedding) == ["guests"]
+
+def test_no_confident_route_searches_everything():
+    assert router(max_partitions=3, margin=1.0).route("?", [0.5, 0.5, 0.5]) == []  # every live partition
+    assert router(max_partitions=0).route("Where do I park?") == []
+    assert router().route("?", [1.0, 0.0]) == []  # wrong dimension: no embedding route
+    assert router().collections_for(["guests"]) == ["c__guests"]
+    assert len(router()) == 3  # empty partitions are never routed to
+
+def hits(*pairs):
+    return [NodeWithScore(node=TextNode(id_=i, text=i), score=s) for i, s in pairs]
+
+def test_merge_hits_uses_ranks_not_raw_scores():
+    # partition scores are not comparable: a's BM25-heavy scores must not crowd out b's top hit
+    merged = merge_hits([hits(("a1", 9.0), ("a2", 8.0)), hits(("b1", 0.03), ("b2", 0.02))], top_k=2)
+    assert {h.node.node_id for h in merged} == {"a1", "b1"}
+
+def test_merge_hits_rewards_chunks_found_twice():
+    merged = merge_hits([hits(("x", 0.5), ("shared", 0.4)), hits(("y", 0.5), ("shared", 0.4))], top_k=3)
+    assert merged[0].node.node_id == "shared"
+    assert len(merged) == 3
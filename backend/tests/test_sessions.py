@@ -0,0 +1,55 @@
+import threading
+from rag import sessions
+from rag.sessions import Session, SessionStore
+
+def record(question, answer="ok"):
+    def apply(s):
+        s = s or Session(conversation_id="c")
+        s.add_exchange(question, answer, max_exchanges=3, answer_chars=10)
+        return s
+    return apply
+
+def test_exchanges_are_rolled_and_abridged():
+    s = Session(conversation_id="c")
+    for i in range(5):
+        s.add_exchange(f"q{i}", "a very   long answer text", max_exchanges=3, answer_chars=10)
+    assert [q for q, _ in s.exchanges] == ["q2", "q3", "q4"]
+    assert s.exchanges[-1][1] == "a very lon…"
+    assert s.turns == 5
+
+def test_update_creates_and_persists(tmp_path):
+    store = SessionStore(tmp_path / "s.sqlite")
+    assert store.get("c") is None
+    store.update("c", record("first"))
+    store.update("c", record("second"))
+    other = SessionStore(tmp_path / "s.sqlite")  # another worker
+    assert [q for q, _ in other.get("c").exchanges] == ["first", "second"]
+
+def test_concurrent_updates_are_not_lost(tmp_path):
+    paths = tmp_path / "s.sqlite"
+    stores = [SessionStore(paths), SessionStore(paths)]
+    def bump(s):
+        s = s or Session(conversation_id="c")
+        s.turns += 1
+        return s
+    threads = [threading.Thread(target=lambda st=st: [st.update("c", bump) for _ in range(25)]) for st in stores * 2]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert stores[0].get("c").turns == 100
+
+def test_idle_sessions_expire(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sessions.time, "time", lambda: now[0])
+    store = SessionStore(tmp_path / "s.sqlite", ttl_s=60)
+    store.update("c", record("q"))
+    now[0] += 61
+    assert store.get("c") is None
+    # an expired session is started afresh, not continued
+    assert store.update("c", record("again")).turns == 1
+
+def test_disabled_store(tmp_path):
+    store = SessionStore(tmp_path / "s.sqlite", enabled=False)
+    assert store.update("c", record("q")) is None
+    assert store.get("c") is None
@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+from rag.singleflight import SingleFlight
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+    async def main():
+        sf = SingleFlight()
+        results = await asyncio.gather(*(sf.do("q", work) for _ in range(5)))
+        return results, len(sf)
+    results, left = asyncio.run(main())
+    assert results == ["answer"] * 5
+    assert calls == [1]
+    assert left == 0
+
+def test_different_keys_run_separately():
+    async def main():
+        sf = SingleFlight()
+        return await asyncio.gather(sf.do("a", lambda: asyncio.sleep(0, "a")), sf.do("b", lambda: asyncio.sleep(0, "b")))
+    assert asyncio.run(main()) == ["a", "b"]
+
+def test_finished_key_runs_again():
+    calls = []
+    async def work():
+        calls.append(1)
+        return len(calls)
+    async def main():
+        sf = SingleFlight()
+        return await sf.do("q", work), await sf.do("q", work)
+    assert asyncio.run(main()) == (1, 2)
+
+def test_error_reaches_every_waiter():
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream")
+    async def main():
+        sf = SingleFlight()
+        return await asyncio.gather(sf.do("q", boom), sf.do("q", boom), return_exceptions=True), len(sf)
+    results, left = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert left == 0
+
+def test_cancelled_caller_does_not_cancel_shared_work():
+    async def work():
+        await asyncio.sleep(0.02)
+        return "done"
+    async def main():
+        sf = SingleFlight()
+        first = asyncio.ensure_future(sf.do("q", work))
+        second = asyncio.ensure_future(sf.do("q", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+    assert asyncio.run(main()) == "done"